@@ -0,0 +1,317 @@
+"""
+Offline stand-ins for Cobalt and Discord, used by the benchmarks.
+
+FakeCobalt is a real local HTTP server, so the bot's aiohttp session, Cobalt
+pool and download code run unchanged against it. FakeDiscord provides just
+enough of the guild, channel, message and attachment objects that
+BoomerBoxBot touches, with a configurable API latency and a log of every
+request made.
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import discord
+from aiohttp import web
+
+COBALT_MODES = ("redirect", "tunnel", "picker", "error")
+
+
+class FakeCobalt:
+    """
+    Local Cobalt API that answers every request with the configured response type,
+    after ``latency`` seconds, and serves ``payload_size`` bytes of media per item.
+    ``error_rate`` turns that fraction of answers into retryable errors instead.
+    """
+
+    def __init__(self, mode: str = "redirect", latency: float = 0.05, media_latency: float = 0.0,
+                 payload_size: int = 1024 * 1024, picker_items: int = 10, error_rate: float = 0.0,
+                 content_type: str = "video/mp4"):
+        if mode not in COBALT_MODES:
+            raise ValueError(f"mode must be one of {', '.join(COBALT_MODES)}")
+        self.mode = mode
+        self.latency = latency
+        self.media_latency = media_latency
+        self.picker_items = picker_items
+        self.error_rate = error_rate
+        self.content_type = content_type
+        self.payload = os.urandom(payload_size)
+        self.requests = Counter()
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/", self._api)
+        app.router.add_get("/", self._info)
+        app.router.add_get("/media/{name}", self._media)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _info(self, request: web.Request) -> web.Response:
+        return web.json_response({"cobalt": {"version": "fake"}})
+
+    async def _api(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        media_id = abs(hash(body.get("url", ""))) % 10 ** 8
+
+        if self.mode == "error" or random.random() < self.error_rate:
+            self.requests["error"] += 1
+            return web.json_response({"status": "error", "error": {"code": "error.api.fetch.fail"}}, status=400)
+
+        self.requests[self.mode] += 1
+        if self.mode == "picker":
+            return web.json_response({"status": "picker", "picker": [
+                {"type": "video", "url": f"{self.url}media/{media_id}-{item}.mp4"}
+                for item in range(self.picker_items)
+            ]})
+        return web.json_response({"status": self.mode, "url": f"{self.url}media/{media_id}.mp4",
+                                  "filename": f"{media_id}.mp4"})
+
+    async def _media(self, request: web.Request) -> web.StreamResponse:
+        self.requests["media"] += 1
+        await asyncio.sleep(self.media_latency)
+        response = web.StreamResponse(headers={"Content-Type": self.content_type,
+                                               "Content-Length": str(len(self.payload))})
+        await response.prepare(request)
+        view = memoryview(self.payload)
+        for start in range(0, len(view), 64 * 1024):
+            await response.write(view[start:start + 64 * 1024])
+        await response.write_eof()
+        return response
+
+
+# Snowflakes carry their creation time in the top bits, which sharding relies on
+_snowflakes = itertools.count((int(time.time() * 1000) - 1420070400000) << 22)
+
+
+def snowflake() -> int:
+    return next(_snowflakes) + random.randrange(1 << 22)
+
+
+class FakeUser:
+    def __init__(self, name: str = "user", bot: bool = False):
+        self.id = snowflake()
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.display_avatar = SimpleNamespace(url=f"https://cdn.example/avatars/{self.id}.png")
+
+    def __str__(self):
+        return self.name
+
+
+class FakeAttachment:
+    def __init__(self, size: int, filename: str = "image.png", content_type: str = "image/png"):
+        self.id = snowflake()
+        self.size = size
+        self.filename = filename
+        self.content_type = content_type
+        self.url = f"https://cdn.example/attachments/{self.id}/{filename}"
+
+    async def read(self) -> bytes:
+        return bytes(self.size)
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", author: FakeUser, content: str = "",
+                 attachments: Optional[List[FakeAttachment]] = None):
+        self.id = snowflake()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.embeds: List[discord.Embed] = []
+        self.created_at = datetime.now(timezone.utc)
+        self.jump_url = f"https://discord.com/channels/{self.guild.id}/{channel.id}/{self.id}"
+        self.deleted_at: Optional[float] = None
+
+    async def edit(self, **kwargs):
+        await self.channel.discord.request("edit")
+        if "content" in kwargs:
+            self.content = kwargs["content"]
+
+    async def delete(self, delay: Optional[float] = None):
+        if delay:
+            await asyncio.sleep(delay)
+        await self.channel.discord.request("delete")
+        self.deleted_at = time.monotonic()
+        self.channel.messages.pop(self.id, None)
+        for listener in self.channel.discord.delete_listeners:
+            listener(self)
+
+
+class FakeChannel:
+    def __init__(self, discord_fake: "FakeDiscord", guild: "FakeGuild", name: str):
+        self.id = snowflake()
+        self.discord = discord_fake
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.messages: Dict[int, FakeMessage] = {}
+
+    def add_message(self, author: FakeUser, content: str = "",
+                    attachments: Optional[List[FakeAttachment]] = None) -> FakeMessage:
+        message = FakeMessage(self, author, content, attachments)
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None,
+                   file: Optional[discord.File] = None, files: Optional[List[discord.File]] = None,
+                   delete_after: Optional[float] = None, **kwargs) -> FakeMessage:
+        files = ([file] if file else []) + (files or [])
+        # "Upload" the files the way the library would: read them to the end, then close them
+        attachments = []
+        for f in files:
+            size = 0
+            try:
+                while chunk := f.fp.read(64 * 1024):
+                    size += len(chunk)
+            finally:
+                f.close()
+            attachments.append(FakeAttachment(size, f.filename, "application/octet-stream"))
+        self.discord.uploaded_bytes += sum(a.size for a in attachments)
+
+        await self.discord.request("send")
+        message = self.add_message(self.discord.bot_user, content or "", attachments)
+        if embed:
+            message.embeds.append(embed)
+        if delete_after is not None:
+            asyncio.create_task(message.delete(delay=delete_after))
+        return message
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.discord.request("fetch_message")
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+        return message
+
+    async def history(self, limit: Optional[int] = None, oldest_first: bool = False):
+        messages = sorted(self.messages.values(), key=lambda m: m.id, reverse=not oldest_first)
+        for message in messages[:limit]:
+            yield message
+
+
+class FakeGuild:
+    def __init__(self, discord_fake: "FakeDiscord", filesize_limit: int):
+        self.id = snowflake()
+        self.discord = discord_fake
+        self.filesize_limit = filesize_limit
+        self.shard_id = 0
+        self.channels: List[FakeChannel] = []
+
+    def add_channel(self, name: str) -> FakeChannel:
+        channel = FakeChannel(self.discord, self, name)
+        self.channels.append(channel)
+        self.discord.channels[channel.id] = channel
+        return channel
+
+
+class FakeDiscord:
+    """Guilds and channels the bot can see, plus a count of the API calls it made."""
+
+    def __init__(self, api_latency: float = 0.02):
+        self.api_latency = api_latency
+        self.bot_user = FakeUser("BoomerBox", bot=True)
+        self.guilds: List[FakeGuild] = []
+        self.channels: Dict[int, FakeChannel] = {}
+        self.requests = Counter()
+        self.uploaded_bytes = 0
+        self.delete_listeners: List[Callable[[FakeMessage], Any]] = []
+
+    async def request(self, kind: str):
+        self.requests[kind] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    def add_guild(self, filesize_limit: int = 25 * 1024 * 1024) -> FakeGuild:
+        guild = FakeGuild(self, filesize_limit)
+        self.guilds.append(guild)
+        return guild
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+
+# --- Gateway payloads, for replaying traffic through the library's own parsers ---
+
+def user_payload(user_id: int, name: str = "user", bot: bool = False) -> Dict[str, Any]:
+    return {"id": str(user_id), "username": name, "global_name": name, "discriminator": "0",
+            "avatar": "a" * 32, "bot": bot}
+
+
+def guild_payload(guild_id: int, channel_ids: List[int], bot_user_id: int, roles: int = 10,
+                  emojis: int = 20) -> Dict[str, Any]:
+    """A GUILD_CREATE as a bot without the members intent receives it."""
+    return {
+        "id": str(guild_id), "name": f"guild {guild_id}", "icon": None, "owner_id": str(snowflake()),
+        "afk_timeout": 300, "verification_level": 1, "default_message_notifications": 1,
+        "explicit_content_filter": 2, "mfa_level": 0, "features": ["COMMUNITY"], "premium_tier": 1,
+        "preferred_locale": "en-US", "member_count": 1000, "large": True, "unavailable": False,
+        "roles": [{"id": str(guild_id if idx == 0 else snowflake()), "name": f"role {idx}", "color": 0,
+                   "colors": {"primary_color": 0}, "hoist": False, "position": idx, "permissions": "104324673",
+                   "managed": False, "mentionable": False} for idx in range(roles)],
+        "emojis": [{"id": str(snowflake()), "name": f"emoji{idx}", "roles": [], "require_colons": True,
+                    "managed": False, "animated": False, "available": True} for idx in range(emojis)],
+        "stickers": [],
+        "channels": [{"id": str(channel_id), "type": 0, "name": f"channel-{idx}", "position": idx,
+                      "permission_overwrites": [], "nsfw": False, "topic": None, "last_message_id": None,
+                      "rate_limit_per_user": 0, "parent_id": None}
+                     for idx, channel_id in enumerate(channel_ids)],
+        "threads": [],
+        "members": [{"user": user_payload(bot_user_id, "BoomerBox", bot=True), "roles": [],
+                     "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False}],
+        "voice_states": [], "presences": [], "stage_instances": [], "guild_scheduled_events": [],
+    }
+
+
+def message_payload(guild_id: int, channel_id: int, author_id: int, content: str,
+                    attachment_size: int = 0) -> Dict[str, Any]:
+    """A MESSAGE_CREATE from a guild member."""
+    message_id = snowflake()
+    attachments = [{"id": str(snowflake()), "filename": "image.png", "size": attachment_size,
+                    "url": f"https://cdn.example/attachments/{message_id}/image.png",
+                    "proxy_url": f"https://media.example/attachments/{message_id}/image.png",
+                    "content_type": "image/png", "width": 1080, "height": 1080}] if attachment_size else []
+    return {
+        "id": str(message_id), "channel_id": str(channel_id), "guild_id": str(guild_id), "type": 0,
+        "content": content, "author": user_payload(author_id, f"user{author_id % 10000}"),
+        "member": {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False},
+        "attachments": attachments, "embeds": [], "mentions": [], "mention_roles": [], "pinned": False,
+        "mention_everyone": False, "tts": False, "timestamp": datetime.now(timezone.utc).isoformat(),
+        "edited_timestamp": None, "flags": 0, "components": [],
+    }
+
+
+def typing_payload(guild_id: int, channel_id: int, user_id: int) -> Dict[str, Any]:
+    return {"guild_id": str(guild_id), "channel_id": str(channel_id), "user_id": str(user_id),
+            "timestamp": int(time.time()),
+            "member": {"user": user_payload(user_id, f"user{user_id % 10000}"), "roles": [],
+                       "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False}}
+
+
+def reaction_payload(guild_id: int, channel_id: int, message_id: int, user_id: int) -> Dict[str, Any]:
+    return {"guild_id": str(guild_id), "channel_id": str(channel_id), "message_id": str(message_id),
+            "user_id": str(user_id), "emoji": {"id": None, "name": "🔥"}, "type": 0, "burst": False,
+            "member": {"user": user_payload(user_id, f"user{user_id % 10000}"), "roles": [],
+                       "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False}}
@@ -0,0 +1,462 @@
+"""
+Offline benchmarks for BoomerBoxBot, run against a local fake Cobalt server and
+in-memory fake Discord objects.
+
+    python benchmarks/run.py                          # every scenario
+    python benchmarks/run.py burst carousel           # just these
+    python benchmarks/run.py --output results.jsonl   # append results, tagged with the git commit
+    python benchmarks/run.py --compare results.jsonl  # show the change since the last saved run
+
+Each scenario runs in a fresh process, so the peak RSS reported is its own.
+Settings from .env (worker counts, budgets, ...) apply unless overridden in the
+environment.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import FakeCobalt, FakeDiscord, FakeUser, snowflake  # noqa: E402
+
+
+# --- Scenarios ---
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def configure_guilds(bot, discord_fake: FakeDiscord, count: int) -> List[Any]:
+    """Add ``count`` guilds, each with a configured submission and showcase channel."""
+    submission_channels = []
+    for _ in range(count):
+        guild = discord_fake.add_guild()
+        submissions = guild.add_channel("submissions")
+        showcase = guild.add_channel("showcase")
+        bot.get_guild_config(guild.id).update(submission_channel_id=submissions.id, showcase_channel_id=showcase.id)
+        submission_channels.append(submissions)
+    return submission_channels
+
+
+async def wait_for_ingest(bot, timeout: float):
+    """Wait until every queued link has been processed."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = bot.ingest_queue.stats()
+        if stats["depth"] == 0 and stats["active"] == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"links still being processed after {timeout:.0f}s")
+
+
+async def ingest_links(bot, discord_fake: FakeDiscord, options: argparse.Namespace) -> Dict[str, Any]:
+    """Post ``links`` Instagram links across the guilds at once and time each until its original is deleted."""
+    channels = configure_guilds(bot, discord_fake, options.guilds)
+    user = FakeUser()
+    posted_at: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    def on_delete(message):
+        if message.id in posted_at:
+            latencies.append(message.deleted_at - posted_at.pop(message.id))
+    discord_fake.delete_listeners.append(on_delete)
+
+    started = time.monotonic()
+    for idx in range(options.links):
+        message = channels[idx % len(channels)].add_message(user, f"https://www.instagram.com/p/BENCH{idx:06d}/")
+        posted_at[message.id] = time.monotonic()
+        await bot.on_message(message)
+    await wait_for_ingest(bot, options.timeout)
+    wall = time.monotonic() - started
+
+    return {
+        "items": options.links,
+        "completed": len(latencies),
+        "rejected": bot.ingest_queue.stats()["rejected"],
+        "wall_s": wall,
+        "throughput_per_s": len(latencies) / wall if wall else 0.0,
+        "p50_ms": (percentile(latencies, 0.5) or 0) * 1000,
+        "p99_ms": (percentile(latencies, 0.99) or 0) * 1000,
+    }
+
+
+async def burst(bot, discord_fake: FakeDiscord, cobalt: FakeCobalt, options: argparse.Namespace) -> Dict[str, Any]:
+    """A burst of single-item links arriving at once."""
+    return await ingest_links(bot, discord_fake, options)
+
+
+async def carousel(bot, discord_fake: FakeDiscord, cobalt: FakeCobalt, options: argparse.Namespace) -> Dict[str, Any]:
+    """Carousel links, each with ``carousel_items`` items to download and post."""
+    return await ingest_links(bot, discord_fake, options)
+
+
+async def noon(bot, discord_fake: FakeDiscord, cobalt: FakeCobalt, options: argparse.Namespace) -> Dict[str, Any]:
+    """Every guild's showcase falling due at the same moment."""
+    channels = configure_guilds(bot, discord_fake, options.guilds)
+    user = FakeUser()
+    from fakes import FakeAttachment
+    for channel in channels:
+        messages = [channel.add_message(user, f"submission {idx}",
+                                        [FakeAttachment(options.payload_kb * 1024)])
+                    for idx in range(options.submissions)]
+        await bot.submission_store.add_many(messages)
+
+    guild_ids = [channel.guild.id for channel in channels]
+    if options.prestage:
+        await bot.run_due_stagings([(guild_id, time.time()) for guild_id in guild_ids])
+
+    started = time.monotonic()
+    scheduled = time.time()
+    await bot.run_due_showcases([(guild_id, scheduled) for guild_id in guild_ids])
+    wall = time.monotonic() - started
+
+    latenesses = [bot.showcase_timings[guild_id]["lateness"] for guild_id in guild_ids
+                  if bot.showcase_timings.get(guild_id, {}).get("lateness") is not None]
+    return {
+        "items": len(guild_ids),
+        "completed": len(latenesses),
+        "wall_s": wall,
+        "throughput_per_s": len(latenesses) / wall if wall else 0.0,
+        "p50_ms": (percentile(latenesses, 0.5) or 0) * 1000,
+        "p99_ms": (percentile(latenesses, 0.99) or 0) * 1000,
+    }
+
+
+def message_corpus(count: int, seed: int = 1) -> List[str]:
+    """Chat-like messages: mostly plain text, some with unrelated URLs, some with supported links."""
+    rng = random.Random(seed)
+    words = ("lol", "this", "is", "so", "good", "look", "at", "that", "cat", "honestly", "wild", "🔥", "same",
+             "what", "the", "dog", "doing", "no", "way", "bro")
+    other_urls = ("https://example.com/article/{n}", "https://github.com/user/repo/issues/{n}",
+                  "https://tenor.com/view/funny-gif-{n}", "https://www.youtube.com/watch?v=abcdefgh{n:03d}")
+    links = ("https://www.instagram.com/reel/C{n:09d}/", "https://www.tiktok.com/@user/video/7{n:018d}",
+             "https://youtube.com/shorts/a{n:010d}", "https://www.reddit.com/r/pics/comments/x{n}/title/",
+             "https://x.com/someone/status/1{n:017d}", "https://vm.tiktok.com/ZM{n}/")
+    corpus = []
+    for n in range(count):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(2, 30)))
+        roll = rng.random()
+        if roll < 0.1:
+            text += " " + rng.choice(links).format(n=n)
+        elif roll < 0.2:
+            text += " " + rng.choice(other_urls).format(n=n % 1000)
+        corpus.append(text)
+    return corpus
+
+
+async def links(bot, discord_fake: FakeDiscord, cobalt: FakeCobalt, options: argparse.Namespace) -> Dict[str, Any]:
+    """Link matching over a large message corpus, against one regex per platform as a baseline."""
+    import main
+    corpus = message_corpus(options.messages)
+    batch = 1000
+
+    def timed_batches(find) -> Tuple[float, List[float], int]:
+        found, batch_times = 0, []
+        started = time.perf_counter()
+        for start in range(0, len(corpus), batch):
+            batch_started = time.perf_counter()
+            for text in corpus[start:start + batch]:
+                found += len(find(text))
+            batch_times.append((time.perf_counter() - batch_started) / batch)
+        return time.perf_counter() - started, batch_times, found
+
+    per_platform = [re.compile(r"https?://(?:www\.|m\.|mobile\.)?" + re.escape(host) + pattern, re.IGNORECASE)
+                    for extractor in main.DEFAULT_LINK_EXTRACTORS
+                    for host in extractor.hosts for pattern in extractor.patterns]
+
+    def find_per_platform(text: str) -> List[str]:
+        return [match.group(0) for pattern in per_platform for match in pattern.finditer(text)]
+
+    baseline_wall, _, _ = timed_batches(find_per_platform)
+    wall, batch_times, found = timed_batches(bot.link_matcher.find)
+    return {
+        "items": len(corpus),
+        "completed": len(corpus),
+        "links_found": found,
+        "wall_s": wall,
+        "throughput_per_s": len(corpus) / wall,
+        "p50_ms": percentile(batch_times, 0.5) * 1000,
+        "p99_ms": percentile(batch_times, 0.99) * 1000,
+        "per_platform_regex_throughput_per_s": len(corpus) / baseline_wall,
+        "notes": [f"one regex per platform: {len(corpus) / baseline_wall:.1f}/s"],
+    }
+
+
+async def gateway(bot, discord_fake: FakeDiscord, cobalt: FakeCobalt, options: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Busy guilds' traffic replayed through the library's gateway parsers, as Discord would
+    send it for the bot's intents; run with and without LEAN_GATEWAY to compare memory.
+    """
+    import main
+    from fakes import guild_payload, message_payload, reaction_payload, typing_payload
+    rng = random.Random(1)
+    parsers = bot._connection.parsers
+    bot_user_id = snowflake()
+
+    guilds = []
+    for _ in range(options.guilds):
+        guild_id, channel_ids = snowflake(), [snowflake() for _ in range(20)]
+        parsers["GUILD_CREATE"](guild_payload(guild_id, channel_ids, bot_user_id))
+        # The first channel is the submission channel
+        bot.get_guild_config(guild_id)["submission_channel_id"] = channel_ids[0]
+        guilds.append((guild_id, channel_ids))
+    bot.refresh_watched_channels()
+    authors = [snowflake() for _ in range(5000)]
+
+    async def drain():
+        pending = [task for task in asyncio.all_tasks() if task.get_name().startswith("pycord:")]
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    await drain()
+    rss_before = main.current_rss_bytes()
+    events, batch_times = 0, []
+    started = time.perf_counter()
+    for start in range(0, options.messages, 1000):
+        batch_started, batch_events = time.perf_counter(), 0
+        for _ in range(min(1000, options.messages - start)):
+            guild_id, channel_ids = rng.choice(guilds)
+            author = rng.choice(authors)
+            if rng.random() < 0.05:
+                # Submissions with an attachment, so nothing is deleted
+                channel_id, payload = channel_ids[0], message_payload(guild_id, channel_ids[0], author, "", 500_000)
+            else:
+                channel_id = rng.choice(channel_ids[1:])
+                payload = message_payload(guild_id, channel_id, author, " ".join(["chatting"] * rng.randint(1, 40)))
+            # Discord only sends the events the bot has the intents for
+            if bot.intents.guild_typing:
+                parsers["TYPING_START"](typing_payload(guild_id, channel_id, author))
+                batch_events += 1
+            parsers["MESSAGE_CREATE"](payload)
+            batch_events += 1
+            if bot.intents.guild_reactions and rng.random() < 0.5:
+                parsers["MESSAGE_REACTION_ADD"](reaction_payload(guild_id, channel_id, int(payload["id"]),
+                                                                 rng.choice(authors)))
+                batch_events += 1
+        await drain()
+        events += batch_events
+        batch_times.append((time.perf_counter() - batch_started) / batch_events)
+    wall = time.perf_counter() - started
+
+    rss_after = main.current_rss_bytes()
+    caches = bot.cache_report()
+    return {
+        "items": events,
+        "completed": events,
+        "wall_s": wall,
+        "throughput_per_s": events / wall,
+        "p50_ms": percentile(batch_times, 0.5) * 1000,
+        "p99_ms": percentile(batch_times, 0.99) * 1000,
+        "rss_growth_mb": (rss_after - rss_before) / 1024 / 1024 if rss_before and rss_after else None,
+        "caches": caches,
+        "notes": [f"{'lean' if bot.lean_gateway else 'default'} mode: {caches['messages']} cached message(s), "
+                  f"{caches['users']} user(s), {caches['members']} member(s), "
+                  f"{caches['dropped_events']} event(s) dropped early"
+                  + (f", RSS grew {(rss_after - rss_before) / 1024 / 1024:.0f} MB while replaying"
+                     if rss_before and rss_after else "")],
+    }
+
+
+SCENARIOS = {
+    "burst": (burst, {"links": 100, "guilds": 10, "cobalt_mode": "redirect"}),
+    "carousel": (carousel, {"links": 20, "guilds": 5, "cobalt_mode": "picker", "payload_kb": 512}),
+    "noon": (noon, {"guilds": 500, "submissions": 20, "payload_kb": 256}),
+    "links": (links, {"messages": 200000}),
+    "gateway": (gateway, {"guilds": 300, "messages": 100000, "lean": False}),
+    "gateway_lean": (gateway, {"guilds": 300, "messages": 100000, "lean": True}),
+}
+
+
+# --- Running a scenario (in its own process) ---
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def no_commands(message):
+    pass
+
+
+async def run_scenario(name: str, options: argparse.Namespace) -> Dict[str, Any]:
+    workdir = Path(tempfile.mkdtemp(prefix="boomerbox-bench-"))
+    os.chdir(workdir)
+    for key, value in {
+        "CONFIG_DB_PATH": workdir / "guild_configs.db",
+        "SUBMISSION_DB_PATH": workdir / "submissions.db",
+        "INGEST_JOURNAL_PATH": workdir / "ingest_jobs.db",
+        "MEDIA_CACHE_DIR": workdir / "media_cache",
+        "SHOWCASE_STAGING_DIR": workdir / "showcase_staging",
+        "COBALT_API_URL": "http://127.0.0.1:9/",  # Replaced by the fake below
+        "DISCORD_CHANNEL_RATE": "1000",  # Measure the bot, not our own rate limiter
+        "LOG_LEVEL": "WARNING",
+        "DUPLICATE_DETECTION": "false",  # Hashing would try to fetch the fake attachments
+    }.items():
+        os.environ.setdefault(key, str(value))
+    if options.lean is not None:
+        os.environ["LEAN_GATEWAY"] = "true" if options.lean else "false"
+
+    import main
+    main.setup_logging()
+
+    cobalt = FakeCobalt(mode=options.cobalt_mode, latency=options.cobalt_latency,
+                        payload_size=options.payload_kb * 1024, picker_items=options.carousel_items,
+                        error_rate=options.error_rate)
+    await cobalt.start()
+    discord_fake = FakeDiscord(api_latency=options.discord_latency)
+
+    bot = main.BoomerBoxBot()
+    bot.cobalt_pool = main.CobaltPool([main.CobaltBackend(name="fake", url=cobalt.url)], health_interval=0)
+    bot.get_channel = discord_fake.get_channel
+    bot.process_commands = no_commands  # Prefix commands need a real connection state
+    await bot.start_services()
+
+    scenario, _ = SCENARIOS[name]
+    try:
+        result = await scenario(bot, discord_fake, cobalt, options)
+    finally:
+        await bot.stop_services()
+        await cobalt.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result.update({
+        "peak_rss_mb": peak_rss_mb(),
+        "discord_requests": dict(discord_fake.requests),
+        "cobalt_requests": dict(cobalt.requests),
+    })
+    return result
+
+
+# --- Command line ---
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def scenario_options(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """The scenario's defaults, overridden by anything given on the command line."""
+    _, defaults = SCENARIOS[name]
+    options = {key: value for key, value in vars(args).items()
+               if key not in ("scenarios", "output", "compare", "child")}
+    for key, value in defaults.items():
+        if options.get(key) is None:
+            options[key] = value
+    for key, value in PARSER_DEFAULTS.items():
+        if options.get(key) is None:
+            options[key] = value
+    return options
+
+
+def run_in_child(name: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    process = subprocess.run([sys.executable, __file__, "--child", name, "--options", json.dumps(options)],
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"scenario {name} failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def format_row(result: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> str:
+    def change(key: str) -> str:
+        if not previous or not previous.get(key) or result.get(key) is None:
+            return ""
+        return f" ({(result[key] - previous[key]) / previous[key] * 100:+.0f}%)"
+
+    def ms(key: str) -> str:
+        return f"{result[key]:.0f}" if result[key] >= 10 else f"{result[key]:.3g}"
+
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result.get("peak_rss_mb") is not None else "n/a"
+    row = (f"{result['scenario']:<12} {result['completed']}/{result['items']} done in {result['wall_s']:.2f}s  "
+           f"{result['throughput_per_s']:.1f}/s{change('throughput_per_s')}  "
+           f"p50 {ms('p50_ms')} ms{change('p50_ms')}  p99 {ms('p99_ms')} ms{change('p99_ms')}  "
+           f"peak RSS {rss}{change('peak_rss_mb')}")
+    for note in result.get("notes", []):
+        row += f"\n{'':<12} {note}"
+    return row
+
+
+def load_previous(path: Path) -> Dict[str, Dict[str, Any]]:
+    """The last saved result for each scenario."""
+    previous = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            if line.strip():
+                result = json.loads(line)
+                previous[result["scenario"]] = result
+    return previous
+
+
+PARSER_DEFAULTS = {
+    "links": 100, "guilds": 10, "messages": 200000, "submissions": 20, "payload_kb": 1024, "carousel_items": 10,
+    "cobalt_mode": "redirect", "cobalt_latency": 0.05, "discord_latency": 0.02, "error_rate": 0.0,
+    "prestage": False, "lean": None, "timeout": 300.0,
+}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline BoomerBoxBot benchmarks")
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + list(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument("--links", type=int, help="links to post (burst, carousel)")
+    parser.add_argument("--guilds", type=int, help="guilds to spread the work over")
+    parser.add_argument("--messages", type=int, help="messages to scan (links)")
+    parser.add_argument("--submissions", type=int, help="submissions per guild (noon)")
+    parser.add_argument("--payload-kb", type=int, help="size of each media file")
+    parser.add_argument("--carousel-items", type=int, help="items per carousel")
+    parser.add_argument("--cobalt-mode", choices=["redirect", "tunnel", "picker", "error"], help="Cobalt response type")
+    parser.add_argument("--cobalt-latency", type=float, help="seconds Cobalt takes to answer")
+    parser.add_argument("--discord-latency", type=float, help="seconds each Discord API call takes")
+    parser.add_argument("--error-rate", type=float, help="fraction of Cobalt requests that fail")
+    parser.add_argument("--prestage", action="store_true", default=None, help="stage showcases before the slot (noon)")
+    parser.add_argument("--timeout", type=float, help="give up on a scenario after this many seconds")
+    parser.add_argument("--output", type=Path, help="append results to this JSON lines file")
+    parser.add_argument("--compare", type=Path, help="compare against the last results saved in this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--options", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        options = argparse.Namespace(**json.loads(args.options))
+        result = asyncio.run(run_scenario(args.child, options))
+        print(json.dumps(result))
+        return
+
+    previous = load_previous(args.compare) if args.compare else {}
+    commit = git_commit()
+    for name in args.scenarios or list(SCENARIOS):
+        options = scenario_options(name, args)
+        result = run_in_child(name, options)
+        result.update({"scenario": name, "commit": commit, "timestamp": datetime.now().isoformat(timespec="seconds"),
+                       "options": options})
+        print(format_row(result, previous.get(name)))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,16 +1,40 @@
 import discord
-from discord.ext import commands, tasks
-import requests
+from discord.ext import commands
+import aiohttp
+import aiohttp.web
 import json
 from dotenv import load_dotenv
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, only needed for image optimization and duplicate detection
+    Image = None
 import os
 import re
 import io
+import mimetypes
+import shutil
+import tempfile
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Awaitable, BinaryIO, Callable, Deque, List, NamedTuple, Tuple, Union
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import heapq
+import itertools
+import logging
 import random
+import signal
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
 
 # --- Configuration ---
 
@@ -18,21 +42,410 @@ load_dotenv()
 
 # --- End Configuration ---
 
-# Regular expression to match Instagram URLs
-INSTAGRAM_URL_PATTERN = re.compile(
-    r'https?://(?:www\.)?instagram\.com/(?:p|reel|tv)/[A-Za-z0-9_-]+/?(?:\?[^\s]*)?',
-    re.IGNORECASE
+log = logging.getLogger("boomerbox")
+
+
+# --- Logging ---
+
+# Attributes every LogRecord has; anything else was passed in ``extra`` and is a structured field
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def log_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _LOG_RECORD_ATTRIBUTES}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, with any ``extra`` fields alongside the message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(log_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextLogFormatter(logging.Formatter):
+    """Human-readable lines, with ``extra`` fields appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = log_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging():
+    """Configure logging from LOG_LEVEL and LOG_FORMAT (text or json)."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if os.environ.get("LOG_FORMAT", "text").lower() == "json"
+                         else TextLogFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    # The Discord library is chatty at INFO
+    logging.getLogger("discord").setLevel(os.environ.get("DISCORD_LOG_LEVEL", "WARNING").upper())
+
+
+# --- Metrics ---
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(*args)
+        self.buckets = buckets
+        self.values: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts, then sum and count
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, counts in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = self._format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {counts[-1]}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {counts[-2]}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when the metrics are scraped, from a callback returning a number or {labels: value}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Any]] = None, kind: str = "gauge"):
+        super().__init__(name, help_text, label_names)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        if self.callback is None:
+            return []
+        value = self.callback()
+        if isinstance(value, dict):
+            return [f"{self.name}{self._format_labels(key)} {v}" for key, v in value.items()]
+        return [f"{self.name} {value}"]
+
+
+class MetricsRegistry:
+    """Counters, histograms and gauges, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> Any:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets=buckets))
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], Any], label_names: Tuple[str, ...] = (),
+              kind: str = "gauge") -> Gauge:
+        return self._register(Gauge(name, help_text, label_names, callback=callback, kind=kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.render()
+            except Exception as e:
+                log.warning(f"⚠️ Could not collect metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+COBALT_REQUESTS = METRICS.counter(
+    "boomerbox_cobalt_requests_total", "Cobalt API requests by backend and response status", ("backend", "status"))
+COBALT_LATENCY = METRICS.histogram(
+    "boomerbox_cobalt_request_seconds", "Cobalt API request latency", ("backend", "status"))
+COBALT_QUALITY = METRICS.counter("boomerbox_cobalt_quality_total", "Links fetched by Cobalt quality tier",
+                                 ("quality",))
+DOWNLOADS = METRICS.counter("boomerbox_downloads_total", "Media downloads by outcome", ("outcome",))
+DOWNLOAD_LATENCY = METRICS.histogram("boomerbox_download_seconds", "Media download time", ("outcome",))
+DOWNLOAD_BYTES = METRICS.counter("boomerbox_download_bytes_total", "Bytes of media downloaded")
+DOWNLOAD_RETRIES = METRICS.counter("boomerbox_downloads_retried_total", "Download attempts retried after a failure")
+DOWNLOAD_RESUMED_BYTES = METRICS.counter("boomerbox_download_bytes_resumed_total",
+                                         "Bytes kept from failed download attempts instead of downloaded again")
+UPLOADS = METRICS.counter("boomerbox_uploads_total", "Media posts to Discord by kind and outcome", ("kind", "outcome"))
+UPLOAD_LATENCY = METRICS.histogram("boomerbox_upload_seconds", "Time to post media to Discord", ("kind", "outcome"))
+INGEST_JOBS = METRICS.counter("boomerbox_ingest_jobs_total", "Processed links by outcome", ("outcome",))
+INGEST_LATENCY = METRICS.histogram("boomerbox_ingest_seconds", "Time to process a link end to end", ("outcome",))
+SHOWCASES = METRICS.counter("boomerbox_showcases_total", "Showcases by outcome", ("outcome",))
+SHOWCASE_LATENCY = METRICS.histogram("boomerbox_showcase_seconds", "Time to pick and post a showcase", ("outcome",))
+LOOP_LAG = METRICS.histogram(
+    "boomerbox_event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+LOOP_BLOCKS = METRICS.counter("boomerbox_event_loop_blocks_total", "Times the event loop was blocked past the threshold")
+SHOWCASE_LATENESS = METRICS.histogram(
+    "boomerbox_showcase_lateness_seconds", "How long after its scheduled slot a showcase was posted",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600))
+
+# --- Link matching ---
+
+class LinkMatch(NamedTuple):
+    """A supported link found in a message."""
+    platform: str
+    canonical_id: str  # The post's id on its platform, the same however the link was written
+    url: str
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.platform}-{self.canonical_id}"
+
+
+@dataclass
+class LinkExtractor:
+    """
+    How to recognise one platform's links: the hosts it lives on and patterns for
+    the rest of the URL, each with an ``id`` group holding the canonical id.
+    Patterns ignore case, like URLs do; ids keep the case they were written in
+    unless the platform's ids are case-insensitive (``lowercase_id``).
+    """
+    platform: str
+    label: str  # Shown to users, e.g. "TikTok"
+    hosts: Tuple[str, ...]
+    patterns: Tuple[str, ...]
+    lowercase_id: bool = False
+
+    def __post_init__(self):
+        self._compiled = [re.compile(pattern, re.IGNORECASE) for pattern in self.patterns]
+
+    def extract(self, rest: str) -> Optional[str]:
+        for pattern in self._compiled:
+            match = pattern.match(rest)
+            if match:
+                return match.group("id").lower() if self.lowercase_id else match.group("id")
+        return None
+
+
+# Link formats Cobalt can download. Hosts are matched without a leading www., m. or mobile.
+DEFAULT_LINK_EXTRACTORS = (
+    LinkExtractor("instagram", "Instagram", ("instagram.com",),
+                  (r"/(?:[\w.]+/)?(?:p|reels?|tv)/(?P<id>[\w-]+)",)),
+    LinkExtractor("tiktok", "TikTok", ("tiktok.com",),
+                  (r"/@[\w.-]+/(?:video|photo)/(?P<id>\d+)", r"/t/(?P<id>\w+)")),
+    LinkExtractor("tiktok", "TikTok", ("vm.tiktok.com", "vt.tiktok.com"), (r"/(?P<id>\w+)",)),
+    LinkExtractor("youtube", "YouTube", ("youtube.com",), (r"/shorts/(?P<id>[\w-]{11})",)),
+    LinkExtractor("reddit", "Reddit", ("reddit.com", "old.reddit.com", "new.reddit.com"),
+                  (r"/r/\w+/comments/(?P<id>[a-z0-9]+)",), lowercase_id=True),
+    LinkExtractor("reddit", "Reddit", ("redd.it",), (r"/(?P<id>[a-z0-9]+)",), lowercase_id=True),
+    LinkExtractor("twitter", "X", ("twitter.com", "x.com"), (r"/\w+/status(?:es)?/(?P<id>\d+)",)),
+    LinkExtractor("bluesky", "Bluesky", ("bsky.app",), (r"/profile/[\w.:-]+/post/(?P<id>\w+)",)),
+    LinkExtractor("streamable", "Streamable", ("streamable.com",), (r"/(?:e/)?(?P<id>\w+)",)),
+    LinkExtractor("vimeo", "Vimeo", ("vimeo.com",), (r"/(?P<id>\d+)",)),
+    LinkExtractor("twitch", "Twitch", ("twitch.tv",), (r"/\w+/clip/(?P<id>[\w-]+)",)),
+    LinkExtractor("twitch", "Twitch", ("clips.twitch.tv",), (r"/(?P<id>[\w-]+)",)),
+)
+
+# Any http(s) URL; the host decides which extractor, if any, looks at the rest
+URL_PATTERN = re.compile(r"https?://(?P<host>[a-z0-9.-]+)(?::\d+)?(?P<rest>[/?][^\s<>]*)?", re.IGNORECASE)
+HOST_PREFIXES = ("www.", "m.", "mobile.")
+URL_TRAILING_PUNCTUATION = ".,!?;:)]}'\"*~|"
+
+
+class LinkMatcher:
+    """
+    Registry of link extractors that finds every supported link in a message in a
+    single pass: messages without "://" are skipped outright, one pattern finds
+    the URLs, and a host lookup picks the extractor for each.
+    """
+
+    def __init__(self, extractors=DEFAULT_LINK_EXTRACTORS):
+        self._hosts: Dict[str, List[LinkExtractor]] = {}
+        self.labels: Dict[str, str] = {}
+        for extractor in extractors:
+            self.register(extractor)
+
+    def register(self, extractor: LinkExtractor):
+        for host in extractor.hosts:
+            self._hosts.setdefault(host.lower(), []).append(extractor)
+        self.labels.setdefault(extractor.platform, extractor.label)
+
+    @property
+    def platforms(self) -> List[str]:
+        return list(self.labels)
+
+    def _extractors_for(self, host: str) -> List[LinkExtractor]:
+        host = host.lower().rstrip(".")
+        extractors = self._hosts.get(host)
+        if extractors is None:
+            for prefix in HOST_PREFIXES:
+                if host.startswith(prefix):
+                    return self._hosts.get(host[len(prefix):], [])
+            return []
+        return extractors
+
+    def _link(self, url_match: "re.Match[str]") -> Optional[LinkMatch]:
+        if url_match.group("rest") is None:
+            return None
+        extractors = self._extractors_for(url_match.group("host"))
+        if not extractors:
+            return None
+        url = url_match.group(0).rstrip(URL_TRAILING_PUNCTUATION)
+        rest = url[url_match.start("rest") - url_match.start():]
+        for extractor in extractors:
+            canonical_id = extractor.extract(rest)
+            if canonical_id:
+                return LinkMatch(extractor.platform, canonical_id, url)
+        return None
+
+    def find(self, text: str) -> List[LinkMatch]:
+        """Every supported link in ``text``, in order, without repeats of the same post."""
+        # Cheap enough to run on every message; every URL_PATTERN match has "://" whatever its case
+        if "://" not in text:
+            return []
+        matches, seen = [], set()
+        for url_match in URL_PATTERN.finditer(text):
+            link = self._link(url_match)
+            if link and link.cache_key not in seen:
+                seen.add(link.cache_key)
+                matches.append(link)
+        return matches
+
+    def match(self, url: str) -> Optional[LinkMatch]:
+        """The supported link ``url`` points to, if it is one."""
+        url_match = URL_PATTERN.match(url.strip())
+        return self._link(url_match) if url_match else None
+
+
+# Discord allows at most this many attachments on a single message
+MAX_FILES_PER_MESSAGE = 10
+
+# Upload limit for servers without a boost, used when we don't know the guild
+DEFAULT_UPLOAD_LIMIT = 25 * 1024 * 1024
+
+
+# Gateway events that only matter in a submission channel; dropped elsewhere in lean gateway mode
+FILTERED_GATEWAY_EVENTS = ("MESSAGE_CREATE", "MESSAGE_UPDATE", "MESSAGE_DELETE", "MESSAGE_DELETE_BULK")
+
+
+def current_rss_bytes() -> Optional[int]:
+    """The process's resident memory right now, where the OS tells us (Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+
+
+def get_upload_limit(guild: Optional[discord.Guild]) -> int:
+    """Returns the attachment size limit for a guild."""
+    return guild.filesize_limit if guild else DEFAULT_UPLOAD_LIMIT
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Creates the shared aiohttp session used for all Cobalt and media requests.
+    Connections are pooled and kept alive between requests.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get("HTTP_MAX_CONNECTIONS", "50")),
+        limit_per_host=int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "10")),
+        ttl_dns_cache=300,
+        keepalive_timeout=30
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10")),
+        sock_read=float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+# Cobalt request options from the best quality down. Links are requested at the first
+# tier whose media fits the server's upload limit; the lower tiers also ask YouTube for
+# VP9, which is smaller than H.264 at the same resolution.
+COBALT_QUALITY_TIERS: Tuple[Dict[str, str], ...] = (
+    {"videoQuality": "1080"},
+    {"videoQuality": "720"},
+    {"videoQuality": "480"},
+    {"videoQuality": "480", "youtubeVideoCodec": "vp9"},
+    {"videoQuality": "360", "youtubeVideoCodec": "vp9"},
+    {"videoQuality": "240", "youtubeVideoCodec": "vp9"},
+    {"videoQuality": "144", "youtubeVideoCodec": "vp9"},
 )
 
 
+def quality_tier_label(tier: int) -> str:
+    options = COBALT_QUALITY_TIERS[tier]
+    codec = options.get("youtubeVideoCodec")
+    return f"{options['videoQuality']}p{f' {codec}' if codec else ''}"
 
-def get_download_link(api_url: str, api_key: Optional[str], media_url: str,
-                     bypass_header_name: Optional[str] = None,
-                     bypass_header_value: Optional[str] = None,
-                     user_agent: Optional[str] = None) -> Optional[Dict[str, Any]]:
+
+async def get_download_link(session: aiohttp.ClientSession, api_url: str, api_key: Optional[str], media_url: str,
+                            bypass_header_name: Optional[str] = None,
+                            bypass_header_value: Optional[str] = None,
+                            user_agent: Optional[str] = None,
+                            timeout: Optional[float] = None,
+                            options: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
     """
-    Fetches a download link from a self-hosted cobalt.tools API.
-    Returns a dict with status and download info, or None on error.
+    Fetches a download link from a self-hosted cobalt.tools API, with the given
+    request ``options`` (the top quality tier by default).
+    Returns a dict with status and download info (including Cobalt's own
+    "error" responses), or None if the instance couldn't be reached.
     """
 
     # 1. Set up headers based on api.md documentation
@@ -56,170 +469,2636 @@ def get_download_link(api_url: str, api_key: Optional[str], media_url: str,
     # 2. Set up the payload (request body)
     payload = {
         "url": media_url,
-        "videoQuality": "1080"  # Request 1080p, cobalt gets best available
+        **(COBALT_QUALITY_TIERS[0] if options is None else options)
     }
 
-    print(f"Requesting download for: {media_url}")
+    log.debug(f"Requesting download for: {media_url}")
 
     try:
         # 3. Make the POST request to the API
-        response = requests.post(
-            api_url,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30
-        )
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with session.post(api_url, headers=headers, json=payload, timeout=request_timeout) as response:
+            # Cobalt reports errors as JSON with status "error", so keep the body around
+            if response.status >= 400:
+                body = await response.text()
+                try:
+                    data = json.loads(body)
+                    if isinstance(data, dict) and data.get("status") == "error":
+                        return data
+                except ValueError:
+                    pass
+                log.error(f"❌ HTTP Error: {response.status} {response.reason}", extra={"body": body[:500]})
+                return None
+
+            # 4. Parse and return the JSON response
+            return await response.json(content_type=None)
 
-        # Raise an exception for bad HTTP status codes
-        response.raise_for_status()
+    except asyncio.TimeoutError:
+        log.error(f"❌ Timed out waiting for Cobalt at {api_url}")
+        return None
+    except aiohttp.ClientError as e:
+        log.error(f"❌ A connection error occurred: {e}")
+        return None
 
-        # 4. Parse the JSON response
-        data = response.json()
 
-        # 5. Return the parsed data
-        return data
+async def probe_media_size(session: aiohttp.ClientSession, url: str, timeout: float = 10.0) -> Optional[int]:
+    """
+    Returns the size the server reports for the media at ``url`` without downloading it,
+    or None if it doesn't say. A HEAD request is tried first (Cobalt tunnels answer it
+    with an estimate), then, for anything but a tunnel, a one-byte range request. A
+    tunnel would start streaming the whole file for any GET, so it's never sent one.
+    """
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    try:
+        async with session.head(url, timeout=client_timeout, allow_redirects=True) as response:
+            if response.status < 400:
+                for header in ("Content-Length", "Estimated-Content-Length"):
+                    value = response.headers.get(header, "")
+                    if value.isdigit() and int(value) > 0:
+                        return int(value)
+        if is_tunnel_url(url):
+            return None
 
-    except requests.exceptions.HTTPError as err:
-        print(f"❌ HTTP Error: {err}")
-        if err.response:
-            print(f"   Response body: {err.response.text}")
+        async with session.get(url, headers={"Range": "bytes=0-0"}, timeout=client_timeout) as response:
+            if response.status == 206:
+                return parse_content_range_total(response.headers.get("Content-Range"))
+            return None
+    except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+        log.debug(f"Could not probe media size: {e}")
         return None
-    except requests.exceptions.RequestException as e:
-        print(f"❌ A connection error occurred: {e}")
+
+
+@dataclass
+class CobaltBackend:
+    """One Cobalt instance, along with what we've learned about its health."""
+    name: str
+    url: str
+    api_key: Optional[str] = None
+    bypass_header_name: Optional[str] = None
+    bypass_header_value: Optional[str] = None
+    user_agent: Optional[str] = None
+
+    latency: Optional[float] = None  # Moving average of successful request time, in seconds
+    inflight: int = 0
+    consecutive_failures: int = 0
+    open_until: float = 0.0  # Circuit is open (backend out of rotation) until this time
+    cooldown: float = 0.0
+    probing: bool = False  # A half-open probe is in flight
+    requests: int = 0
+    failures: int = 0
+    last_elapsed: float = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.open_until > time.monotonic():
+            return "open"
+        return "half-open" if self.consecutive_failures else "closed"
+
+
+def load_cobalt_backends() -> List[CobaltBackend]:
+    """
+    Reads Cobalt instances from the environment. The first uses COBALT_API_URL and
+    friends; more can be added as COBALT_API_URL_2, COBALT_API_KEY_2, and so on.
+    """
+    backends = []
+    default_agent = os.environ.get("COBALT_USER_AGENT")
+    for index in range(1, 33):
+        suffix = "" if index == 1 else f"_{index}"
+        url = os.environ.get(f"COBALT_API_URL{suffix}")
+        if not url:
+            if index == 1:
+                continue
+            break
+        backends.append(CobaltBackend(
+            name=f"cobalt{index}",
+            url=url,
+            api_key=os.environ.get(f"COBALT_API_KEY{suffix}"),
+            bypass_header_name=os.environ.get(f"CLOUDFLARE_BYPASS_HEADER{suffix}"),
+            bypass_header_value=os.environ.get(f"CLOUDFLARE_BYPASS_VALUE{suffix}"),
+            user_agent=os.environ.get(f"COBALT_USER_AGENT{suffix}", default_agent)
+        ))
+    return backends
+
+
+class CobaltPool:
+    """
+    Spreads Cobalt requests over several instances.
+
+    Requests go to the healthy backend with the lowest expected latency. Each
+    backend has a circuit breaker: after a few consecutive failures it is taken
+    out of rotation for a cooldown that grows with repeated trips, then a single
+    probe decides whether it comes back. A background health check keeps the
+    latency estimates fresh and brings recovered backends back early. Failed
+    requests and retryable Cobalt errors are retried on another backend, but
+    only failures of the instance itself count against its breaker.
+    """
+
+    # Cobalt error codes that say more about the instance than the link
+    INSTANCE_ERROR_PREFIXES = ("error.api.auth.",)
+    INSTANCE_ERRORS = {"error.api.timed_out", "error.api.rate_exceeded", "error.api.capacity"}
+    # Codes about the link (or fetching it) that another instance might still get past
+    LINK_ERROR_PREFIXES = ("error.api.fetch.", "error.api.youtube.")
+    LINK_ERRORS = {"error.api.unreachable", "error.api.generic", "error.api.unknown_response"}
+
+    def __init__(self, backends: List[CobaltBackend], timeout: float = 15.0, failure_threshold: int = 3,
+                 base_cooldown: float = 10.0, max_cooldown: float = 300.0, health_interval: float = 15.0):
+        self.backends = backends
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def is_instance_error(cls, response: Dict[str, Any]) -> bool:
+        code = (response.get("error") or {}).get("code", "")
+        return code in cls.INSTANCE_ERRORS or code.startswith(cls.INSTANCE_ERROR_PREFIXES)
+
+    @classmethod
+    def is_retryable(cls, response: Dict[str, Any]) -> bool:
+        code = (response.get("error") or {}).get("code", "")
+        return cls.is_instance_error(response) or code in cls.LINK_ERRORS or code.startswith(cls.LINK_ERROR_PREFIXES)
+
+    def _available(self) -> List[CobaltBackend]:
+        now = time.monotonic()
+        return [b for b in self.backends
+                if b.open_until <= now and not (b.consecutive_failures and b.probing)]
+
+    def _score(self, backend: CobaltBackend) -> float:
+        # Unknown latency is treated as fast so new backends get tried
+        return (backend.latency or 0.0) * (1 + backend.inflight)
+
+    def _record_success(self, backend: CobaltBackend, elapsed: float):
+        backend.latency = elapsed if backend.latency is None else backend.latency * 0.7 + elapsed * 0.3
+        if backend.consecutive_failures:
+            log.info(f"✅ Cobalt backend {backend.name} is healthy again")
+        backend.consecutive_failures = 0
+        backend.cooldown = 0.0
+        backend.open_until = 0.0
+
+    def _record_failure(self, backend: CobaltBackend, reason: str):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.failure_threshold:
+            backend.cooldown = min(self.max_cooldown, backend.cooldown * 2 if backend.cooldown else self.base_cooldown)
+            backend.open_until = time.monotonic() + backend.cooldown
+            log.warning(f"🚫 Cobalt backend {backend.name} taken out of rotation for {backend.cooldown:.0f}s ({reason})",
+                        extra={"backend": backend.name, "reason": reason})
+
+    async def _call(self, session: aiohttp.ClientSession, backend: CobaltBackend, media_url: str,
+                    options: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        backend.inflight += 1
+        backend.requests += 1
+        probing = backend.consecutive_failures > 0
+        backend.probing = probing
+        started = time.monotonic()
+        status = "failed"
+        try:
+            response = await get_download_link(session, backend.url, backend.api_key, media_url,
+                                               backend.bypass_header_name, backend.bypass_header_value,
+                                               backend.user_agent, timeout=self.timeout, options=options)
+            if response is not None:
+                status = response.get("status", "unknown")
+                if status == "error":
+                    status = response.get("error", {}).get("code", "error")
+            return response
+        finally:
+            backend.inflight -= 1
+            if probing:
+                backend.probing = False
+            backend.last_elapsed = time.monotonic() - started
+            COBALT_REQUESTS.inc(backend=backend.name, status=status)
+            COBALT_LATENCY.observe(backend.last_elapsed, backend=backend.name, status=status)
+
+    async def get_download_link(self, session: aiohttp.ClientSession, media_url: str,
+                                options: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Asks the best available backend for a download link, moving on to the next
+        one if it can't be reached or answers with a retryable error.
+        """
+        tried = set()
+        last_response = None
+        while True:
+            candidates = [b for b in self._available() if b.name not in tried]
+            if not candidates:
+                break
+            backend = min(candidates, key=self._score)
+            tried.add(backend.name)
+
+            response = await self._call(session, backend, media_url, options)
+            if response is None:
+                self._record_failure(backend, "request failed")
+                continue
+
+            if response.get("status") == "error" and self.is_retryable(response):
+                if self.is_instance_error(response):
+                    self._record_failure(backend, response["error"].get("code", "error"))
+                last_response = response
+                log.warning(f"🔁 Cobalt backend {backend.name} returned {response['error'].get('code')}, trying another")
+                continue
+
+            self._record_success(backend, backend.last_elapsed)
+            return response
+
+        if not tried:
+            log.error("❌ No Cobalt backends are available")
+        return last_response
+
+    async def _check(self, session: aiohttp.ClientSession, backend: CobaltBackend):
+        """Active health check against the instance's info endpoint."""
+        headers = {"Accept": "application/json"}
+        if backend.user_agent:
+            headers["User-Agent"] = backend.user_agent
+        if backend.bypass_header_name and backend.bypass_header_value:
+            headers[backend.bypass_header_name] = backend.bypass_header_value
+        started = time.monotonic()
+        try:
+            async with session.get(backend.url, headers=headers,
+                                   timeout=aiohttp.ClientTimeout(total=min(5.0, self.timeout))) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+                await response.read()
+            self._record_success(backend, time.monotonic() - started)
+        except Exception as e:
+            self._record_failure(backend, f"health check: {e.__class__.__name__}")
+
+    async def _health_loop(self, session: aiohttp.ClientSession):
+        while True:
+            now = time.monotonic()
+            # Skip backends still cooling down; the first check after the cooldown acts as the probe
+            due = [b for b in self.backends if b.open_until <= now and not b.probing]
+            await asyncio.gather(*(self._check(session, b) for b in due))
+            await asyncio.sleep(self.health_interval)
+
+    def start(self, session: aiohttp.ClientSession):
+        if self.health_interval > 0 and self.backends and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(session))
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{
+            "name": b.name,
+            "state": b.state,
+            "latency": b.latency,
+            "inflight": b.inflight,
+            "requests": b.requests,
+            "failures": b.failures,
+        } for b in self.backends]
+
+
+class MemoryBudget:
+    """
+    Process-wide limit on how many bytes of media may be held in memory at once.
+    Jobs reserve what they expect to hold before they start and release it once
+    the upload is done. Waiters are served first come, first served.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.reserved = 0
+        self.peak = 0
+        self.waits = 0
+        self.spills = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _clamp(self, nbytes: int) -> int:
+        # A single job bigger than the whole budget gets all of it rather than waiting forever
+        return max(0, min(nbytes, self.limit))
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.reserved == 0 or self.reserved + nbytes <= self.limit
+
+    def _take(self, nbytes: int):
+        self.reserved += nbytes
+        self.peak = max(self.peak, self.reserved)
+
+    def try_reserve(self, nbytes: int) -> Optional[int]:
+        """Reserve without waiting. Returns the bytes reserved, or None if the budget is used up."""
+        nbytes = self._clamp(nbytes)
+        if self._waiters or not self._fits(nbytes):
+            self.spills += 1
+            return None
+        self._take(nbytes)
+        return nbytes
+
+    async def reserve(self, nbytes: int) -> int:
+        """Reserve, waiting for other jobs to release memory if needed. Returns the bytes reserved."""
+        nbytes = self._clamp(nbytes)
+        if not self._waiters and self._fits(nbytes):
+            self._take(nbytes)
+            return nbytes
+
+        self.waits += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)  # Granted just as we were cancelled
+            elif (nbytes, future) in self._waiters:
+                # release() may already have dropped our cancelled future from the queue
+                self._waiters.remove((nbytes, future))
+                self.release(0)  # Waiters queued behind us may fit now
+            raise
+        return nbytes
+
+    def release(self, nbytes: int):
+        self.reserved = max(0, self.reserved - nbytes)
+        while self._waiters:
+            waiting_bytes, future = self._waiters[0]
+            if future.cancelled():
+                self._waiters.popleft()
+                continue
+            if not self._fits(waiting_bytes):
+                break
+            self._waiters.popleft()
+            self._take(waiting_bytes)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "reserved": self.reserved,
+            "peak": self.peak,
+            "waiting": len(self._waiters),
+            "waits": self.waits,
+            "spills": self.spills,
+        }
+
+
+@dataclass
+class MediaItem:
+    """A downloaded (or cached) media file ready to be uploaded."""
+    item_num: int
+    file_ext: str
+    size: int
+    data: Optional[BinaryIO] = None
+    path: Optional[Path] = None
+    budget: Optional[MemoryBudget] = None
+    reserved: int = 0  # Bytes held against the memory budget while the data is in memory
+    attempts: int = 0  # Download attempts it took, 0 if it came from the cache
+    resumed_bytes: int = 0  # Bytes kept from failed attempts instead of downloaded again
+
+    def to_discord_file(self, total_items: int) -> discord.File:
+        filename = f"media{f'_{self.item_num}' if total_items > 1 else ''}{self.file_ext}"
+        return discord.File(str(self.path) if self.path else self.data, filename=filename)
+
+    def release_memory(self):
+        if self.budget and self.reserved:
+            self.budget.release(self.reserved)
+        self.reserved = 0
+
+    def close(self):
+        """Release the in-memory buffer or temporary file holding the download."""
+        if self.data:
+            self.data.close()
+        self.release_memory()
+
+
+class MediaTooLargeError(Exception):
+    """Raised when media is bigger than the upload limit it is meant for."""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"media is {size / 1024 / 1024:.1f} MB, upload limit is {limit / 1024 / 1024:.1f} MB")
+        self.size = size
+        self.limit = limit
+
+
+# File extensions we trust from a URL when the server doesn't send a usable Content-Type
+KNOWN_MEDIA_EXTENSIONS = (".mp4", ".mov", ".webm", ".jpg", ".jpeg", ".png", ".webp", ".gif", ".mp3", ".m4a", ".ogg")
+
+
+def get_file_extension(content_type: Optional[str], url: str) -> str:
+    """Picks a file extension from the response Content-Type, falling back to the URL path."""
+    if content_type:
+        mime_type = content_type.split(";", 1)[0].strip().lower()
+        if mime_type == "image/jpeg":
+            return ".jpg"  # guess_extension() may give .jpe on older Pythons
+        file_ext = mimetypes.guess_extension(mime_type)
+        if file_ext and mime_type.split("/", 1)[0] in ("image", "video", "audio"):
+            return file_ext
+
+    url_ext = os.path.splitext(url.split("?", 1)[0])[1].lower()
+    if url_ext in KNOWN_MEDIA_EXTENSIONS:
+        return url_ext
+    return ".mp4"  # Default to mp4
+
+
+# --- Media optimization (runs in worker processes) ---
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm")
+MEDIA_OPTIMIZATION_POLICIES = ("off", "oversized", "always")
+
+
+def optimize_image(source: str, destination: str, target_bytes: int) -> Optional[str]:
+    """
+    Re-encode an image to fit in ``target_bytes``, lowering quality first and then
+    scaling it down. Writes it to ``destination`` plus the returned file extension,
+    or returns None if it can't fit.
+    """
+    with Image.open(source) as image:
+        image.load()
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        # JPEG is smallest for photos; WebP keeps transparency
+        image_format, file_ext = ("WEBP", ".webp") if has_alpha else ("JPEG", ".jpg")
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        for _ in range(8):
+            for quality in (90, 80, 70, 60, 50):
+                output = io.BytesIO()
+                image.save(output, format=image_format, quality=quality, optimize=True)
+                if output.tell() <= target_bytes:
+                    with open(destination + file_ext, "wb") as f:
+                        f.write(output.getbuffer())
+                    return file_ext
+            width, height = image.size
+            if width < 320 or height < 320:
+                break
+            image = image.resize((int(width * 0.75), int(height * 0.75)), Image.LANCZOS)
+    return None
+
+
+def transcode_video(source: str, destination: str, target_bytes: int) -> bool:
+    """Re-encode a video with ffmpeg at a bitrate that should land under ``target_bytes``."""
+    probe = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", source],
+        capture_output=True, text=True, timeout=30
+    )
+    duration = float(probe.stdout.strip() or 0)
+    if duration <= 0:
+        return False
+
+    audio_bitrate = 96_000
+    # Leave some headroom for the container and rate control overshoot
+    video_bitrate = int(target_bytes * 8 * 0.9 / duration) - audio_bitrate
+    if video_bitrate < 100_000:
+        return False
+
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", source,
+         "-c:v", "libx264", "-preset", "veryfast", "-b:v", str(video_bitrate),
+         "-maxrate", str(video_bitrate), "-bufsize", str(video_bitrate * 2),
+         "-c:a", "aac", "-b:a", str(audio_bitrate), "-movflags", "+faststart", destination],
+        capture_output=True, timeout=600
+    )
+    return result.returncode == 0 and os.path.getsize(destination) <= target_bytes
+
+
+def perceptual_hash(source: Union[str, bytes]) -> int:
+    """
+    64-bit difference hash (dHash) of an image, given its path or its bytes.
+    Re-encoded, resized or lightly edited copies of the same picture end up only
+    a few bits apart.
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def video_perceptual_hash(source: str) -> Optional[int]:
+    """Perceptual hash of a video's frame one second in (or its first frame, for very short clips)."""
+    for seek in ("1", "0"):
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-ss", seek, "-i", source, "-frames:v", "1",
+             "-f", "image2pipe", "-vcodec", "png", "-"],
+            capture_output=True, timeout=60
+        )
+        if result.returncode == 0 and result.stdout:
+            return perceptual_hash(result.stdout)
+    return None
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _BKNode:
+    __slots__ = ("value_hash", "values", "children")
+
+    def __init__(self, value_hash: int, value: Any):
+        self.value_hash = value_hash
+        self.values = [value]
+        self.children: Dict[int, "_BKNode"] = {}
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of 64-bit hashes. Finding every hash within a small
+    Hamming distance only visits the branches that could hold a match, instead
+    of comparing against every stored hash.
+    """
+
+    def __init__(self):
+        self.root: Optional[_BKNode] = None
+        self.size = 0
+
+    def add(self, value_hash: int, value: Any):
+        self.size += 1
+        if self.root is None:
+            self.root = _BKNode(value_hash, value)
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value_hash, node.value_hash)
+            if distance == 0:
+                node.values.append(value)
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _BKNode(value_hash, value)
+                return
+            node = child
+
+    def remove(self, value_hash: int, value: Any):
+        """Remove a value. Its node stays in place (empty) to keep the tree's structure valid."""
+        node = self.root
+        while node is not None:
+            distance = hamming_distance(value_hash, node.value_hash)
+            if distance == 0:
+                if value in node.values:
+                    node.values.remove(value)
+                    self.size -= 1
+                return
+            node = node.children.get(distance)
+
+    def search(self, value_hash: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Every (distance, value) within ``max_distance`` of ``value_hash``, closest first."""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value_hash, node.value_hash)
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node.values)
+            # Triangle inequality: only children in this distance band can hold matches
+            for child_distance, child in node.children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class DuplicateIndex:
+    """Per-guild perceptual hashes of submitted media, for spotting reposts."""
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.trees: Dict[int, BKTree] = {}
+        self.messages: Dict[int, Tuple[int, List[int]]] = {}  # message id -> (guild id, hashes)
+        self.flagged = 0
+
+    def add(self, guild_id: int, message_id: int, hashes: List[int]):
+        tree = self.trees.setdefault(guild_id, BKTree())
+        for value_hash in hashes:
+            tree.add(value_hash, message_id)
+        known = self.messages.setdefault(message_id, (guild_id, []))
+        known[1].extend(hashes)
+
+    def find(self, guild_id: int, value_hash: int, exclude: Optional[int] = None) -> Optional[int]:
+        """The closest earlier message whose media is a near-duplicate, if any."""
+        tree = self.trees.get(guild_id)
+        if tree is None:
+            return None
+        for _, message_id in tree.search(value_hash, self.max_distance):
+            if message_id != exclude:
+                return message_id
         return None
 
+    def remove(self, message_ids: List[int]):
+        for message_id in message_ids:
+            guild_id, hashes = self.messages.pop(message_id, (None, []))
+            tree = self.trees.get(guild_id)
+            for value_hash in hashes:
+                tree.remove(value_hash, message_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"messages": len(self.messages), "hashes": sum(t.size for t in self.trees.values()),
+                "flagged": self.flagged}
+
+
+class RetryBudget:
+    """Download retries shared by every download in one ingest job."""
+
+    def __init__(self, retries: int):
+        self.remaining = retries
+
+    def take(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
 
-async def download_media(url: str) -> Optional[io.BytesIO]:
+def is_retryable_download_error(error: Exception) -> bool:
+    """Connection drops, timeouts and server errors are worth retrying; other HTTP errors are not."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status in (408, 429)
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def is_tunnel_url(url: str) -> bool:
+    """Whether a download link is a Cobalt tunnel, which stops working shortly after it's made."""
+    return urlparse(url).path.rstrip("/").endswith("/tunnel")
+
+
+def parse_content_range_start(value: Optional[str]) -> Optional[int]:
+    """Returns the first byte of a 'bytes start-end/total' Content-Range header."""
+    match = re.match(r"bytes (\d+)-\d+/(?:\d+|\*)", value or "")
+    return int(match.group(1)) if match else None
+
+
+def parse_content_range_total(value: Optional[str]) -> Optional[int]:
+    """Returns the total size of a 'bytes start-end/total' Content-Range header, if it's known."""
+    match = re.match(r"bytes \d+-\d+/(\d+)", value or "")
+    return int(match.group(1)) if match else None
+
+
+async def download_media(session: aiohttp.ClientSession, url: str, max_bytes: Optional[int] = None,
+                         spool_limit: int = 8 * 1024 * 1024,
+                         budget: Optional[MemoryBudget] = None,
+                         max_attempts: int = 1,
+                         retry_budget: Optional[RetryBudget] = None,
+                         backoff: float = 1.0,
+                         max_bytes_for: Optional[Callable[[str], int]] = None) -> Optional[MediaItem]:
     """
-    Downloads media from a URL and returns it as a BytesIO object.
+    Streams media from a URL and returns it as a MediaItem.
+
+    Small files stay in memory; once a download passes ``spool_limit`` bytes it is
+    moved to a temporary file, so memory use doesn't grow with the media size.
+    If a memory budget is given, the in-memory part is reserved against it up
+    front, and the download goes straight to disk when the budget is used up.
+
+    Failed attempts are retried up to ``max_attempts`` times (while ``retry_budget``
+    lasts) with exponential backoff and jitter. Retries ask for the rest of the file
+    with a Range request and carry on from the last byte received if the server
+    honours it, otherwise they start over.
+
+    Raises MediaTooLargeError as soon as the download is known to exceed ``max_bytes``.
+    If ``max_bytes_for`` is given, it picks ``max_bytes`` from the file extension
+    (worked out from the response Content-Type or the URL) before anything is read.
     """
+    media_item: Optional[MediaItem] = None
+    attempt = 0
+    started = time.monotonic()
     try:
-        print(f"Downloading media from: {url}")
-        response = requests.get(url, stream=True, timeout=60)
-        response.raise_for_status()
+        log.debug(f"Downloading media from: {url}")
+        while True:
+            attempt += 1
+            resume_from = media_item.size if media_item else 0
+            headers = {"Range": f"bytes={resume_from}-"} if resume_from else None
+            try:
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+
+                    if resume_from:
+                        if response.status == 206 and parse_content_range_start(
+                                response.headers.get("Content-Range")) == resume_from:
+                            media_item.resumed_bytes += resume_from
+                            DOWNLOAD_RESUMED_BYTES.inc(resume_from)
+                            log.info(f"⏩ Resuming download at byte {resume_from} (attempt {attempt})",
+                                     extra={"resumed_bytes": resume_from, "attempts": attempt})
+                        else:
+                            # Range not honoured, start from the beginning again
+                            log.info(f"🔄 Server ignored range request, restarting download (attempt {attempt})",
+                                     extra={"attempts": attempt})
+                            media_item.data.seek(0)
+                            media_item.data.truncate()
+                            media_item.size = 0
+                            resume_from = 0
+
+                    if media_item is None and max_bytes_for is not None:
+                        max_bytes = max_bytes_for(get_file_extension(response.headers.get("Content-Type"), url))
+
+                    # Reject before downloading anything if the server tells us the size
+                    expected_total = resume_from + response.content_length if response.content_length else None
+                    if max_bytes and expected_total and expected_total > max_bytes:
+                        raise MediaTooLargeError(expected_total, max_bytes)
+
+                    if media_item is None:
+                        media_item = MediaItem(item_num=0, size=0, data=io.BytesIO(), budget=budget,
+                                               file_ext=get_file_extension(response.headers.get("Content-Type"), url))
 
-        # Read the content into a BytesIO object
-        media_data = io.BytesIO()
-        for chunk in response.iter_content(chunk_size=8192):
-            media_data.write(chunk)
+                        if budget:
+                            expected = min(response.content_length or spool_limit, spool_limit)
+                            reserved = budget.try_reserve(expected)
+                            if reserved is None:
+                                spool_limit = 0  # No memory to spare, go straight to disk
+                            else:
+                                media_item.reserved = reserved
+                                spool_limit = reserved
 
-        media_data.seek(0)
-        print(f"✅ Downloaded {len(media_data.getvalue())} bytes")
-        return media_data
+                    async for chunk in response.content.iter_chunked(65536):
+                        media_item.size += len(chunk)
+                        if max_bytes and media_item.size > max_bytes:
+                            raise MediaTooLargeError(media_item.size, max_bytes)
 
+                        # Spill to disk once the download gets big
+                        if media_item.size > spool_limit and isinstance(media_item.data, io.BytesIO):
+                            spool_file = tempfile.TemporaryFile()
+                            spool_file.write(media_item.data.getbuffer())
+                            media_item.data = spool_file
+                            media_item.release_memory()
+
+                        media_item.data.write(chunk)
+                break
+
+            except MediaTooLargeError:
+                raise
+            except Exception as e:
+                if not is_retryable_download_error(e) or attempt >= max_attempts or \
+                        (retry_budget is not None and not retry_budget.take()):
+                    raise
+                delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+                kept = media_item.size if media_item else 0
+                DOWNLOAD_RETRIES.inc()
+                log.warning(f"🔁 Download attempt {attempt}/{max_attempts} failed ({e.__class__.__name__}: {e}), "
+                            f"retrying in {delay:.1f}s with {kept} bytes kept",
+                            extra={"attempts": attempt, "kept_bytes": kept})
+                await asyncio.sleep(delay)
+
+        media_item.attempts = attempt
+        media_item.data.seek(0)
+        spooled = not isinstance(media_item.data, io.BytesIO)
+        log.debug(f"✅ Downloaded {media_item.size} bytes{' (spooled to disk)' if spooled else ''}"
+                  f"{f' in {attempt} attempts, {media_item.resumed_bytes} bytes resumed' if attempt > 1 else ''}",
+                  extra={"bytes": media_item.size, "attempts": attempt})
+        DOWNLOADS.inc(outcome="ok")
+        DOWNLOAD_LATENCY.observe(time.monotonic() - started, outcome="ok")
+        DOWNLOAD_BYTES.inc(media_item.size)
+        return media_item
+
+    except MediaTooLargeError as e:
+        log.warning(f"⚠️ Stopped download of {url}: {e}", extra={"size": e.size, "limit": e.limit})
+        DOWNLOADS.inc(outcome="too_large")
+        DOWNLOAD_LATENCY.observe(time.monotonic() - started, outcome="too_large")
+        if media_item:
+            media_item.close()
+        raise
     except Exception as e:
-        print(f"❌ Error downloading media: {e}")
+        log.error(f"❌ Error downloading media after {attempt} attempt(s): {e}", extra={"attempts": attempt})
+        DOWNLOADS.inc(outcome="failed")
+        DOWNLOAD_LATENCY.observe(time.monotonic() - started, outcome="failed")
+        if media_item:
+            media_item.close()
         return None
 
-class BoomerBoxBot(commands.Bot):
-    def __init__(self, **options):
-        intents = discord.Intents.default()
-        intents.message_content = True
 
-        super().__init__(command_prefix='!', intents=intents, **options)
+@dataclass
+class IngestJob:
+    """A single link waiting to be processed from a submission message."""
+    message: discord.Message
+    url: str
+    guild_id: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    job_id: Optional[int] = None  # Row in the ingest journal
+
+
+@dataclass
+class StagedShowcase:
+    """A showcase prepared ahead of its slot: the chosen submission, its embed and its attachments on disk."""
+    guild_id: int
+    message: discord.Message
+    embed: discord.Embed
+    directory: Path
+    files: List[Tuple[Path, str]] = field(default_factory=list)  # (path on disk, upload filename)
+
+    def discord_files(self) -> List[discord.File]:
+        return [discord.File(str(path), filename=filename) for path, filename in self.files]
+
+    async def cleanup(self):
+        await asyncio.to_thread(shutil.rmtree, self.directory, True)
+
+
+class IngestQueue:
+    """
+    Bounded job queue between on_message and the Cobalt/download/upload stages.
+    Jobs are kept in per-guild queues and handed to a fixed pool of workers in
+    round-robin order, so one busy guild cannot starve the others.
+    """
+
+    def __init__(self, handler: Callable[[IngestJob], Awaitable[None]],
+                 workers: int = 4, max_size: int = 100, max_per_guild: int = 20):
+        self.handler = handler
+        self.worker_count = max(1, workers)
+        self.max_size = max_size
+        self.max_per_guild = max_per_guild
+
+        self._queues: Dict[int, Deque[IngestJob]] = {}
+        self._rotation: Deque[int] = deque()  # Guilds with pending jobs, in service order
+        self._size = 0
+        self._not_empty = asyncio.Condition()
+        self._workers: List[asyncio.Task] = []
+
+        # Operator stats
+        self.active = 0
+        self.processed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def guild_depth(self, guild_id: int) -> int:
+        return len(self._queues.get(guild_id, ()))
+
+    def position_of(self, guild_id: int) -> int:
+        """Approximate position of a guild's newest job under round-robin service."""
+        own = self.guild_depth(guild_id)
+        ahead = sum(min(len(q), own) for gid, q in self._queues.items() if gid != guild_id)
+        return ahead + own
+
+    async def put(self, job: IngestJob) -> Optional[int]:
+        """Queue a job. Returns its position in the queue, or None if the queue is full."""
+        if self._size >= self.max_size or self.guild_depth(job.guild_id) >= self.max_per_guild:
+            self.rejected += 1
+            return None
+
+        guild_queue = self._queues.get(job.guild_id)
+        if guild_queue is None:
+            guild_queue = self._queues[job.guild_id] = deque()
+            self._rotation.append(job.guild_id)
+        guild_queue.append(job)
+        self._size += 1
+
+        async with self._not_empty:
+            self._not_empty.notify()
+        return self.position_of(job.guild_id)
+
+    def _next_job(self) -> IngestJob:
+        guild_id = self._rotation.popleft()
+        guild_queue = self._queues[guild_id]
+        job = guild_queue.popleft()
+        if guild_queue:
+            self._rotation.append(guild_id)
+        else:
+            del self._queues[guild_id]
+        self._size -= 1
+        return job
+
+    async def _worker(self, worker_id: int):
+        while True:
+            async with self._not_empty:
+                await self._not_empty.wait_for(lambda: self._size > 0)
+                job = self._next_job()
+
+            waited = time.monotonic() - job.enqueued_at
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.active += 1
+            try:
+                await self.handler(job)
+            except Exception as e:
+                log.error(f"❌ Ingest worker {worker_id} failed on {job.url}: {e}")
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def start(self):
+        """Start the worker pool on the running event loop."""
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        log.info(f"📬 Ingest queue started with {self.worker_count} worker(s), capacity {self.max_size}")
+
+    async def stop(self):
+        """Cancel all workers. Jobs still queued are dropped."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self._size,
+            "guilds_waiting": len(self._queues),
+            "active": self.active,
+            "workers": self.worker_count,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.processed if self.processed else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+# "<link key>_<item>of<total>", the name of a cached media file without its extension
+MEDIA_KEY_PATTERN = re.compile(r"(.+)_(\d+)of(\d+)")
+
+
+class MediaCache:
+    """
+    Cache for repeated links, keyed on ``LinkMatch.cache_key`` (the platform and
+    the post's canonical id).
+
+    Cobalt responses are kept in memory for a short TTL, since tunnel and
+    redirect URLs expire; responses with tunnel links get a shorter one, as
+    Cobalt only keeps a tunnel open for about 90 seconds. Downloaded media is kept on disk as
+    ``<key>_<item>of<total><ext>`` with a total size limit and
+    least-recently-used eviction.
+    """
+
+    CACHEABLE_STATUSES = ("redirect", "tunnel", "picker")
+
+    def __init__(self, directory: Path, max_bytes: int, cobalt_ttl: float, max_cobalt_entries: int = 1000,
+                 tunnel_ttl: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cobalt_ttl = cobalt_ttl
+        self.tunnel_ttl = tunnel_ttl
+        self.max_cobalt_entries = max_cobalt_entries
+
+        # link key -> (expires at, stored at, response)
+        self._cobalt: "OrderedDict[str, Tuple[float, float, Dict[str, Any]]]" = OrderedDict()
+        self._media: "OrderedDict[str, Tuple[Path, int]]" = OrderedDict()  # Oldest first
+        self._media_bytes = 0
+        # link key -> {total items in the post: how many of them are cached}
+        self._link_items: Dict[str, Dict[int, int]] = {}
+
+        self.cobalt_hits = 0
+        self.cobalt_misses = 0
+        self.media_hits = 0
+        self.media_misses = 0
+        self.evictions = 0
+
+        if self.max_bytes > 0:
+            self._load()
+
+    @staticmethod
+    def _media_key(link_key: str, item_num: int, total_items: int) -> str:
+        return f"{link_key}_{item_num}of{total_items}"
+
+    def _count_item(self, key: str, delta: int):
+        """Keep the per-link count of cached items in step with ``_media``."""
+        match = MEDIA_KEY_PATTERN.fullmatch(key)
+        if not match:
+            return
+        link_key, total = match.group(1), int(match.group(3))
+        counts = self._link_items.setdefault(link_key, {})
+        counts[total] = counts.get(total, 0) + delta
+        if counts[total] <= 0:
+            del counts[total]
+            if not counts:
+                del self._link_items[link_key]
+
+    def _load(self):
+        """Index media already on disk, least recently used first."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.directory.iterdir():
+            if path.is_file() and not path.name.endswith(".tmp"):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.stem, path, stat.st_size))
+        for _, key, path, size in sorted(entries):
+            if key in self._media:
+                self._forget(key)  # Same item saved with another extension; keep the newer file
+            self._media[key] = (path, size)
+            self._media_bytes += size
+            self._count_item(key, 1)
+        if entries:
+            log.info(f"♻️ Media cache loaded {len(entries)} file(s), {self._media_bytes} bytes")
+
+    def get_cobalt(self, link_key: str) -> Optional[Dict[str, Any]]:
+        entry = self._cobalt.get(link_key)
+        if entry and entry[0] > time.monotonic():
+            self.cobalt_hits += 1
+            return entry[2]
+        if entry:
+            del self._cobalt[link_key]
+        self.cobalt_misses += 1
+        return None
+
+    def put_cobalt(self, link_key: str, response: Dict[str, Any]):
+        if response.get("status") not in self.CACHEABLE_STATUSES:
+            return
+        urls = [response.get("url")] + [item.get("url") for item in response.get("picker", [])]
+        ttl = self.link_ttl(urls)
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        self._cobalt[link_key] = (now + ttl, now, response)
+        self._cobalt.move_to_end(link_key)
+        while len(self._cobalt) > self.max_cobalt_entries:
+            self._cobalt.popitem(last=False)
+
+    def cobalt_stored_at(self, link_key: str) -> Optional[float]:
+        """When (on the monotonic clock) the cached Cobalt response for a link was stored."""
+        entry = self._cobalt.get(link_key)
+        return entry[1] if entry else None
+
+    def drop_cobalt(self, link_key: str):
+        """Forget a cached Cobalt response whose links stopped working."""
+        self._cobalt.pop(link_key, None)
+
+    def link_ttl(self, urls: List[Optional[str]]) -> float:
+        """How long download links can be reused; tunnel links expire sooner than the rest."""
+        if any(url and is_tunnel_url(url) for url in urls):
+            return min(self.cobalt_ttl, self.tunnel_ttl)
+        return self.cobalt_ttl
+
+    def cached_item_count(self, link_key: str, max_item_bytes: Optional[int] = None) -> int:
+        """
+        Returns the number of items in a post if every one of them is cached (and no
+        bigger than ``max_item_bytes``, if given), otherwise 0.
+        """
+        for total, count in self._link_items.get(link_key, {}).items():
+            if count != total:
+                continue
+            sizes = [self._media[self._media_key(link_key, i, total)][1] for i in range(1, total + 1)]
+            if max_item_bytes is None or all(size <= max_item_bytes for size in sizes):
+                return total
+        return 0
+
+    def get_media(self, link_key: str, item_num: int, total_items: int) -> Optional[Path]:
+        key = self._media_key(link_key, item_num, total_items)
+        entry = self._media.get(key)
+        if entry and entry[0].exists():
+            self.media_hits += 1
+            self._media.move_to_end(key)
+            try:
+                os.utime(entry[0])  # Keep LRU order across restarts
+            except OSError:
+                pass
+            return entry[0]
+        if entry:
+            self._forget(key)
+        self.media_misses += 1
+        return None
+
+    async def put_media(self, link_key: str, item_num: int, total_items: int, file_ext: str,
+                        data: BinaryIO, size: int) -> Optional[Path]:
+        """Store downloaded media on disk, evicting old entries to stay under the size limit."""
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return None
+
+        key = self._media_key(link_key, item_num, total_items)
+        path = self.directory / f"{key}{file_ext}"
+        try:
+            await asyncio.to_thread(self._write_file, path, data)
+        except OSError as e:
+            log.warning(f"⚠️ Could not write {path.name} to media cache: {e}")
+            return None
+
+        if key in self._media:
+            self._forget(key)
+        self._media[key] = (path, size)
+        self._media_bytes += size
+        self._count_item(key, 1)
+
+        while self._media_bytes > self.max_bytes and self._media:
+            old_key = next(iter(self._media))
+            self._forget(old_key, unlink=True)
+            self.evictions += 1
+        return path
+
+    @staticmethod
+    def _write_file(path: Path, data: BinaryIO):
+        tmp_path = path.with_name(path.name + ".tmp")
+        start = data.tell()
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(data, f)
+        finally:
+            data.seek(start)
+        os.replace(tmp_path, path)
+
+    def _forget(self, key: str, unlink: bool = False):
+        path, size = self._media.pop(key)
+        self._media_bytes -= size
+        self._count_item(key, -1)
+        if unlink:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cobalt_entries": len(self._cobalt),
+            "cobalt_hits": self.cobalt_hits,
+            "cobalt_misses": self.cobalt_misses,
+            "media_files": len(self._media),
+            "media_bytes": self._media_bytes,
+            "media_hits": self.media_hits,
+            "media_misses": self.media_misses,
+            "evictions": self.evictions,
+        }
+
+
+class QualityMemory:
+    """
+    Remembers which Cobalt quality tier fitted, per link and upload limit, and
+    recently per platform and upload limit, so later requests can start at the
+    tier likely to fit instead of working down from the top every time.
+    """
+
+    def __init__(self, max_links: int = 5000, history: int = 20):
+        self.max_links = max_links
+        self.history = history
+        self._links: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self._recent: Dict[Tuple[str, int], Deque[int]] = {}
+
+        self.link_hits = 0
+        self.step_downs = 0  # Extra Cobalt requests spent stepping down a tier
+
+    def for_link(self, link_key: str, upload_limit: int) -> Optional[int]:
+        tier = self._links.get((link_key, upload_limit))
+        if tier is not None:
+            self._links.move_to_end((link_key, upload_limit))
+        return tier
+
+    def start_tier(self, platform: str, upload_limit: int) -> int:
+        """Where to start for a link we haven't seen: the lower median of what recently fitted."""
+        recent = self._recent.get((platform, upload_limit))
+        if not recent:
+            return 0
+        return sorted(recent)[(len(recent) - 1) // 2]
+
+    def record(self, link_key: str, platform: str, upload_limit: int, tier: int):
+        self._links[(link_key, upload_limit)] = tier
+        self._links.move_to_end((link_key, upload_limit))
+        while len(self._links) > self.max_links:
+            self._links.popitem(last=False)
+        self._recent.setdefault((platform, upload_limit), deque(maxlen=self.history)).append(tier)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "links": len(self._links),
+            "link_hits": self.link_hits,
+            "step_downs": self.step_downs,
+            "start_tiers": {(platform, limit): quality_tier_label(self.start_tier(platform, limit))
+                            for platform, limit in self._recent},
+        }
+
+
+class SubmissionStore:
+    """
+    SQLite index of every showcase-eligible message in each guild's submission
+    channel, so a showcase can pick from the whole history without scanning it.
+
+    Each row gets a random sort key when it is inserted; picking a random
+    submission is then a single indexed lookup for the first key at or after
+    a random point.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS submissions (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            content TEXT NOT NULL DEFAULT '',
+            attachments TEXT NOT NULL DEFAULT '[]',
+            created_at TEXT NOT NULL,
+            showcased INTEGER NOT NULL DEFAULT 0,
+            rand_key REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_submissions_pick
+            ON submissions (guild_id, channel_id, showcased, rand_key);
+        CREATE TABLE IF NOT EXISTS backfills (
+            channel_id INTEGER PRIMARY KEY,
+            completed_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS media_hashes (
+            message_id INTEGER NOT NULL,
+            item_num INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            PRIMARY KEY (message_id, item_num)
+        );
+        CREATE TABLE IF NOT EXISTS duplicates (
+            message_id INTEGER PRIMARY KEY,
+            duplicate_of INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_duplicates_of ON duplicates (duplicate_of);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    async def _run(self, fn: Callable, *args):
+        """Run a database call off the event loop, one at a time."""
+        def locked():
+            with self._lock:
+                result = fn(*args)
+                self._db.commit()
+                return result
+        return await asyncio.to_thread(locked)
+
+    @staticmethod
+    def attachment_metadata(attachments) -> str:
+        return json.dumps([
+            {"id": a.id, "filename": a.filename, "size": a.size, "content_type": a.content_type}
+            for a in attachments
+        ])
+
+    def _add_many(self, rows: List[Tuple]):
+        self._db.executemany(
+            "INSERT OR IGNORE INTO submissions "
+            "(message_id, guild_id, channel_id, author_id, content, attachments, created_at, rand_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [row + (random.random(),) for row in rows]
+        )
+
+    @classmethod
+    def _row(cls, message: discord.Message) -> Tuple:
+        return (message.id, message.guild.id, message.channel.id, message.author.id, message.content or "",
+                cls.attachment_metadata(message.attachments), message.created_at.isoformat())
+
+    async def add(self, message: discord.Message):
+        await self._run(self._add_many, [self._row(message)])
+
+    async def add_many(self, messages: List[discord.Message]):
+        if messages:
+            await self._run(self._add_many, [self._row(m) for m in messages])
+
+    async def remove(self, message_ids: List[int]) -> List[int]:
+        """
+        Forget deleted submissions, returning the ids that were forgotten. Showcased ones
+        (usually deleted by us after the showcase) are kept, along with their hashes and
+        reposts, so reposts of something already showcased stay flagged.
+        """
+        def delete() -> List[int]:
+            showcased = set()
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                showcased.update(row[0] for row in self._db.execute(
+                    f"SELECT message_id FROM submissions WHERE showcased = 1 "
+                    f"AND message_id IN ({','.join('?' * len(chunk))})", chunk))
+            forgotten = [mid for mid in message_ids if mid not in showcased]
+            rows = [(mid,) for mid in forgotten]
+            self._db.executemany("DELETE FROM submissions WHERE message_id = ?", rows)
+            self._db.executemany("DELETE FROM media_hashes WHERE message_id = ?", rows)
+            # A repost of a submission deleted before its showcase is no longer a duplicate of anything
+            self._db.executemany("DELETE FROM duplicates WHERE message_id = ? OR duplicate_of = ?",
+                                 [(mid, mid) for mid in forgotten])
+            return forgotten
+        return await self._run(delete)
+
+    async def update(self, message_id: int, content: Optional[str] = None, attachments: Optional[str] = None):
+        if content is not None:
+            await self._run(lambda: self._db.execute(
+                "UPDATE submissions SET content = ? WHERE message_id = ?", (content, message_id)))
+        if attachments is not None:
+            await self._run(lambda: self._db.execute(
+                "UPDATE submissions SET attachments = ? WHERE message_id = ?", (attachments, message_id)))
+
+    async def mark_showcased(self, message_id: int):
+        await self._run(lambda: self._db.execute(
+            "UPDATE submissions SET showcased = 1 WHERE message_id = ?", (message_id,)))
+
+    def _pick_random(self, guild_id: int, channel_id: int) -> Optional[int]:
+        point = random.random()
+        query = ("SELECT message_id FROM submissions WHERE guild_id = ? AND channel_id = ? AND showcased = 0 "
+                 "AND message_id NOT IN (SELECT message_id FROM duplicates) "
+                 "AND rand_key {} ? ORDER BY rand_key {} LIMIT 1")
+        row = self._db.execute(query.format(">=", "ASC"), (guild_id, channel_id, point)).fetchone()
+        if row is None:
+            # Wrap around to the start of the key space
+            row = self._db.execute(query.format("<", "ASC"), (guild_id, channel_id, point)).fetchone()
+        return row[0] if row else None
+
+    async def pick_random(self, guild_id: int, channel_id: int) -> Optional[int]:
+        """Returns the id of a random submission that hasn't been showcased yet."""
+        return await self._run(self._pick_random, guild_id, channel_id)
+
+    # SQLite integers are signed, so 64-bit hashes are stored shifted into that range
+    @staticmethod
+    def _to_signed(value: int) -> int:
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    async def add_hashes(self, guild_id: int, message_id: int, hashes: List[int]):
+        await self._run(lambda: self._db.executemany(
+            "INSERT OR REPLACE INTO media_hashes (message_id, item_num, guild_id, hash) VALUES (?, ?, ?, ?)",
+            [(message_id, idx + 1, guild_id, self._to_signed(h)) for idx, h in enumerate(hashes)]))
+
+    async def load_hashes(self) -> List[Tuple[int, int, int]]:
+        """Every stored (guild id, message id, hash)."""
+        rows = await self._run(lambda: self._db.execute(
+            "SELECT guild_id, message_id, hash FROM media_hashes ORDER BY message_id").fetchall())
+        return [(guild_id, message_id, h & ((1 << 64) - 1)) for guild_id, message_id, h in rows]
+
+    async def mark_duplicate(self, message_id: int, duplicate_of: int):
+        await self._run(lambda: self._db.execute(
+            "INSERT OR REPLACE INTO duplicates (message_id, duplicate_of) VALUES (?, ?)", (message_id, duplicate_of)))
+
+    async def count(self, guild_id: int, channel_id: int) -> Tuple[int, int]:
+        """Returns (total submissions, submissions not yet showcased) for a channel."""
+        return await self._run(lambda: self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(showcased = 0), 0) FROM submissions WHERE guild_id = ? AND channel_id = ?",
+            (guild_id, channel_id)).fetchone())
+
+    async def is_backfilled(self, channel_id: int) -> bool:
+        return await self._run(lambda: self._db.execute(
+            "SELECT 1 FROM backfills WHERE channel_id = ?", (channel_id,)).fetchone() is not None)
+
+    async def mark_backfilled(self, channel_id: int):
+        await self._run(lambda: self._db.execute(
+            "INSERT OR REPLACE INTO backfills (channel_id, completed_at) VALUES (?, ?)",
+            (channel_id, datetime.now().isoformat())))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+@dataclass
+class JournalEntry:
+    """An ingest job as recorded in the journal."""
+    job_id: int
+    guild_id: int
+    channel_id: int
+    message_id: int
+    url: str
+    state: str
+    resolved_at: Optional[float] = None
+    original_deleted: bool = False
+    cache_key: Optional[str] = None  # Media cache key of the quality tier the links were resolved at
+    download_urls: List[Optional[str]] = field(default_factory=list)
+    item_states: Dict[int, str] = field(default_factory=dict)  # item number -> pending/downloaded/posted
+
+    def posted_items(self) -> set:
+        return {item_num for item_num, state in self.item_states.items() if state == "posted"}
+
+
+class IngestJournal:
+    """
+    SQLite record of every ingest job and how far each of its items has got, so
+    jobs interrupted by a restart can carry on from their last completed step.
+
+    A job is queued, then resolved (Cobalt has returned its download links), then
+    done or failed. Each item goes pending -> downloaded (in the media cache) ->
+    posted. Steps are recorded straight after they succeed, so at most the step
+    in progress during a crash is repeated.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            resolved_at REAL,
+            original_deleted INTEGER NOT NULL DEFAULT 0,
+            cache_key TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_ingest_jobs_state ON ingest_jobs (state);
+        CREATE TABLE IF NOT EXISTS ingest_items (
+            job_id INTEGER NOT NULL REFERENCES ingest_jobs (job_id) ON DELETE CASCADE,
+            item_num INTEGER NOT NULL,
+            download_url TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (job_id, item_num)
+        );
+    """
+
+    UNFINISHED = ("queued", "resolved")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(self.SCHEMA)
+        # Journals written before the cache key was recorded
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(ingest_jobs)")}
+        if "cache_key" not in columns:
+            self._db.execute("ALTER TABLE ingest_jobs ADD COLUMN cache_key TEXT")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    async def _run(self, fn: Callable, *args):
+        """Run a database call off the event loop, one at a time."""
+        def locked():
+            with self._lock:
+                result = fn(*args)
+                self._db.commit()
+                return result
+        return await asyncio.to_thread(locked)
+
+    def _touch(self, job_id: int, **columns):
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        self._db.execute(f"UPDATE ingest_jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                         (*columns.values(), datetime.now().isoformat(), job_id))
+
+    async def create(self, guild_id: int, channel_id: int, message_id: int, url: str) -> int:
+        def insert():
+            now = datetime.now().isoformat()
+            return self._db.execute(
+                "INSERT INTO ingest_jobs (guild_id, channel_id, message_id, url, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (guild_id, channel_id, message_id, url, now, now)).lastrowid
+        return await self._run(insert)
+
+    async def resolve(self, job_id: int, download_urls: List[Optional[str]], cache_key: Optional[str] = None):
+        """
+        Record the download links Cobalt returned and the media cache key of their quality
+        tier; item states are kept if the job is re-resolved.
+        """
+        def write():
+            self._db.executemany(
+                "INSERT INTO ingest_items (job_id, item_num, download_url) VALUES (?, ?, ?) "
+                "ON CONFLICT(job_id, item_num) DO UPDATE SET "
+                "download_url = COALESCE(excluded.download_url, ingest_items.download_url)",
+                [(job_id, idx + 1, url) for idx, url in enumerate(download_urls)])
+            self._touch(job_id, state="resolved", resolved_at=time.time(), cache_key=cache_key)
+        await self._run(write)
+
+    async def mark_items(self, job_id: int, item_nums: List[int], state: str):
+        await self._run(lambda: self._db.executemany(
+            "UPDATE ingest_items SET state = ? WHERE job_id = ? AND item_num = ?",
+            [(state, job_id, item_num) for item_num in item_nums]))
+
+    async def mark_original_deleted(self, job_id: int):
+        await self._run(lambda: self._touch(job_id, original_deleted=1))
+
+    async def finish(self, job_id: int, state: str = "done"):
+        await self._run(lambda: self._touch(job_id, state=state))
+
+    def _entry(self, row: Tuple) -> JournalEntry:
+        entry = JournalEntry(job_id=row[0], guild_id=row[1], channel_id=row[2], message_id=row[3], url=row[4],
+                             state=row[5], resolved_at=row[6], original_deleted=bool(row[7]), cache_key=row[8])
+        for item_num, download_url, state in self._db.execute(
+                "SELECT item_num, download_url, state FROM ingest_items WHERE job_id = ? ORDER BY item_num",
+                (entry.job_id,)):
+            entry.download_urls.append(download_url)
+            entry.item_states[item_num] = state
+        return entry
+
+    _COLUMNS = "job_id, guild_id, channel_id, message_id, url, state, resolved_at, original_deleted, cache_key"
+
+    async def get(self, job_id: int) -> Optional[JournalEntry]:
+        def read():
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return self._entry(row) if row else None
+        return await self._run(read)
+
+    async def unfinished(self) -> List[JournalEntry]:
+        """Every job that was still in progress, oldest first."""
+        return await self._run(lambda: [
+            self._entry(row) for row in self._db.execute(
+                f"SELECT {self._COLUMNS} FROM ingest_jobs WHERE state IN (?, ?) ORDER BY job_id",
+                self.UNFINISHED).fetchall()])
+
+    async def prune(self, max_age: timedelta):
+        """Forget finished jobs older than ``max_age``."""
+        cutoff = (datetime.now() - max_age).isoformat()
+        await self._run(lambda: self._db.execute(
+            "DELETE FROM ingest_jobs WHERE state NOT IN (?, ?) AND updated_at < ?", (*self.UNFINISHED, cutoff)))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_timezone(name: Optional[str]) -> tzinfo:
+    """
+    Returns the time zone for an IANA name (e.g. "Europe/London"). Falls back to
+    SHOWCASE_TIMEZONE and then to the machine's local time zone.
+    """
+    for candidate in (name, os.environ.get("SHOWCASE_TIMEZONE")):
+        if candidate:
+            try:
+                return ZoneInfo(candidate)
+            except (ZoneInfoNotFoundError, ValueError):
+                log.warning(f"⚠️ Unknown time zone {candidate!r}, ignoring")
+    return datetime.now().astimezone().tzinfo
+
+
+# --- Sharding ---
+
+def parse_shard_ids(value: str) -> List[int]:
+    """Parse a shard list like "0,1,2" or "0-3" (or a mix of both)."""
+    shard_ids = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return sorted(set(shard_ids))
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """The shard Discord routes a guild's events to."""
+    return (guild_id >> 22) % shard_count
+
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def next_showcase_time(guild_config: Dict, now: Optional[datetime] = None, catch_up: bool = False) -> datetime:
+    """
+    Returns when a guild's next showcase is due, as an aware datetime in the guild's time zone.
+    With ``catch_up``, a slot that already passed today without a showcase is due immediately.
+    """
+    tz = get_timezone(guild_config.get("timezone"))
+    now = now.astimezone(tz) if now else datetime.now(tz)
+    showcase_hour, showcase_minute = map(int, guild_config.get("showcase_time", "12:00").split(":"))
+
+    # Build the slot from the calendar date so DST changes land on the right wall-clock time
+    slot = datetime(now.year, now.month, now.day, showcase_hour, showcase_minute, tzinfo=tz)
+    if now >= slot:
+        if catch_up and guild_config.get("last_showcase_date") != now.strftime("%Y-%m-%d"):
+            return now
+        tomorrow = now.date() + timedelta(days=1)
+        slot = datetime(tomorrow.year, tomorrow.month, tomorrow.day, showcase_hour, showcase_minute, tzinfo=tz)
+    return slot
+
+
+class ShowcaseScheduler:
+    """
+    Min-heap of the next showcase time for each guild. The run loop sleeps until
+    the earliest entry is due, so each wake-up only touches guilds that are due.
+    Rescheduling a guild bumps its version, which makes its older heap entries stale.
+    """
+
+    # Wake up at least this often so long sleeps re-check the wall clock
+    MAX_SLEEP = 3600
+
+    def __init__(self, callback: Callable[[List[Tuple[int, float]]], Awaitable[None]]):
+        self.callback = callback
+        self._heap: List[Tuple[float, int, int]] = []  # (due timestamp, guild id, version)
+        self._versions: Dict[int, int] = {}
+        self._due: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()  # Callback tasks still in progress
+
+    def schedule(self, guild_id: int, due: datetime):
+        version = self._versions.get(guild_id, 0) + 1
+        self._versions[guild_id] = version
+        self._due[guild_id] = due.timestamp()
+        heapq.heappush(self._heap, (due.timestamp(), guild_id, version))
+        self._wakeup.set()
+
+    def unschedule(self, guild_id: int):
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        self._due.pop(guild_id, None)
+
+    def next_due(self, guild_id: int) -> Optional[float]:
+        return self._due.get(guild_id)
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0][2] != self._versions.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._drop_stale()
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, self.MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Pop everything that is due now and hand it off without waiting,
+            # so guilds due a little later aren't held up by this batch
+            now = time.time()
+            due_guilds = []
+            while self._heap and self._heap[0][0] <= now:
+                due, guild_id, version = heapq.heappop(self._heap)
+                if version == self._versions.get(guild_id):
+                    self._due.pop(guild_id, None)
+                    due_guilds.append((guild_id, due))
+
+            if due_guilds:
+                task = asyncio.create_task(self.callback(due_guilds))
+                self._running.add(task)
+                task.add_done_callback(self._callback_done)
+
+    def _callback_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            log.error(f"❌ Error running scheduled showcases: {task.exception()}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def stop(self):
+        tasks = list(self._running)
+        if self._task:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+
+class ConfigStore:
+    """
+    Guild configuration stored one row per guild in SQLite.
+
+    Changes are write-behind: save() only marks a guild dirty, and the dirty
+    guilds are written together in one transaction, off the event loop, after
+    a short debounce. A crash can lose at most the last debounce window, never
+    corrupt the other guilds.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path: Path, legacy_json: Optional[Path] = None, debounce: float = 2.0):
+        self.path = path
+        self.legacy_json = legacy_json
+        self.debounce = debounce
+        self.configs: Dict[int, Dict] = {}
+        self.writes = 0
+
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+
+    def _migrate(self):
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version > self.SCHEMA_VERSION:
+            raise RuntimeError(f"{self.path} has schema version {version}, "
+                               f"this version of the bot only understands up to {self.SCHEMA_VERSION}")
+        if version < 1:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS guild_configs ("
+                "guild_id INTEGER PRIMARY KEY, config TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            self._db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._db.commit()
+
+    def load(self, owns: Optional[Callable[[int], bool]] = None) -> Dict[int, Dict]:
+        """
+        Load guild configurations, importing the old JSON file the first time. When
+        several processes share the database, ``owns`` limits this one to its guilds.
+        """
+        stored = 0
+        for guild_id, raw in self._db.execute("SELECT guild_id, config FROM guild_configs"):
+            stored += 1
+            if owns and not owns(guild_id):
+                continue
+            try:
+                self.configs[guild_id] = json.loads(raw)
+            except ValueError as e:
+                # Only this guild falls back to defaults; the rest load normally
+                log.error(f"❌ Could not read configuration for guild {guild_id}: {e}")
+
+        if not stored and self.legacy_json and self.legacy_json.exists():
+            try:
+                with open(self.legacy_json, 'r') as f:
+                    data = json.load(f)
+                imported = {int(k): v for k, v in data.items()}
+                self._write({guild_id: json.dumps(config) for guild_id, config in imported.items()})
+                self.configs = {guild_id: config for guild_id, config in imported.items() if not owns or owns(guild_id)}
+                log.info(f"📦 Imported {len(imported)} guild configuration(s) from {self.legacy_json}")
+            except Exception as e:
+                log.error(f"❌ Error importing {self.legacy_json}: {e}")
+
+        return self.configs
+
+    def save(self, guild_id: int):
+        """Mark a guild's configuration as changed and schedule a flush."""
+        self._dirty.add(guild_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.debounce)
+        await self.flush()
+
+    async def flush(self):
+        """Write all dirty guilds now."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        # Serialise on the loop so the snapshot can't change while the thread writes it
+        rows = {guild_id: json.dumps(self.configs[guild_id]) for guild_id in dirty if guild_id in self.configs}
+        try:
+            await asyncio.to_thread(self._write, rows)
+            log.debug(f"✅ Saved configuration for {len(rows)} guild(s)")
+        except Exception as e:
+            log.error(f"❌ Error saving configuration: {e}")
+            self._dirty |= dirty  # Try again on the next flush
+
+    def _write(self, rows: Dict[int, str]):
+        now = datetime.now().isoformat()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO guild_configs (guild_id, config, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET config = excluded.config, updated_at = excluded.updated_at",
+                [(guild_id, raw, now) for guild_id, raw in rows.items()]
+            )
+        self.writes += len(rows)
+
+    async def close(self):
+        """Flush anything pending and close the database."""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        with self._lock:
+            self._db.close()
+
+
+class RateLimitCounter(logging.Handler):
+    """Counts the 429s that the Discord library handles (and retries) internally."""
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.rate_limited = 0
+        self.global_rate_limited = 0
+
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str):
+            if record.msg.startswith("We are being rate limited"):
+                self.rate_limited += 1
+            elif record.msg.startswith("Global rate limit"):
+                self.global_rate_limited += 1
+
+
+class DiscordSender:
+    """
+    Single outbound path for the messages the bot sends, edits and deletes.
+
+    Each channel has a token bucket sized to Discord's per-channel limit and a
+    priority queue, so media posts go out before status messages and status
+    cleanups wait behind both. Status edits are coalesced: within the window
+    only the latest content for a message is sent.
+    """
+
+    HIGH = 0  # Media posts and showcases
+    NORMAL = 1  # Status messages and replies
+    LOW = 2  # Status cleanups
+
+    def __init__(self, rate: int = 5, per: float = 5.0, edit_window: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self.edit_window = edit_window
+
+        self._queues: Dict[int, asyncio.PriorityQueue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._tokens: Dict[int, Tuple[float, float]] = {}  # channel id -> (tokens, last refill)
+        self._next_prune = 0.0
+        self._pending_edits: Dict[int, Tuple[discord.Message, Dict[str, Any]]] = {}
+        self._edit_tasks: Dict[int, asyncio.Task] = {}
+        self._cleanups: set = set()  # delete_later tasks
+        self._seq = itertools.count()
+
+        self.rate_limits = RateLimitCounter()
+        logging.getLogger("discord.http").addHandler(self.rate_limits)
+
+        self.sent = 0
+        self.coalesced_edits = 0
+        self.total_queued = 0.0
+        self.max_queued = 0.0
+
+    async def _take_token(self, channel_id: int):
+        while True:
+            now = time.monotonic()
+            tokens, last = self._tokens.get(channel_id, (float(self.rate), now))
+            tokens = min(float(self.rate), tokens + (now - last) * self.rate / self.per)
+            if tokens >= 1:
+                self._tokens[channel_id] = (tokens - 1, now)
+                return
+            self._tokens[channel_id] = (tokens, now)
+            await asyncio.sleep((1 - tokens) * self.per / self.rate)
+
+    def _prune_tokens(self):
+        """
+        Forget buckets untouched for a whole window: they have refilled, and a missing
+        bucket counts as full, so channels the bot posted to once don't stay around.
+        """
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.per
+        for channel_id in [c for c, (_, last) in self._tokens.items()
+                           if now - last >= self.per and c not in self._workers]:
+            del self._tokens[channel_id]
+
+    async def _worker(self, channel_id: int):
+        queue = self._queues[channel_id]
+        try:
+            while not queue.empty():
+                _, _, enqueued, call, future = queue.get_nowait()
+                if future.cancelled():
+                    continue
+                await self._take_token(channel_id)
+                waited = time.monotonic() - enqueued
+                self.total_queued += waited
+                self.max_queued = max(self.max_queued, waited)
+                try:
+                    result = await call()
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                self.sent += 1
+        finally:
+            # Idle channels don't keep a worker around
+            del self._workers[channel_id]
+            if queue.empty():
+                self._queues.pop(channel_id, None)
+            self._prune_tokens()
+
+    def _submit(self, channel_id: int, priority: int, call: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(channel_id, asyncio.PriorityQueue())
+        queue.put_nowait((priority, next(self._seq), time.monotonic(), call, future))
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._worker(channel_id))
+        return future
+
+    async def send(self, channel: discord.abc.Messageable, priority: int = NORMAL, **kwargs) -> discord.Message:
+        """Send a message once the channel's rate limit and queue allow it."""
+        return await self._submit(channel.id, priority, lambda: channel.send(**kwargs))
+
+    async def edit(self, message: discord.Message, **kwargs):
+        """
+        Edit a message. Edits made within the coalescing window replace each other,
+        and only the latest is sent. Returns without waiting for the edit to go out.
+        """
+        if message.id in self._pending_edits:
+            self.coalesced_edits += 1
+        self._pending_edits[message.id] = (message, kwargs)
+        if message.id not in self._edit_tasks:
+            self._edit_tasks[message.id] = asyncio.create_task(self._flush_edit(message.id))
+
+    async def _flush_edit(self, message_id: int):
+        try:
+            await asyncio.sleep(self.edit_window)
+        finally:
+            self._edit_tasks.pop(message_id, None)
+        pending = self._pending_edits.pop(message_id, None)
+        if not pending:
+            return
+        message, kwargs = pending
+        try:
+            await self._submit(message.channel.id, self.NORMAL, lambda: message.edit(**kwargs))
+        except discord.NotFound:
+            pass
+        except Exception as e:
+            log.warning(f"⚠️ Could not edit message {message_id}: {e}")
+
+    async def delete(self, message: discord.Message, priority: int = NORMAL, delay: float = 0):
+        """Delete a message (after ``delay`` seconds), dropping any edits still waiting for it."""
+        if delay:
+            await asyncio.sleep(delay)
+        self._pending_edits.pop(message.id, None)
+        edit_task = self._edit_tasks.pop(message.id, None)
+        if edit_task:
+            edit_task.cancel()
+        await self._submit(message.channel.id, priority, message.delete)
+
+    def delete_later(self, message: discord.Message, delay: float = 0):
+        """Queue a low-priority cleanup delete without waiting for it."""
+        async def cleanup():
+            try:
+                await self.delete(message, priority=self.LOW, delay=delay)
+            except discord.NotFound:
+                pass
+            except Exception as e:
+                log.warning(f"⚠️ Could not delete message {message.id}: {e}")
+        task = asyncio.create_task(cleanup())
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    async def stop(self):
+        """Cancel queued sends, coalesced edits and pending cleanups."""
+        tasks = [*self._workers.values(), *self._edit_tasks.values(), *self._cleanups]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "queued": sum(q.qsize() for q in self._queues.values()),
+            "coalesced_edits": self.coalesced_edits,
+            "rate_limited": self.rate_limits.rate_limited,
+            "global_rate_limited": self.rate_limits.global_rate_limited,
+            "avg_queued": self.total_queued / self.sent if self.sent else 0.0,
+            "max_queued": self.max_queued,
+        }
+
+
+@dataclass
+class LoopBlock:
+    """Where the event loop was stuck, aggregated over every time it was stuck there."""
+    callsite: str
+    task: str
+    count: int = 0
+    total: float = 0.0
+    worst: float = 0.0
+    stack: str = ""  # From the worst occurrence
+
+
+class LoopMonitor:
+    """
+    Watches the event loop for lag and for calls that block it.
+
+    A sampler task sleeps for ``interval`` and records how late it wakes up. A
+    watchdog thread pings the loop; if the ping isn't answered within
+    ``threshold`` it snapshots the loop thread's stack and current task, then
+    waits for the loop to recover to time the whole stall. Stalls are grouped
+    by the innermost line of this bot's code in the stack.
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1, window: int = 2400, max_callsites: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_callsites = max_callsites
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.blocks: Dict[str, LoopBlock] = {}
+        self.block_count = 0
+        self.last_block: Optional[LoopBlock] = None
+        self.last_block_at: Optional[float] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()  # blocks are written by the watchdog thread
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 5)
+            self._thread = None
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def _watch(self):
+        while not self._stop.is_set():
+            pinged = time.monotonic()
+            answered = threading.Event()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return  # Loop closed
+            if not answered.wait(self.threshold):
+                task, stack = self._snapshot()
+                while not answered.wait(0.5):
+                    if self._stop.is_set():
+                        return
+                self._record(time.monotonic() - pinged, task, stack)
+            self._stop.wait(self.interval)
+
+    def _snapshot(self) -> Tuple[str, traceback.StackSummary]:
+        """What the loop thread is doing right now, seen from the watchdog thread."""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame else traceback.StackSummary()
+        try:
+            current = asyncio.current_task(self._loop)
+        except RuntimeError:
+            current = None
+        if current is None:
+            task = "(callback)"
+        else:
+            coro = current.get_coro()
+            task = f"{current.get_name()} {getattr(coro, '__qualname__', coro)}"
+        return task, stack
+
+    def _record(self, duration: float, task: str, stack: traceback.StackSummary):
+        # Blame the innermost line of our own code, falling back to wherever the loop was
+        ours = [f for f in stack if f.filename == __file__]
+        frame = ours[-1] if ours else (stack[-1] if stack else None)
+        callsite = f"{Path(frame.filename).name}:{frame.lineno} in {frame.name}" if frame else "unknown"
+        key = f"{callsite} ({task})"
+
+        with self._lock:
+            block = self.blocks.get(key)
+            if block is None:
+                if len(self.blocks) >= self.max_callsites:
+                    # Forget the least significant callsite to keep memory bounded
+                    del self.blocks[min(self.blocks, key=lambda k: self.blocks[k].total)]
+                block = self.blocks[key] = LoopBlock(callsite=callsite, task=task)
+            block.count += 1
+            block.total += duration
+            if duration >= block.worst:
+                block.worst = duration
+                block.stack = "".join(traceback.format_list(stack[-8:]))
+            self.block_count += 1
+            self.last_block = block
+            self.last_block_at = time.time()
+        LOOP_BLOCKS.inc()
+        # Logged from the watchdog thread; logging is thread-safe
+        log.warning(f"🐢 Event loop blocked for {duration * 1000:.0f} ms at {callsite}",
+                    extra={"callsite": callsite, "task": task, "duration": round(duration, 3)})
+
+    def percentile(self, fraction: float) -> float:
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def worst_offenders(self, limit: int = 5) -> List[LoopBlock]:
+        with self._lock:
+            return sorted(self.blocks.values(), key=lambda b: b.total, reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self.lags),
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": max(self.lags, default=0.0),
+            "blocks": self.block_count,
+        }
+
+
+class BoomerBoxBot(commands.AutoShardedBot):
+    def __init__(self, **options):
+        intents = discord.Intents.default()
+        intents.message_content = True
+
+        # Lean gateway mode: only the intents and caches the bot actually uses, and message
+        # events from channels other than the submission channels dropped before parsing
+        self.lean_gateway = os.environ.get("LEAN_GATEWAY", "false").lower() == "true"
+        if self.lean_gateway:
+            intents = discord.Intents.none()
+            intents.guilds = True
+            intents.guild_messages = True
+            intents.message_content = True
+            options.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+            options.setdefault("chunk_guilds_at_startup", False)
+            options.setdefault("cache_default_sounds", False)
+        message_cache = os.environ.get("MESSAGE_CACHE_SIZE", "0" if self.lean_gateway else None)
+        if message_cache is not None:
+            options.setdefault("max_messages", int(message_cache) or None)
+        self.watched_channels: set = set()
+        self.dropped_events: Dict[str, int] = {event: 0 for event in FILTERED_GATEWAY_EVENTS}
+
+        # Shards this process runs; by default every shard Discord recommends
+        shard_count = os.environ.get("SHARD_COUNT")
+        shard_ids = os.environ.get("SHARD_IDS")
+        if shard_count:
+            options.setdefault("shard_count", int(shard_count))
+            if shard_ids:
+                options.setdefault("shard_ids", parse_shard_ids(shard_ids))
+        self.cluster_id = os.environ.get("CLUSTER_ID")
+
+        super().__init__(command_prefix='!', intents=intents, **options)
+        if self.lean_gateway:
+            self.install_event_filter()
+
+        # Load configuration from environment
+        self.cobalt_pool = CobaltPool(
+            load_cobalt_backends(),
+            timeout=float(os.environ.get("COBALT_TIMEOUT", "15")),
+            failure_threshold=int(os.environ.get("COBALT_FAILURE_THRESHOLD", "3")),
+            health_interval=float(os.environ.get("COBALT_HEALTH_INTERVAL", "15"))
+        )
+
+        # Shared HTTP session for Cobalt and media downloads, created in start()
+        self.http_session: Optional[aiohttp.ClientSession] = None
+
+        # Outbound messages, edits and deletes
+        self.sender = DiscordSender(
+            rate=int(os.environ.get("DISCORD_CHANNEL_RATE", "5")),
+            per=float(os.environ.get("DISCORD_CHANNEL_RATE_PERIOD", "5")),
+            edit_window=float(os.environ.get("STATUS_EDIT_WINDOW", "1"))
+        )
+
+        # Worker pool that processes submitted links
+        self.ingest_queue = IngestQueue(
+            self.run_ingest_job,
+            workers=int(os.environ.get("INGEST_WORKERS", "4")),
+            max_size=int(os.environ.get("INGEST_QUEUE_SIZE", "100")),
+            max_per_guild=int(os.environ.get("INGEST_QUEUE_PER_GUILD", "20"))
+        )
+
+        # How many carousel items are downloaded at the same time
+        self.carousel_concurrency = int(os.environ.get("CAROUSEL_DOWNLOAD_CONCURRENCY", "4"))
+
+        # Limit on media held in memory across all jobs
+        self.memory_budget = MemoryBudget(int(float(os.environ.get("MEMORY_BUDGET_MB", "256")) * 1024 * 1024))
+
+        # Download retries: attempts per file, and retries shared by all files in one link
+        self.download_max_attempts = int(os.environ.get("DOWNLOAD_MAX_ATTEMPTS", "4"))
+        self.download_retry_budget = int(os.environ.get("DOWNLOAD_RETRY_BUDGET", "6"))
+        self.download_stats = {"downloads": 0, "failed": 0, "retries": 0, "resumed_bytes": 0}
+
+        # Optional recompression of media that is too big to upload
+        self.media_optimization_default = os.environ.get("MEDIA_OPTIMIZATION", "oversized")
+        self.media_optimize_max_bytes = int(float(os.environ.get("MEDIA_OPTIMIZE_MAX_MB", "100")) * 1024 * 1024)
+        self.media_optimize_workers = int(os.environ.get("MEDIA_OPTIMIZE_WORKERS", "2"))
+        self.media_pool: Optional[ProcessPoolExecutor] = None
+        self.ffmpeg_available = bool(shutil.which("ffmpeg") and shutil.which("ffprobe"))
+        self.optimization_stats: Dict[int, Dict[str, int]] = {}
+
+        # Perceptual hashes of submitted media, used to spot reposts
+        self.duplicate_detection = os.environ.get("DUPLICATE_DETECTION", "true").lower() == "true"
+        self.duplicate_index = DuplicateIndex(int(os.environ.get("DUPLICATE_MAX_DISTANCE", "6")))
+        self.hash_max_bytes = int(float(os.environ.get("DUPLICATE_HASH_MAX_MB", "25")) * 1024 * 1024)
+
+        # Downloads bigger than this are spooled to a temporary file instead of memory
+        self.spool_limit = int(float(os.environ.get("DOWNLOAD_SPOOL_MB", "8")) * 1024 * 1024)
+
+        # Which platforms' links are downloaded from submission channels
+        platforms = os.environ.get("LINK_PLATFORMS", "").lower().replace(" ", "")
+        enabled = set(platforms.split(",")) if platforms else None
+        self.link_matcher = LinkMatcher([extractor for extractor in DEFAULT_LINK_EXTRACTORS
+                                         if enabled is None or extractor.platform in enabled])
+
+        # Cache for links that get posted more than once
+        self.media_cache = MediaCache(
+            self.cluster_path(Path(os.environ.get("MEDIA_CACHE_DIR", "media_cache"))),
+            max_bytes=int(float(os.environ.get("MEDIA_CACHE_MAX_MB", "500")) * 1024 * 1024),
+            cobalt_ttl=float(os.environ.get("COBALT_CACHE_TTL", "300")),
+            tunnel_ttl=float(os.environ.get("COBALT_TUNNEL_TTL", "60"))
+        )
+
+        # Step down Cobalt's quality until media fits the server's upload limit
+        self.adaptive_quality = os.environ.get("ADAPTIVE_QUALITY", "true").lower() == "true"
+        self.quality_memory = QualityMemory()
+
+        # Record of ingest jobs, replayed after a restart
+        self.ingest_journal = IngestJournal(Path(os.environ.get("INGEST_JOURNAL_PATH", "ingest_jobs.db")))
+        self._journal_recovered = False
+        self._cache_reported = False
+
+        # Index of submissions used to pick showcases
+        self.submission_store = SubmissionStore(Path(os.environ.get("SUBMISSION_DB_PATH", "submissions.db")))
+        self._backfill_tasks: Dict[int, asyncio.Task] = {}
+        self._background_tasks: set = set()  # Fire-and-forget work, cancelled before the stores close
+
+        # Next showcase time for every configured guild
+        self.showcase_scheduler = ShowcaseScheduler(self.run_due_showcases)
+        self.showcase_semaphore = asyncio.Semaphore(int(os.environ.get("SHOWCASE_CONCURRENCY", "5")))
+        self.showcase_timeout = float(os.environ.get("SHOWCASE_TIMEOUT", "300"))
+        self.showcase_timings: Dict[int, Dict[str, Any]] = {}
+
+        # Showcases are picked and downloaded this many seconds before their slot
+        self.staging_scheduler = ShowcaseScheduler(self.run_due_stagings)
+        self.showcase_lead_time = float(os.environ.get("SHOWCASE_PREFETCH_LEAD", "300"))
+        self.staging_dir = self.cluster_path(Path(os.environ.get("SHOWCASE_STAGING_DIR", "showcase_staging")))
+        self.staged_showcases: Dict[int, StagedShowcase] = {}
+
+        # Store bot configuration
+        self.config_store = ConfigStore(
+            Path(os.environ.get("CONFIG_DB_PATH", "guild_configs.db")),
+            legacy_json=Path("guild_configs.json"),
+            debounce=float(os.environ.get("CONFIG_SAVE_DELAY", "2"))
+        )
+        self.guild_configs: Dict[int, Dict] = {}
+        self.load_config()
+
+        # Event loop lag and blocking-call monitor
+        self.loop_monitor = LoopMonitor(
+            interval=float(os.environ.get("LOOP_LAG_INTERVAL", "0.25")),
+            threshold=float(os.environ.get("LOOP_BLOCK_THRESHOLD", "0.1"))
+        ) if os.environ.get("LOOP_MONITOR", "true").lower() == "true" else None
+
+        # Optional Prometheus endpoint, started in start()
+        self.metrics_port = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+        self.metrics_host = os.environ.get("METRICS_HOST", "127.0.0.1")
+        self._metrics_runner: Optional[aiohttp.web.AppRunner] = None
+        self.register_metrics()
+
+    def install_event_filter(self):
+        """
+        Drop message events from channels other than the submission channels before the
+        library turns them into objects. The parsers are swapped in place, so shards
+        connecting later pick them up too.
+        """
+        parsers = self._connection.parsers
+        for event in FILTERED_GATEWAY_EVENTS:
+            parsers[event] = self._filtered_parser(event, parsers[event])
+
+    def _filtered_parser(self, event: str, parser: Callable[[Dict[str, Any]], Any]) -> Callable[[Dict[str, Any]], None]:
+        watched = self.watched_channels
+        dropped = self.dropped_events
+
+        def parse(data: Dict[str, Any]):
+            channel_id = data.get("channel_id")
+            if channel_id is not None and int(channel_id) not in watched:
+                dropped[event] += 1
+                return
+            parser(data)
+        return parse
+
+    def refresh_watched_channels(self):
+        """Rebuild the set of submission channels whose message events we need."""
+        self.watched_channels.clear()
+        self.watched_channels.update(config["submission_channel_id"] for config in self.guild_configs.values()
+                                     if config.get("submission_channel_id"))
+
+    def cache_report(self) -> Dict[str, Any]:
+        """How many objects the library is holding on to, and the process's memory."""
+        guilds = self.guilds
+        rss = current_rss_bytes()
+        return {
+            "guilds": len(guilds),
+            "channels": sum(len(guild.channels) for guild in guilds),
+            "threads": sum(len(guild.threads) for guild in guilds),
+            "roles": sum(len(guild.roles) for guild in guilds),
+            "members": sum(len(guild.members) for guild in guilds),
+            "users": len(self.users),
+            "emojis": len(self.emojis),
+            "stickers": len(self.stickers),
+            "messages": len(self.cached_messages),
+            "message_cache_limit": self._connection.max_messages,
+            "dropped_events": sum(self.dropped_events.values()),
+            "rss_mb": rss / 1024 / 1024 if rss is not None else None,
+        }
+
+    def log_cache_report(self):
+        report = self.cache_report()
+        limit = report["message_cache_limit"]
+        log.info(f"📦 {'Lean' if self.lean_gateway else 'Default'} gateway caches: {report['guilds']} guild(s), "
+                 f"{report['channels']} channel(s), {report['threads']} thread(s), {report['roles']} role(s), "
+                 f"{report['members']} member(s), {report['users']} user(s), {report['emojis']} emoji(s), "
+                 f"{report['stickers']} sticker(s), {report['messages']} message(s) "
+                 f"(limit {limit if limit else 'off'})"
+                 + (f"; RSS {report['rss_mb']:.0f} MB" if report["rss_mb"] is not None else ""),
+                 extra=report)
+
+    def cluster_path(self, path: Path) -> Path:
+        """Give each cluster process its own copy of a working directory."""
+        return path / f"cluster-{self.cluster_id}" if self.cluster_id is not None else path
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether this process runs the shard that a guild belongs to."""
+        if self.shard_ids is None or not self.shard_count:
+            return True
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+    async def load_duplicate_index(self):
+        """Rebuild the in-memory duplicate index from the hashes stored with the submissions."""
+        try:
+            for guild_id, message_id, value_hash in await self.submission_store.load_hashes():
+                if self.owns_guild(guild_id):
+                    self.duplicate_index.add(guild_id, message_id, [value_hash])
+        except Exception as e:
+            log.error(f"❌ Error loading media hashes: {e}")
+            return
+        if self.duplicate_index.messages:
+            log.info(f"🧬 Loaded {self.duplicate_index.stats()['hashes']} media hash(es) "
+                     f"for {len(self.duplicate_index.messages)} submission(s)")
+
+    def register_metrics(self):
+        """Gauges read from the bot's own state each time the metrics are scraped."""
+        METRICS.gauge("boomerbox_gateway_latency_seconds", "Discord gateway heartbeat latency by shard",
+                      lambda: {(str(shard_id),): shard.latency for shard_id, shard in self.shards.items()
+                               if shard.latency == shard.latency},  # skip NaN before the first heartbeat
+                      ("shard",))
+        METRICS.gauge("boomerbox_guilds", "Guilds this process is in", lambda: len(self.guilds))
+        METRICS.gauge("boomerbox_configured_guilds", "Guilds with a configuration", lambda: len(self.guild_configs))
+        METRICS.gauge("boomerbox_ingest_inflight", "Links being processed right now", lambda: self.ingest_queue.active)
+        METRICS.gauge("boomerbox_ingest_queue_depth", "Links waiting for a worker", lambda: self.ingest_queue.stats()["depth"])
+        METRICS.gauge("boomerbox_ingest_rejected_total", "Links rejected because the queue was full",
+                      lambda: self.ingest_queue.rejected, kind="counter")
+        METRICS.gauge("boomerbox_cobalt_backend_up", "1 if a Cobalt backend is in rotation",
+                      lambda: {(b["name"],): int(b["state"] != "open") for b in self.cobalt_pool.stats()}, ("backend",))
+        METRICS.gauge("boomerbox_cobalt_backend_inflight", "Requests in flight per Cobalt backend",
+                      lambda: {(b["name"],): b["inflight"] for b in self.cobalt_pool.stats()}, ("backend",))
+        METRICS.gauge("boomerbox_media_memory_bytes", "Bytes of media held in memory",
+                      lambda: self.memory_budget.reserved)
+        METRICS.gauge("boomerbox_media_cache_bytes", "Bytes in the on-disk media cache",
+                      lambda: self.media_cache.stats()["media_bytes"])
+        METRICS.gauge("boomerbox_discord_queued_requests", "Discord requests waiting for a rate limit slot",
+                      lambda: self.sender.stats()["queued"])
+        METRICS.gauge("boomerbox_discord_rate_limited_total", "429 responses from Discord",
+                      lambda: self.sender.stats()["rate_limited"], kind="counter")
+        METRICS.gauge("boomerbox_showcases_staged", "Showcases staged ahead of their slot",
+                      lambda: len(self.staged_showcases))
+        METRICS.gauge("boomerbox_cached_messages", "Messages held in the library's message cache",
+                      lambda: len(self.cached_messages))
+        METRICS.gauge("boomerbox_gateway_events_dropped_total", "Message events dropped outside submission channels",
+                      lambda: {(event,): count for event, count in self.dropped_events.items()}, ("event",),
+                      kind="counter")
+
+    async def start_metrics_server(self):
+        """Serve /metrics in the Prometheus text format. Each cluster listens on METRICS_PORT + its id."""
+        async def metrics(request):
+            return aiohttp.web.Response(text=METRICS.render(), content_type="text/plain",
+                                        headers={"X-Content-Type-Options": "nosniff"})
+
+        app = aiohttp.web.Application()
+        app.router.add_get("/metrics", metrics)
+        self._metrics_runner = aiohttp.web.AppRunner(app, access_log=None)
+        await self._metrics_runner.setup()
+        port = self.metrics_port + int(self.cluster_id or 0)
+        await aiohttp.web.TCPSite(self._metrics_runner, self.metrics_host, port).start()
+        log.info(f"📈 Metrics available at http://{self.metrics_host}:{port}/metrics")
+
+    async def start_services(self):
+        """
+        Start everything except the Discord connection: the HTTP session, workers and
+        background monitors. Called by start(), and by the benchmarks, which run offline.
+        """
+        if self.http_session is None or self.http_session.closed:
+            self.http_session = create_http_session()
+        # Anything left in the staging area from a previous run is stale
+        await asyncio.to_thread(shutil.rmtree, self.staging_dir, True)
+        if self.media_pool is None and (Image is not None or self.ffmpeg_available):
+            self.media_pool = ProcessPoolExecutor(max_workers=self.media_optimize_workers)
+        if self.duplicate_detection:
+            missing = [what for what, available in (("images (install Pillow)", Image is not None),
+                                                    ("videos (install ffmpeg)", self.ffmpeg_available))
+                       if not available]
+            if missing:
+                log.warning(f"⚠️ Duplicate detection can't hash {' or '.join(missing)}; "
+                            f"reposts of those won't be flagged")
+        if self.duplicate_detection and not self.duplicate_index.messages:
+            await self.load_duplicate_index()
+        if self.loop_monitor:
+            self.loop_monitor.start()
+        if self.metrics_port is not None and self._metrics_runner is None:
+            await self.start_metrics_server()
+        self.ingest_queue.start()
+        self.cobalt_pool.start(self.http_session)
+
+    async def start(self, *args, **kwargs):
+        """Open the shared HTTP session before connecting to Discord."""
+        await self.start_services()
+        await super().start(*args, **kwargs)
+
+    async def stop_services(self):
+        """Stop the schedulers, workers and monitors, then close the HTTP session and databases."""
+        await self.showcase_scheduler.stop()
+        await self.staging_scheduler.stop()
+        await self.ingest_queue.stop()
+        # Background jobs (hashing, backfills, staging) would otherwise hit the closed stores below
+        background = list(self._background_tasks)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await self.sender.stop()
+        await self.cobalt_pool.stop()
+        if self.loop_monitor:
+            await self.loop_monitor.stop()
+        if self._metrics_runner:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+        if self.media_pool:
+            self.media_pool.shutdown(wait=False, cancel_futures=True)
+        if self.http_session and not self.http_session.closed:
+            await self.http_session.close()
+            log.info("🔌 Closed HTTP session")
+        self.submission_store.close()
+        self.ingest_journal.close()
+        await self.config_store.close()
+
+    async def close(self):
+        """Close the shared HTTP session along with the Discord connection."""
+        await super().close()
+        await self.stop_services()
+
+    def save_config(self, guild_id: int):
+        """Queue a guild's configuration to be written to the config store."""
+        self.refresh_watched_channels()
+        self.config_store.save(guild_id)
+
+    def load_config(self):
+        """Load all guild configurations from the config store."""
+        try:
+            self.guild_configs = self.config_store.load(owns=self.owns_guild)
+            if self.guild_configs:
+                log.info(f"✅ Loaded configuration for {len(self.guild_configs)} guild(s)")
+            else:
+                log.info("ℹ️ No existing configuration found, starting fresh")
+        except Exception as e:
+            log.error(f"❌ Error loading configuration: {e}")
+            self.guild_configs = self.config_store.configs
+        self.refresh_watched_channels()
+
+    def get_guild_config(self, guild_id: int) -> Dict:
+        """Get the configuration for a specific guild, creating it if it doesn't exist."""
+        if guild_id not in self.guild_configs:
+            self.guild_configs[guild_id] = {
+                "submission_channel_id": None,
+                "showcase_channel_id": None,
+                "last_showcase_date": None,
+                "showcase_time": "12:00",
+                "timezone": None,
+                "delete_after_showcase": True,
+                "media_optimization": None
+            }
+        return self.guild_configs[guild_id]
+
+    async def stage_showcase(self, guild_id: int,
+                             submission_channel: discord.TextChannel) -> Optional[StagedShowcase]:
+        """
+        Pick a random submission, download and verify its attachments into the staging
+        directory, and build its embed, so that posting it later is a single send.
+        Returns None if there is nothing to showcase.
+        """
+        log.info(f"🎲 Selecting random post from {submission_channel.name} in guild {guild_id}...")
+
+        # Pick a random submission from the index, skipping any that have since disappeared
+        chosen_message = None
+        for _ in range(5):
+            message_id = await self.submission_store.pick_random(guild_id, submission_channel.id)
+            if message_id is None:
+                break
+            try:
+                chosen_message = await submission_channel.fetch_message(message_id)
+                break
+            except discord.NotFound:
+                await self.submission_store.remove([message_id])
+
+        if not chosen_message:
+            return None
+
+        log.info(f"✅ Selected message from {chosen_message.author} in guild {guild_id}")
+
+        # Create showcase post
+        embed = discord.Embed(
+            title="🌟 Daily Showcase",
+            description=chosen_message.content if chosen_message.content else "",
+            color=discord.Color.gold()
+        )
+        embed.set_author(name=chosen_message.author.display_name, icon_url=chosen_message.author.display_avatar.url)
+
+        staged = StagedShowcase(guild_id=guild_id, message=chosen_message, embed=embed,
+                                directory=self.staging_dir / str(guild_id) / str(chosen_message.id))
+        await asyncio.to_thread(staged.directory.mkdir, parents=True, exist_ok=True)
+
+        # Handle attachments
+        for idx, attachment in enumerate(chosen_message.attachments):
+            reserved = 0
+            try:
+                # Download attachment, waiting for room in the memory budget first
+                reserved = await self.memory_budget.reserve(attachment.size)
+                file_data = await attachment.read()
+                if len(file_data) != attachment.size:
+                    raise ValueError(f"expected {attachment.size} bytes, got {len(file_data)}")
+
+                path = staged.directory / f"{idx}_{attachment.filename}"
+                await asyncio.to_thread(path.write_bytes, file_data)
+                del file_data
+                staged.files.append((path, attachment.filename))
+
+                # Set first image as embed thumbnail
+                if attachment.content_type and attachment.content_type.startswith("image") and not embed.image:
+                    embed.set_image(url=attachment.url)
+            except Exception as e:
+                log.warning(f"⚠️ Could not process attachment: {e}")
+            finally:
+                self.memory_budget.release(reserved)
 
-        # Load configuration from environment
-        self.cobalt_url = os.environ.get("COBALT_API_URL")
-        self.cobalt_key = os.environ.get("COBALT_API_KEY")
-        self.cf_header = os.environ.get("CLOUDFLARE_BYPASS_HEADER")
-        self.cf_value = os.environ.get("CLOUDFLARE_BYPASS_VALUE")
-        self.user_agent = os.environ.get("COBALT_USER_AGENT")
+        return staged
 
-        # Store bot configuration
-        self.config_file = Path("guild_configs.json")
-        self.guild_configs: Dict[int, Dict] = {}
-        self.load_config()
+    async def prestage_showcase(self, guild_id: int):
+        """Stage a guild's next showcase ahead of its slot."""
+        guild_config = self.guild_configs.get(guild_id)
+        if not guild_config:
+            return
+        submission_channel = self.get_channel(guild_config.get("submission_channel_id") or 0)
+        if not submission_channel:
+            return
 
-    def save_config(self):
-        """Save all guild configurations to a JSON file."""
+        await self.discard_staged(guild_id)
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.guild_configs, f, indent=2)
-            print(f"✅ Saved configuration for {len(self.guild_configs)} guild(s)")
+            staged = await self.stage_showcase(guild_id, submission_channel)
         except Exception as e:
-            print(f"❌ Error saving configuration: {e}")
+            log.warning(f"⚠️ Could not pre-stage showcase for guild {guild_id}: {e}")
+            return
+        if staged:
+            self.staged_showcases[guild_id] = staged
+            log.info(f"📦 Staged showcase for guild {guild_id} ({len(staged.files)} attachment(s))")
 
-    def load_config(self):
-        """Load all guild configurations from JSON file."""
-        try:
-            if self.config_file.exists():
-                with open(self.config_file, 'r') as f:
-                    data = json.load(f)
-                    # Convert string keys back to integers
-                    self.guild_configs = {int(k): v for k, v in data.items()}
-                print(f"✅ Loaded configuration for {len(self.guild_configs)} guild(s)")
-            else:
-                print("ℹ️ No existing configuration file found, starting fresh")
-        except Exception as e:
-            print(f"❌ Error loading configuration: {e}")
-            self.guild_configs = {}
+    async def discard_staged(self, guild_id: int):
+        staged = self.staged_showcases.pop(guild_id, None)
+        if staged:
+            await staged.cleanup()
 
-    def get_guild_config(self, guild_id: int) -> Dict:
-        """Get the configuration for a specific guild, creating it if it doesn't exist."""
-        if guild_id not in self.guild_configs:
-            self.guild_configs[guild_id] = {
-                "submission_channel_id": None,
-                "showcase_channel_id": None,
-                "last_showcase_date": None,
-                "showcase_time": "12:00",
-                "delete_after_showcase": True
-            }
-        return self.guild_configs[guild_id]
+    async def invalidate_staged(self, message_ids: List[int]):
+        """Drop staged showcases whose submission was edited, deleted or showcased, and pick another."""
+        for guild_id, staged in list(self.staged_showcases.items()):
+            if staged.message.id in message_ids:
+                log.info(f"♻️ Staged submission for guild {guild_id} changed, picking another")
+                await self.discard_staged(guild_id)
+                due = self.showcase_scheduler.next_due(guild_id)
+                if due and due > time.time():
+                    self.spawn(self.prestage_showcase(guild_id))
+
+    async def run_due_stagings(self, due_guilds: List[Tuple[int, float]]):
+        """Called by the staging scheduler when guilds enter their pre-staging window."""
+        async def stage_one(guild_id: int):
+            async with self.showcase_semaphore:
+                await self.prestage_showcase(guild_id)
+
+        await asyncio.gather(*(stage_one(guild_id) for guild_id, _ in due_guilds))
 
-    async def pick_and_showcase_post(self, guild_id: int):
-        """Randomly pick a post from a guild's submission channel and showcase it."""
+    async def pick_and_showcase_post(self, guild_id: int, use_staged: bool = True) -> Optional[discord.Message]:
+        """
+        Randomly pick a post from a guild's submission channel and showcase it, using the
+        pre-staged pick if there is one. Returns the showcase message, or None if nothing
+        was showcased.
+        """
+        started = time.monotonic()
+        outcome = "cancelled"
+        try:
+            showcase_msg = await self._pick_and_showcase_post(guild_id, use_staged)
+            outcome = "posted" if showcase_msg else "skipped"
+            return showcase_msg
+        finally:
+            SHOWCASES.inc(outcome=outcome)
+            SHOWCASE_LATENCY.observe(time.monotonic() - started, outcome=outcome)
+
+    async def _pick_and_showcase_post(self, guild_id: int, use_staged: bool) -> Optional[discord.Message]:
         guild_config = self.get_guild_config(guild_id)
 
         submission_channel_id = guild_config.get("submission_channel_id")
         showcase_channel_id = guild_config.get("showcase_channel_id")
 
         if not submission_channel_id or not showcase_channel_id:
-            print(f"⚠️ Channels not configured for guild {guild_id}. Skipping showcase.")
+            log.warning(f"⚠️ Channels not configured for guild {guild_id}. Skipping showcase.")
             return
 
         submission_channel = self.get_channel(submission_channel_id)
         showcase_channel = self.get_channel(showcase_channel_id)
 
         if not submission_channel or not showcase_channel:
-            print(f"❌ Could not find configured channels for guild {guild_id}")
+            log.error(f"❌ Could not find configured channels for guild {guild_id}")
             return
 
-        print(f"\n🎲 Selecting random post from {submission_channel.name} in guild {guild_id}...")
-
+        staged = None
         try:
-            # Collect all messages from submission channel (last 100)
-            messages = []
-            async for message in submission_channel.history(limit=100):
-                # Include messages from users, or from the bot if it has attachments
-                if (not message.author.bot and (message.content or message.attachments)) or \
-                   (message.author == self.user and message.attachments):
-                    messages.append(message)
-
-            if not messages:
-                print(f"⚠️ No messages found in submission channel for guild {guild_id}")
-                await showcase_channel.send("📢 No submissions to showcase today!")
-                return
+            staged = self.staged_showcases.pop(guild_id, None) if use_staged else None
+            if staged and staged.message.channel.id != submission_channel_id:
+                await staged.cleanup()
+                staged = None
 
-            # Pick a random message
-            chosen_message = random.choice(messages)
-            print(f"✅ Selected message from {chosen_message.author} in guild {guild_id}")
+            if staged:
+                log.info(f"📦 Using staged showcase for guild {guild_id}")
+            else:
+                staged = await self.stage_showcase(guild_id, submission_channel)
 
-            # Create showcase post
-            embed = discord.Embed(
-                title="🌟 Daily Showcase",
-                description=chosen_message.content if chosen_message.content else "",
-                color=discord.Color.gold(),
-                timestamp=datetime.now()
-            )
-            embed.set_author(name=chosen_message.author.display_name, icon_url=chosen_message.author.display_avatar.url)
+            if not staged:
+                log.warning(f"⚠️ No messages found in submission channel for guild {guild_id}")
+                await self.sender.send(showcase_channel, content="📢 No submissions to showcase today!")
+                # Today's slot is used up; don't send the notice again when catching up after a restart
+                self.record_showcase_date(guild_id)
+                return
+
+            chosen_message = staged.message
+            embed = staged.embed
+            embed.timestamp = datetime.now()
 
             # Calculate next showcase time for the footer
-            now = datetime.now()
-            showcase_time_str = guild_config.get('showcase_time', '12:00')
-            showcase_hour, showcase_minute = map(int, showcase_time_str.split(':'))
-            next_showcase_dt = now.replace(hour=showcase_hour, minute=showcase_minute, second=0, microsecond=0)
-            if now >= next_showcase_dt:
-                next_showcase_dt += timedelta(days=1)
+            next_showcase_dt = next_showcase_time(guild_config)
 
             embed.add_field(
                 name="⏳ Next Showcase",
@@ -227,85 +3106,245 @@ class BoomerBoxBot(commands.Bot):
                 inline=False
             )
 
-            # Handle attachments
-            files = []
-            if chosen_message.attachments:
-                for attachment in chosen_message.attachments:
-                    try:
-                        # Download attachment
-                        file_data = await attachment.read()
-                        files.append(discord.File(io.BytesIO(file_data), filename=attachment.filename))
-
-                        # Set first image as embed thumbnail
-                        if attachment.content_type and attachment.content_type.startswith("image") and not embed.image:
-                            embed.set_image(url=attachment.url)
-                    except Exception as e:
-                        print(f"⚠️ Could not process attachment: {e}")
-
             # Post to showcase channel
+            files = staged.discord_files()
             if files:
-                await showcase_channel.send(embed=embed, files=files)
+                showcase_msg = await self.sender.send(showcase_channel, priority=DiscordSender.HIGH, embed=embed, files=files)
             else:
-                await showcase_channel.send(embed=embed)
+                showcase_msg = await self.sender.send(showcase_channel, priority=DiscordSender.HIGH, embed=embed)
 
-            print(f"✅ Showcased post in {showcase_channel.name} for guild {guild_id}")
+            log.info(f"✅ Showcased post in {showcase_channel.name} for guild {guild_id}",
+                     extra={"guild_id": guild_id, "message_id": chosen_message.id})
+            await self.submission_store.mark_showcased(chosen_message.id)
+            await self.invalidate_staged([chosen_message.id])
 
             # Delete original message if configured
             if guild_config.get("delete_after_showcase", False):
                 try:
-                    await chosen_message.delete()
-                    print(f"🗑️ Deleted showcased message from {submission_channel.name}")
+                    await self.sender.delete(chosen_message, priority=DiscordSender.LOW)
+                    log.info(f"🗑️ Deleted showcased message from {submission_channel.name}")
                 except discord.Forbidden:
-                    print(f"⚠️ Missing permissions to delete message in {submission_channel.name}")
+                    log.warning(f"⚠️ Missing permissions to delete message in {submission_channel.name}")
                 except Exception as e:
-                    print(f"⚠️ Could not delete showcased message: {e}")
+                    log.warning(f"⚠️ Could not delete showcased message: {e}")
 
-            # Update last showcase date
-            guild_config["last_showcase_date"] = datetime.now().strftime("%Y-%m-%d")
-            self.save_config()
+            self.record_showcase_date(guild_id)
+            return showcase_msg
 
         except discord.Forbidden:
-            print(f"❌ Missing permissions in channels for guild {guild_id}")
+            log.error(f"❌ Missing permissions in channels for guild {guild_id}")
         except Exception as e:
-            print(f"❌ Error during showcase for guild {guild_id}: {e}")
+            log.error(f"❌ Error during showcase for guild {guild_id}: {e}")
+        finally:
+            if staged:
+                await staged.cleanup()
+
+    def record_showcase_date(self, guild_id: int):
+        """Remember that today's showcase has run, in the guild's time zone."""
+        guild_config = self.get_guild_config(guild_id)
+        guild_config["last_showcase_date"] = datetime.now(get_timezone(guild_config.get("timezone"))).strftime("%Y-%m-%d")
+        self.save_config(guild_id)
 
-    @tasks.loop(minutes=1)  # Check every minute
-    async def daily_showcase_task(self):
-        """Daily task to showcase a random post for each guild."""
-        now = datetime.now()
-        today_str = now.strftime("%Y-%m-%d")
-        current_time_str = now.strftime("%H:%M")
+    def schedule_showcase(self, guild_id: int, catch_up: bool = False):
+        """(Re)schedule a guild's next showcase, or drop it if the guild isn't configured."""
+        config = self.guild_configs.get(guild_id)
+        # Any staged pick may no longer match the new settings
+        if guild_id in self.staged_showcases:
+            self.spawn(self.discard_staged(guild_id))
 
-        for guild_id, config in self.guild_configs.items():
-            showcase_time = config.get("showcase_time", "12:00")
-            last_showcase_date = config.get("last_showcase_date")
+        if not config or not config.get("submission_channel_id") or not config.get("showcase_channel_id"):
+            self.showcase_scheduler.unschedule(guild_id)
+            self.staging_scheduler.unschedule(guild_id)
+            return
+
+        due = next_showcase_time(config, catch_up=catch_up)
+        self.showcase_scheduler.schedule(guild_id, due)
 
-            if current_time_str == showcase_time and last_showcase_date != today_str:
-                print(f"🚀 Triggering showcase for guild {guild_id} at {showcase_time}")
-                await self.pick_and_showcase_post(guild_id)
+        # Stage the showcase ahead of time if there's still room before the slot
+        stage_at = due - timedelta(seconds=self.showcase_lead_time)
+        if self.showcase_lead_time > 0 and stage_at.timestamp() > time.time():
+            self.staging_scheduler.schedule(guild_id, stage_at)
+        else:
+            self.staging_scheduler.unschedule(guild_id)
+
+    async def run_due_showcases(self, due_guilds: List[Tuple[int, float]]):
+        """
+        Called by the scheduler with (guild id, scheduled timestamp) for every guild whose
+        showcase time has come. Guilds run concurrently, up to SHOWCASE_CONCURRENCY at once,
+        and each is bounded by SHOWCASE_TIMEOUT so a slow one can't hold up the rest.
+        """
+        async def run_one(guild_id: int, scheduled: float):
+            config = self.guild_configs.get(guild_id)
+            if not config:
+                return
+            try:
+                async with self.showcase_semaphore:
+                    started = time.time()
+                    log.info(f"🚀 Triggering showcase for guild {guild_id} at {config.get('showcase_time', '12:00')}")
+                    showcase_msg = await asyncio.wait_for(self.pick_and_showcase_post(guild_id),
+                                                          timeout=self.showcase_timeout)
+                    finished = time.time()
+                    posted = showcase_msg.created_at.timestamp() if showcase_msg else None
+                    self.showcase_timings[guild_id] = {
+                        "scheduled": scheduled,
+                        "start_delay": started - scheduled,
+                        "lateness": posted - scheduled if posted else None,
+                        "duration": finished - started,
+                    }
+                    if posted:
+                        SHOWCASE_LATENESS.observe(max(0.0, posted - scheduled))
+                        log.info(f"⏱️ Showcase for guild {guild_id} posted {posted - scheduled:.1f}s after its slot "
+                                 f"(took {finished - started:.1f}s)",
+                                 extra={"guild_id": guild_id, "lateness": round(posted - scheduled, 3),
+                                        "duration": round(finished - started, 3)})
+            except asyncio.TimeoutError:
+                log.error(f"❌ Showcase for guild {guild_id} timed out after {self.showcase_timeout:.0f}s",
+                          extra={"guild_id": guild_id})
+            except Exception as e:
+                log.error(f"❌ Error during showcase for guild {guild_id}: {e}")
+            finally:
+                # Always move on to the next slot, even if this one failed
+                self.schedule_showcase(guild_id)
 
-    @daily_showcase_task.before_loop
-    async def before_daily_showcase(self):
-        """Wait until the bot is ready before starting the task."""
-        await self.wait_until_ready()
-        print("🕐 Daily showcase task started (runs every minute to check for scheduled showcases)")
+        await asyncio.gather(*(run_one(guild_id, scheduled) for guild_id, scheduled in due_guilds))
 
+        latenesses = [self.showcase_timings[guild_id]["lateness"] for guild_id, _ in due_guilds
+                      if self.showcase_timings.get(guild_id, {}).get("lateness") is not None]
+        if len(latenesses) > 1:
+            log.info(f"⏱️ Ran {len(due_guilds)} showcase(s); lateness spread "
+                     f"{min(latenesses):.1f}s to {max(latenesses):.1f}s")
 
     async def on_ready(self):
         """Called when the bot is ready."""
-        print(f'✅ Logged in as {self.user} (ID: {self.user.id})')
-        print('------')
+        log.info(f'✅ Logged in as {self.user} (ID: {self.user.id})')
+        shards = self.shard_ids if self.shard_ids is not None else list(range(self.shard_count or 1))
+        log.info(f'🧩 Running shard(s) {", ".join(map(str, shards))} of {self.shard_count or 1}'
+                 + (f' as cluster {self.cluster_id}' if self.cluster_id is not None else ''))
+
+        # Start the daily showcase scheduler, catching up on any slot missed while offline
+        if not self.showcase_scheduler.is_running():
+            for guild_id in self.guild_configs:
+                self.schedule_showcase(guild_id, catch_up=True)
+            self.showcase_scheduler.start()
+            self.staging_scheduler.start()
+            log.info(f"🕐 Showcase scheduler started for {len(self.showcase_scheduler)} guild(s)")
+
+        # Report what the library has cached, once the guilds have arrived
+        if not self._cache_reported:
+            self._cache_reported = True
+            self.log_cache_report()
+
+        # Pick up links that were being processed when the bot last stopped
+        if not self._journal_recovered:
+            self._journal_recovered = True
+            self.spawn(self.recover_ingest_jobs())
+
+        # Index any submission channels we haven't seen before
+        for guild_id, config in self.guild_configs.items():
+            if config.get("submission_channel_id"):
+                self.start_backfill(config["submission_channel_id"])
+
+        log.info('🤖 Bot is ready!')
 
-        # Start the daily showcase task
-        if not self.daily_showcase_task.is_running():
-            self.daily_showcase_task.start()
+    def is_submission(self, message: discord.Message) -> bool:
+        """Whether a message in a submission channel can be showcased."""
+        # Include messages from users, or from the bot if it has attachments
+        return (not message.author.bot and bool(message.content or message.attachments)) or \
+               (message.author == self.user and bool(message.attachments))
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Run a coroutine in the background, keeping hold of it so shutdown can cancel it."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def start_backfill(self, channel_id: int):
+        """Index a submission channel's existing history in the background, once per channel."""
+        task = self._backfill_tasks.get(channel_id)
+        if task and not task.done():
+            return
+        self._backfill_tasks[channel_id] = self.spawn(self.backfill_submissions(channel_id))
+
+    async def backfill_submissions(self, channel_id: int):
+        """Add a submission channel's full history to the submission index."""
+        if await self.submission_store.is_backfilled(channel_id):
+            return
+
+        channel = self.get_channel(channel_id)
+        if not channel:
+            return
+
+        log.info(f"📚 Indexing submission history of {channel.name} in guild {channel.guild.id}...")
+        try:
+            batch = []
+            indexed = 0
+            async for message in channel.history(limit=None, oldest_first=True):
+                if self.is_submission(message):
+                    batch.append(message)
+                if len(batch) >= 500:
+                    await self.submission_store.add_many(batch)
+                    indexed += len(batch)
+                    batch = []
+            await self.submission_store.add_many(batch)
+            indexed += len(batch)
+            await self.submission_store.mark_backfilled(channel_id)
+            log.info(f"✅ Indexed {indexed} submission(s) from {channel.name}")
+        except discord.Forbidden:
+            log.warning(f"⚠️ Missing permissions to read history of {channel.name}")
+        except Exception as e:
+            log.error(f"❌ Error indexing submissions from {channel_id}: {e}")
+
+    def is_submission_channel(self, guild_id: Optional[int], channel_id: int) -> bool:
+        if guild_id is None or guild_id not in self.guild_configs:
+            return False
+        return self.guild_configs[guild_id].get("submission_channel_id") == channel_id
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Drop deleted submissions from the index, unless they were showcased."""
+        if self.is_submission_channel(payload.guild_id, payload.channel_id):
+            forgotten = await self.submission_store.remove([payload.message_id])
+            self.duplicate_index.remove(forgotten)
+            await self.invalidate_staged([payload.message_id])
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Drop bulk-deleted submissions from the index."""
+        if self.is_submission_channel(payload.guild_id, payload.channel_id):
+            forgotten = await self.submission_store.remove(list(payload.message_ids))
+            self.duplicate_index.remove(forgotten)
+            await self.invalidate_staged(list(payload.message_ids))
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Keep the index in step with edited submissions."""
+        if not self.is_submission_channel(payload.guild_id, payload.channel_id):
+            return
+        content = payload.data.get("content")
+        attachments = payload.data.get("attachments")
+        if attachments is not None:
+            attachments = json.dumps([
+                {"id": int(a["id"]), "filename": a.get("filename"), "size": a.get("size"),
+                 "content_type": a.get("content_type")}
+                for a in attachments
+            ])
+        await self.submission_store.update(payload.message_id, content=content, attachments=attachments)
 
-        print('🤖 Bot is ready!')
+        # Link embeds resolving also count as edits, so only restage if the submission itself changed
+        staged = self.staged_showcases.get(payload.guild_id)
+        if staged and staged.message.id == payload.message_id:
+            staged_attachment_ids = [a.id for a in staged.message.attachments]
+            if (content is not None and content != staged.message.content) or \
+               (attachments is not None and [a["id"] for a in json.loads(attachments)] != staged_attachment_ids):
+                await self.invalidate_staged([payload.message_id])
 
     async def on_message(self, message: discord.Message):
         """Called when a message is received."""
-        # Don't respond to our own messages or DMs
-        if message.author == self.user or not message.guild:
+        if not message.guild:
+            return
+
+        # Don't respond to our own messages, but index our reposts as submissions
+        if message.author == self.user:
+            if self.is_submission_channel(message.guild.id, message.channel.id) and self.is_submission(message):
+                await self.submission_store.add(message)
             return
 
         # Process commands first
@@ -319,136 +3358,845 @@ class BoomerBoxBot(commands.Bot):
             return
 
         # Check for supported URLs
-        instagram_urls = INSTAGRAM_URL_PATTERN.findall(message.content)
+        links = self.link_matcher.find(message.content)
+
+        # Anything that isn't deleted below can be showcased later
+        if (links or message.attachments) and self.is_submission(message):
+            await self.submission_store.add(message)
 
         # If a supported URL is found, process it
-        if instagram_urls:
-            print(f"Found {len(instagram_urls)} Instagram URL(s) in message from {message.author} in guild {message.guild.id}")
-            for url in instagram_urls:
-                await self.process_instagram_url(message, url)
+        if links:
+            platforms = ", ".join(sorted({self.link_matcher.labels[link.platform] for link in links}))
+            log.info(f"Found {len(links)} link(s) ({platforms}) in message from {message.author} in guild {message.guild.id}",
+                     extra={"guild_id": message.guild.id, "message_id": message.id})
+            for link in links:
+                await self.enqueue_link(message, link.url)
             return
 
+        # Uploaded media goes into the duplicate index in the background
+        if message.attachments and self.duplicate_detection and self.is_submission(message):
+            self.spawn(self.hash_attachments(message))
+
         # If the message has no attachments and no supported URLs, delete it.
         if not message.attachments:
             try:
-                await message.delete()
-                print(f"🗑️ Deleted message from {message.author} in {message.channel.name} (no attachment or supported URL)")
+                await self.sender.delete(message)
+                log.info(f"🗑️ Deleted message from {message.author} in {message.channel.name} (no attachment or supported URL)")
             except discord.Forbidden:
-                print(f"⚠️ Missing permissions to delete message in {message.channel.name}")
+                log.warning(f"⚠️ Missing permissions to delete message in {message.channel.name}")
+            except Exception as e:
+                log.warning(f"⚠️ Could not delete message: {e}")
+
+    async def enqueue_link(self, message: discord.Message, url: str, job_id: Optional[int] = None):
+        """Hand a supported link to the ingest queue, telling the user if it has to wait."""
+        if job_id is None:
+            job_id = await self.ingest_journal.create(message.guild.id, message.channel.id, message.id, url)
+        position = await self.ingest_queue.put(IngestJob(message=message, url=url, guild_id=message.guild.id,
+                                                         job_id=job_id))
+
+        if position is None:
+            log.warning(f"⚠️ Ingest queue full, rejected link from {message.author} in guild {message.guild.id}",
+                        extra={"guild_id": message.guild.id})
+            await self.ingest_journal.finish(job_id, "failed")
+            await self.sender.send(message.channel, content="⏳ The bot is busy right now, please post that link again in a few minutes.", delete_after=30)
+            return
+
+        # Only tell the user about the wait if no worker is free to pick it up straight away
+        if position > self.ingest_queue.worker_count - self.ingest_queue.active:
+            await self.sender.send(message.channel, content=f"⏳ Queued, position {position}", delete_after=30)
+
+    async def run_ingest_job(self, job: IngestJob):
+        """Worker entry point for a queued link."""
+        await self.process_link(job.message, job.url, job_id=job.job_id)
+
+    async def recover_ingest_jobs(self):
+        """Requeue ingest jobs that were interrupted by the last shutdown or crash."""
+        try:
+            await self.ingest_journal.prune(timedelta(days=7))
+            jobs = [entry for entry in await self.ingest_journal.unfinished() if self.owns_guild(entry.guild_id)]
+        except Exception as e:
+            log.error(f"❌ Could not read the ingest journal: {e}")
+            return
+        if not jobs:
+            return
+
+        log.info(f"🔁 Resuming {len(jobs)} interrupted ingest job(s)")
+        for entry in jobs:
+            channel = self.get_channel(entry.channel_id)
+            try:
+                if channel is None:
+                    raise discord.NotFound
+                message = await channel.fetch_message(entry.message_id)
+            except discord.NotFound:
+                # Either we deleted it after posting everything, or its author deleted it
+                all_posted = bool(entry.item_states) and len(entry.posted_items()) == len(entry.item_states)
+                await self.ingest_journal.finish(entry.job_id, "done" if all_posted or entry.original_deleted else "failed")
+                continue
             except Exception as e:
-                print(f"⚠️ Could not delete message: {e}")
+                log.warning(f"⚠️ Could not resume ingest job {entry.job_id}: {e}")
+                await self.ingest_journal.finish(entry.job_id, "failed")
+                continue
+            await self.enqueue_link(message, entry.url, job_id=entry.job_id)
+
+    def quality_cache_key(self, link: Optional[LinkMatch], tier: int) -> Optional[str]:
+        """Cache key for a link's media at a quality tier; the top tier uses the link's own key."""
+        if link is None:
+            return None
+        return link.cache_key if tier == 0 else f"{link.cache_key}@q{tier}"
+
+    @staticmethod
+    def quality_tier_of(cache_key: Optional[str]) -> int:
+        """The quality tier a cache key from ``quality_cache_key`` stands for."""
+        if cache_key and "@q" in cache_key:
+            return int(cache_key.rsplit("@q", 1)[1])
+        return 0
+
+    async def request_cobalt(self, url: str, cache_key: Optional[str], tier: int) -> Optional[Dict[str, Any]]:
+        """Cobalt's response for a link at a quality tier, from the cache if it's there."""
+        response = self.media_cache.get_cobalt(cache_key) if cache_key else None
+        if response is None:
+            response = await self.cobalt_pool.get_download_link(self.http_session, url, COBALT_QUALITY_TIERS[tier])
+            if response and cache_key:
+                self.media_cache.put_cobalt(cache_key, response)
+        return response
+
+    async def probe_tier(self, link: Optional[LinkMatch], url: str,
+                         tier: int) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[int]]:
+        """
+        Cobalt's response and cache key for a link at a quality tier, plus the size of a
+        single video or image as its server reports it (None for anything else).
+        """
+        cache_key = self.quality_cache_key(link, tier)
+        response = await self.request_cobalt(url, cache_key, tier)
+        size = None
+        if response and response.get("status") in ("redirect", "tunnel") and response.get("url"):
+            size = await probe_media_size(self.http_session, response["url"])
+        return response, cache_key, size
+
+    async def resolve_link(self, link: Optional[LinkMatch], url: str,
+                           upload_limit: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Ask Cobalt for a link at the best quality tier whose media fits ``upload_limit``,
+        returning the response and the media cache key for that tier.
+
+        A link seen before goes straight to the tier that fitted last time. Otherwise
+        we start from what recently fitted on the same platform and upload limit, and
+        step down a tier (one more Cobalt request) while the reported size is too big.
+        Carousels and media whose size isn't reported are taken at the starting tier.
+        """
+        if link is None or not self.adaptive_quality:
+            cache_key = self.quality_cache_key(link, 0)
+            return await self.request_cobalt(url, cache_key, 0), cache_key
+
+        remembered = self.quality_memory.for_link(link.cache_key, upload_limit)
+        if remembered is not None:
+            self.quality_memory.link_hits += 1
+            cache_key = self.quality_cache_key(link, remembered)
+            COBALT_QUALITY.inc(quality=quality_tier_label(remembered))
+            return await self.request_cobalt(url, cache_key, remembered), cache_key
 
-    async def process_instagram_url(self, message: discord.Message, url: str):
-        """Process an Instagram URL: download it and repost it."""
+        start = tier = self.quality_memory.start_tier(link.platform, upload_limit)
+        response, cache_key, size = await self.probe_tier(link, url, tier)
+        previous = None
+        while size is not None and size > upload_limit and tier < len(COBALT_QUALITY_TIERS) - 1:
+            if previous is not None and size >= previous[2] * 0.95:
+                # The platform ignores the quality options; keep the better tier and leave it to media optimization
+                tier -= 1
+                response, cache_key, size = previous
+                break
+            previous = (response, cache_key, size)
+            tier += 1
+            self.quality_memory.step_downs += 1
+            log.info(f"📉 {link.cache_key} is {size / 1024 / 1024:.1f} MB, over the "
+                     f"{upload_limit / 1024 / 1024:.0f} MB limit; asking Cobalt for {quality_tier_label(tier)}",
+                     extra={"size": size, "limit": upload_limit})
+            response, cache_key, size = await self.probe_tier(link, url, tier)
+
+        # Starting low because of the platform's history: with plenty of room left, try one tier up
+        # so the history can recover once bigger posts stop coming in
+        if tier == start > 0 and size is not None and size < upload_limit // 2:
+            higher = await self.probe_tier(link, url, tier - 1)
+            if higher[0] and higher[2] is not None and higher[2] <= upload_limit:
+                tier -= 1
+                response, cache_key, size = higher
+
+        if size is not None:
+            self.quality_memory.record(link.cache_key, link.platform, upload_limit, tier)
+        if response and response.get("status") != "error":
+            COBALT_QUALITY.inc(quality=quality_tier_label(tier))
+        return response, cache_key
+
+    async def refresh_download_urls(self, url: str, cache_key: Optional[str],
+                                    job_id: Optional[int] = None) -> Optional[List[Optional[str]]]:
+        """
+        Replace download links that stopped working: drop the cached Cobalt response
+        and ask Cobalt again at the same quality tier. Returns None if that fails too.
+        """
+        log.info(f"🔁 Download links for {cache_key or url} stopped working, asking Cobalt again")
+        if cache_key:
+            self.media_cache.drop_cobalt(cache_key)
+        response = await self.request_cobalt(url, cache_key, self.quality_tier_of(cache_key))
+        status = response.get("status") if response else None
+        if status in ("redirect", "tunnel"):
+            download_urls = [response.get("url")]
+        elif status == "picker":
+            download_urls = [item.get("url") for item in response.get("picker", [])]
+        else:
+            return None
+        if job_id:
+            await self.ingest_journal.resolve(job_id, download_urls, cache_key)
+        return download_urls
+
+    async def process_link(self, message: discord.Message, url: str, job_id: Optional[int] = None):
+        """Process a supported link: download its media and repost it."""
+        completed = interrupted = False
+        started = time.monotonic()
         try:
             # Send a status message
-            status_msg = await message.channel.send(f"🔄 Processing Instagram link...", delete_after=60)
-
-            # Get download link from Cobalt
-            cobalt_response = await asyncio.to_thread(
-                get_download_link,
-                self.cobalt_url,
-                self.cobalt_key,
-                url,
-                self.cf_header,
-                self.cf_value,
-                self.user_agent
-            )
+            link = self.link_matcher.match(url)
+            label = self.link_matcher.labels.get(link.platform, "media") if link else "media"
+            status_msg = await self.sender.send(message.channel, content=f"🔄 Processing {label} link...", delete_after=60)
 
-            if not cobalt_response:
-                await status_msg.edit(content="❌ Failed to get download link from Cobalt.")
-                return
+            upload_limit = get_upload_limit(message.guild)
+            remembered_tier = self.quality_memory.for_link(link.cache_key, upload_limit) if link else None
+            cache_key = self.quality_cache_key(link, remembered_tier or 0)
 
-            status = cobalt_response.get("status")
-
-            if status in ("redirect", "tunnel"):
-                # Single video/image
-                download_url = cobalt_response.get("url")
-                if download_url:
-                    await self.download_and_post(message, download_url, status_msg)
-
-            elif status == "picker":
-                # Multiple items (carousel)
-                picker_items = cobalt_response.get("picker", [])
-                if picker_items:
-                    await status_msg.edit(content=f"🔄 Downloading {len(picker_items)} items from carousel...")
-
-                    for idx, item in enumerate(picker_items):
-                        item_url = item.get("url")
-                        if item_url:
-                            await self.download_and_post(message, item_url, status_msg if idx == 0 else None, item_num=idx+1, total_items=len(picker_items))
-
-            elif status == "error":
-                error_code = cobalt_response.get("error", {}).get("code", "unknown")
-                error_text = cobalt_response.get("text", "Unknown error")
-                await status_msg.edit(content=f"❌ Cobalt error: {error_code} - {error_text}")
-                return
+            # A resumed job carries on from what the journal says it already did, at the
+            # quality tier it was resolved at (the quality memory doesn't survive a restart)
+            entry = await self.ingest_journal.get(job_id) if job_id else None
+            already_posted = entry.posted_items() if entry else set()
+            if entry and entry.cache_key:
+                cache_key = entry.cache_key
+            links_fresh = (entry is not None and entry.state == "resolved" and entry.download_urls
+                           and time.time() - (entry.resolved_at or 0) < self.media_cache.link_ttl(entry.download_urls))
+            links_reused = bool(links_fresh)
 
+            # Reposts of a fully cached post skip Cobalt and the download entirely, as long as the
+            # cached copies fit here; otherwise Cobalt is asked for a quality tier that does
+            cached_total = self.media_cache.cached_item_count(cache_key, upload_limit) if cache_key else 0
+            if cached_total:
+                log.info(f"♻️ Serving {cache_key} from media cache ({cached_total} item(s))")
+                download_urls: List[Optional[str]] = [None] * cached_total
+            elif links_fresh:
+                log.info(f"🔁 Reusing download links from ingest job {job_id}")
+                download_urls = entry.download_urls
             else:
-                await status_msg.edit(content=f"❔ Unknown Cobalt response status: {status}")
-                return
+                # Get download link from Cobalt, at a quality that fits here
+                cobalt_response, cache_key = await self.resolve_link(link, url, upload_limit)
+                stored_at = self.media_cache.cobalt_stored_at(cache_key) if cache_key else None
+                links_reused = stored_at is not None and stored_at < started
+
+                if not cobalt_response:
+                    await self.sender.edit(status_msg, content="❌ Failed to get download link from Cobalt.")
+                    return
+
+                status = cobalt_response.get("status")
+
+                if status in ("redirect", "tunnel"):
+                    # Single video/image
+                    download_urls = [cobalt_response.get("url")]
+
+                elif status == "picker":
+                    # Multiple items (carousel)
+                    download_urls = [item.get("url") for item in cobalt_response.get("picker", [])]
+                    if download_urls:
+                        await self.sender.edit(status_msg, content=f"🔄 Downloading {len(download_urls)} items from carousel...")
+
+                elif status == "error":
+                    error_code = cobalt_response.get("error", {}).get("code", "unknown")
+                    error_text = cobalt_response.get("text", "Unknown error")
+                    await self.sender.edit(status_msg, content=f"❌ Cobalt error: {error_code} - {error_text}")
+                    return
+
+                else:
+                    await self.sender.edit(status_msg, content=f"❔ Unknown Cobalt response status: {status}")
+                    return
+
+            if job_id and not (links_fresh and not cached_total):
+                await self.ingest_journal.resolve(job_id, download_urls, cache_key)
+
+            # Cached or journaled links may have expired; if a download from one fails,
+            # ask Cobalt for new links once and share them between the carousel items
+            new_links: Optional[asyncio.Task] = None
+
+            async def refresh_item_link(item_num: int) -> Optional[str]:
+                nonlocal new_links
+                if new_links is None:
+                    new_links = self.spawn(self.refresh_download_urls(url, cache_key, job_id))
+                new_urls = await asyncio.shield(new_links)
+                if not new_urls or len(new_urls) != len(download_urls):
+                    return None
+                return new_urls[item_num - 1]
+
+            refresh_link = refresh_item_link if links_reused and not cached_total else None
+
+            retry_budget = RetryBudget(self.download_retry_budget)
+            if len(download_urls) > 1:
+                completed = await self.download_and_post_carousel(message, download_urls, status_msg,
+                                                                  cache_key=cache_key, source=f"{label} content",
+                                                                  retry_budget=retry_budget,
+                                                                  job_id=job_id, already_posted=already_posted,
+                                                                  refresh_link=refresh_link)
+            elif download_urls and (download_urls[0] or cached_total):
+                completed = await self.download_and_post(message, download_urls[0], status_msg, item_num=1,
+                                                         cache_key=cache_key, source=f"{label} content",
+                                                         retry_budget=retry_budget,
+                                                         job_id=job_id, already_posted=1 in already_posted,
+                                                         refresh_link=refresh_link)
 
             # Delete the status message after a short delay
-            await asyncio.sleep(2)
-            await status_msg.delete()
+            self.sender.delete_later(status_msg, delay=2)
 
         except Exception as e:
-            print(f"❌ Error processing Instagram URL: {e}")
-            await message.channel.send(f"❌ Error processing link: {str(e)}", delete_after=30)
+            log.error(f"❌ Error processing link: {e}", extra={"url": url, "job_id": job_id}, exc_info=True)
+            await self.sender.send(message.channel, content=f"❌ Error processing link: {str(e)}", delete_after=30)
 
-    async def download_and_post(self, original_message: discord.Message, download_url: str,
-                                status_msg: Optional[discord.Message] = None,
-                                item_num: int = 0, total_items: int = 1, source: str = "Instagram content"):
-        """Download media and post it as a Discord attachment."""
+        except asyncio.CancelledError:
+            # Shutting down: leave the job unfinished so the next start resumes it
+            interrupted = True
+            raise
+
+        finally:
+            if not interrupted:
+                outcome = "done" if completed else "failed"
+                INGEST_JOBS.inc(outcome=outcome)
+                INGEST_LATENCY.observe(time.monotonic() - started, outcome=outcome)
+            if job_id and not interrupted:
+                try:
+                    await self.ingest_journal.finish(job_id, "done" if completed else "failed")
+                except Exception as e:
+                    log.warning(f"⚠️ Could not update ingest job {job_id}: {e}")
+
+    async def fetch_media_item(self, download_url: Optional[str], item_num: int, total_items: int,
+                               cache_key: Optional[str] = None, max_bytes: Optional[int] = None,
+                               retry_budget: Optional[RetryBudget] = None,
+                               max_bytes_for: Optional[Callable[[str], int]] = None) -> Optional[MediaItem]:
+        """
+        Get one media item from the cache, or download it (and cache it) if it isn't there.
+        Raises MediaTooLargeError if the item can't fit in ``max_bytes`` (or the limit
+        ``max_bytes_for`` gives for its file extension).
+        """
+        cached_path = self.media_cache.get_media(cache_key, item_num, total_items) if cache_key else None
+        if cached_path:
+            size = cached_path.stat().st_size
+            if max_bytes_for is not None:
+                max_bytes = max_bytes_for(cached_path.suffix)
+            if max_bytes and size > max_bytes:
+                raise MediaTooLargeError(size, max_bytes)
+            return MediaItem(item_num=item_num, file_ext=cached_path.suffix, size=size, path=cached_path)
+
+        # Download the media
+        media_item = await download_media(self.http_session, download_url, max_bytes=max_bytes,
+                                          spool_limit=self.spool_limit,
+                                          budget=self.memory_budget,
+                                          max_attempts=self.download_max_attempts,
+                                          retry_budget=retry_budget,
+                                          max_bytes_for=max_bytes_for) if download_url else None
+        if not media_item:
+            if download_url:
+                self.download_stats["failed"] += 1
+            return None
+        media_item.item_num = item_num
+        self.download_stats["downloads"] += 1
+        self.download_stats["retries"] += media_item.attempts - 1
+        self.download_stats["resumed_bytes"] += media_item.resumed_bytes
+
+        if cache_key:
+            await self.media_cache.put_media(cache_key, item_num, total_items, media_item.file_ext,
+                                             media_item.data, media_item.size)
+
+        return media_item
+
+    def media_optimization_policy(self, guild_id: Optional[int]) -> str:
+        """The guild's media optimization policy: off, oversized or always."""
+        config = self.guild_configs.get(guild_id) or {}
+        policy = config.get("media_optimization") or self.media_optimization_default
+        return policy if policy in MEDIA_OPTIMIZATION_POLICIES else "off"
+
+    def can_process_media(self, file_ext: str) -> bool:
+        """Whether the process pool has the tools (Pillow or ffmpeg) to handle this kind of file."""
+        if self.media_pool is None:
+            return False
+        if file_ext in IMAGE_EXTENSIONS:
+            return Image is not None
+        return file_ext in VIDEO_EXTENSIONS and self.ffmpeg_available
+
+    @staticmethod
+    async def media_source_path(media_item: MediaItem, work_dir: Path) -> Path:
+        """A path to the media item on disk, writing it into ``work_dir`` if it's only in memory."""
+        if media_item.path:
+            return media_item.path
+        source = work_dir / f"source{media_item.file_ext}"
+
+        def write_source():
+            with open(source, "wb") as f:
+                shutil.copyfileobj(media_item.data, f)
+            media_item.data.seek(0)
+        await asyncio.to_thread(write_source)
+        return source
+
+    async def hash_media_item(self, media_item: MediaItem) -> Optional[int]:
+        """Perceptual hash of an image or video, computed in the process pool."""
+        if not self.duplicate_detection or not self.can_process_media(media_item.file_ext):
+            return None
+        # The pool works from a file on disk, so big media never has to be read into memory here
+        hash_function = perceptual_hash if media_item.file_ext in IMAGE_EXTENSIONS else video_perceptual_hash
         try:
-            # Download the media
-            media_data = await download_media(download_url)
+            work_dir = Path(await asyncio.to_thread(tempfile.mkdtemp, prefix="boomerbox_"))
+            try:
+                source = await self.media_source_path(media_item, work_dir)
+                return await asyncio.get_running_loop().run_in_executor(self.media_pool, hash_function, str(source))
+            finally:
+                await asyncio.to_thread(shutil.rmtree, work_dir, True)
+        except Exception as e:
+            log.warning(f"⚠️ Could not hash media: {e}")
+            return None
 
-            if not media_data:
-                if status_msg:
-                    await status_msg.edit(content="❌ Failed to download media.")
-                return
+    async def hash_attachments(self, message: discord.Message):
+        """Hash a user's uploaded images and videos so later reposts of them can be spotted."""
+        hashes = []
+        for attachment in message.attachments:
+            file_ext = Path(attachment.filename).suffix.lower()
+            if attachment.size > self.hash_max_bytes or not self.can_process_media(file_ext):
+                continue
+            media_item = await download_media(self.http_session, attachment.url, max_bytes=self.hash_max_bytes,
+                                              spool_limit=self.spool_limit, budget=self.memory_budget)
+            if not media_item:
+                continue
+            try:
+                hashes.append(await self.hash_media_item(media_item))
+            finally:
+                media_item.close()
+        await self.record_media_hashes(message, hashes)
+
+    async def record_media_hashes(self, message: discord.Message, hashes: List[Optional[int]]):
+        """
+        Add a submission's media hashes to the duplicate index. If every one of them is a
+        near-duplicate of an earlier submission, it is flagged and left out of showcases.
+        """
+        hashes = [value_hash for value_hash in hashes if value_hash is not None]
+        if not hashes:
+            return
+        guild_id = message.guild.id
+        matches = [self.duplicate_index.find(guild_id, value_hash, exclude=message.id) for value_hash in hashes]
+        duplicate_of = matches[0] if all(matches) else None
+        self.duplicate_index.add(guild_id, message.id, hashes)
+        try:
+            await self.submission_store.add_hashes(guild_id, message.id, hashes)
+            if duplicate_of:
+                await self.submission_store.mark_duplicate(message.id, duplicate_of)
+        except Exception as e:
+            log.error(f"❌ Error saving media hashes for message {message.id}: {e}")
+            return
+
+        if duplicate_of:
+            self.duplicate_index.flagged += 1
+            log.info(f"♻️ Message {message.id} in guild {guild_id} looks like a repost of {duplicate_of}")
+            original_url = f"https://discord.com/channels/{guild_id}/{message.channel.id}/{duplicate_of}"
+            try:
+                await self.sender.send(message.channel, priority=DiscordSender.LOW,
+                                       content=f"♻️ This looks like a repost of {original_url}, "
+                                               f"so it won't be picked for a showcase.",
+                                       delete_after=30)
+            except Exception as e:
+                log.warning(f"⚠️ Could not send repost notice: {e}")
+
+    async def optimize_media(self, media_item: MediaItem, target_bytes: int, guild_id: Optional[int]) -> MediaItem:
+        """
+        Recompress an image or transcode a video in the process pool so it fits in
+        ``target_bytes``, depending on the guild's policy. Returns the original item
+        if optimization is off, not needed, unavailable or doesn't help.
+        """
+        policy = self.media_optimization_policy(guild_id)
+        if policy == "off" or (policy == "oversized" and media_item.size <= target_bytes):
+            return media_item
+        if not self.can_process_media(media_item.file_ext):
+            return media_item
+
+        stats = self.optimization_stats.setdefault(guild_id or 0, {"optimized": 0, "failed": 0, "bytes_saved": 0})
+        started = time.monotonic()
+        try:
+            optimized = await self._optimize_in_pool(media_item, target_bytes)
+            if optimized is None or optimized.size >= media_item.size:
+                if optimized:
+                    optimized.close()
+                stats["failed"] += 1
+                return media_item
+        except Exception as e:
+            log.warning(f"⚠️ Could not optimize media: {e}")
+            stats["failed"] += 1
+            return media_item
+
+        saved = media_item.size - optimized.size
+        stats["optimized"] += 1
+        stats["bytes_saved"] += saved
+        log.info(f"🗜️ Optimized {media_item.file_ext} from {media_item.size} to {optimized.size} bytes "
+                 f"in {time.monotonic() - started:.1f}s")
+        media_item.close()
+        return optimized
+
+    async def _optimize_in_pool(self, media_item: MediaItem, target_bytes: int) -> Optional[MediaItem]:
+        """
+        Run Pillow on an image or ffmpeg on a video in the process pool, returning the
+        smaller copy. Both ends stay on disk so big media isn't held in memory here.
+        """
+        loop = asyncio.get_running_loop()
+        work_dir = Path(await asyncio.to_thread(tempfile.mkdtemp, prefix="boomerbox_"))
+        try:
+            source = await self.media_source_path(media_item, work_dir)
+            if media_item.file_ext in IMAGE_EXTENSIONS:
+                file_ext = await loop.run_in_executor(
+                    self.media_pool, optimize_image, str(source), str(work_dir / "optimized"), target_bytes)
+            else:
+                ok = await loop.run_in_executor(
+                    self.media_pool, transcode_video, str(source), str(work_dir / "optimized.mp4"), target_bytes)
+                file_ext = ".mp4" if ok else None
+            if file_ext is None:
+                return None
+            destination = work_dir / f"optimized{file_ext}"
+
+            # Copy into an anonymous temp file so the work directory can go straight away
+            def load_result():
+                result = tempfile.TemporaryFile()
+                with open(destination, "rb") as f:
+                    shutil.copyfileobj(f, result)
+                size = result.tell()
+                result.seek(0)
+                return result, size
+            data, size = await asyncio.to_thread(load_result)
+            return MediaItem(item_num=media_item.item_num, file_ext=file_ext, size=size, data=data)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    async def prepare_media_item(self, download_url: Optional[str], item_num: int, total_items: int,
+                                 guild: Optional[discord.Guild], cache_key: Optional[str] = None,
+                                 retry_budget: Optional[RetryBudget] = None) -> Optional[MediaItem]:
+        """
+        Fetch a media item and get it under the guild's upload limit, optimizing it if
+        the guild allows. Raises MediaTooLargeError if it still doesn't fit.
+        """
+        upload_limit = get_upload_limit(guild)
+        guild_id = guild.id if guild else None
+
+        optimizing = self.media_optimization_policy(guild_id) != "off"
 
-            # Determine file extension from URL
-            file_ext = ".mp4"  # Default to mp4
-            if ".jpg" in download_url or ".jpeg" in download_url:
-                file_ext = ".jpg"
-            elif ".png" in download_url:
-                file_ext = ".png"
+        def max_bytes_for(file_ext: str) -> int:
+            # Only allow bigger downloads if this kind of file can be shrunk afterwards
+            if optimizing and self.can_process_media(file_ext):
+                return max(upload_limit, self.media_optimize_max_bytes)
+            return upload_limit
 
-            filename = f"instagram_media{f'_{item_num}' if total_items > 1 else ''}{file_ext}"
+        media_item = await self.fetch_media_item(download_url, item_num, total_items, cache_key,
+                                                 max_bytes=upload_limit, retry_budget=retry_budget,
+                                                 max_bytes_for=max_bytes_for)
+        if not media_item:
+            return None
 
-            # Create Discord file object
-            discord_file = discord.File(media_data, filename=filename)
+        media_item = await self.optimize_media(media_item, upload_limit, guild_id)
+        if media_item.size > upload_limit:
+            media_item.close()
+            raise MediaTooLargeError(media_item.size, upload_limit)
+        return media_item
+
+    async def delete_original(self, original_message: discord.Message, job_id: Optional[int] = None):
+        """Delete a submission once its media has been reposted."""
+        try:
+            await self.sender.delete(original_message)
+            log.info(f"✅ Deleted original message from {original_message.author}")
+            if job_id:
+                await self.ingest_journal.mark_original_deleted(job_id)
+        except discord.Forbidden:
+            log.warning("⚠️ Missing permissions to delete message")
+        except Exception as e:
+            log.warning(f"⚠️ Could not delete original message: {e}")
+
+    async def download_and_post(self, original_message: discord.Message, download_url: Optional[str],
+                                status_msg: Optional[discord.Message] = None,
+                                item_num: int = 0, total_items: int = 1, source: str = "Media",
+                                cache_key: Optional[str] = None, retry_budget: Optional[RetryBudget] = None,
+                                job_id: Optional[int] = None, already_posted: bool = False,
+                                refresh_link: Optional[Callable[[int], Awaitable[Optional[str]]]] = None) -> bool:
+        """
+        Download media and post it as a Discord attachment. Returns True once it has been posted.
+        If the download fails and ``refresh_link`` is given, it is asked for a new link to try once more.
+        """
+        try:
+            if already_posted:
+                if item_num == total_items or total_items == 1:
+                    await self.delete_original(original_message, job_id)
+                return True
+
+            try:
+                media_item = await self.prepare_media_item(download_url, item_num or 1, total_items,
+                                                           original_message.guild, cache_key,
+                                                           retry_budget=retry_budget)
+                if not media_item and refresh_link:
+                    download_url = await refresh_link(item_num or 1)
+                    if download_url:
+                        media_item = await self.prepare_media_item(download_url, item_num or 1, total_items,
+                                                                   original_message.guild, cache_key,
+                                                                   retry_budget=retry_budget)
+            except MediaTooLargeError as e:
+                if status_msg:
+                    await self.sender.edit(status_msg, content=f"❌ Media is too large to upload here ({e}).")
+                return False
+
+            if not media_item:
+                if status_msg:
+                    await self.sender.edit(status_msg, content="❌ Failed to download media.")
+                return False
+            if job_id:
+                await self.ingest_journal.mark_items(job_id, [item_num or 1], "downloaded")
+            media_hash = await self.hash_media_item(media_item)
 
             # Post the media with attribution
-            content = f"📹 Instagram content from {original_message.author.mention}"
+            content = f"📹 {source} from {original_message.author.mention}"
             if total_items > 1:
                 content += f" (Item {item_num}/{total_items})"
 
-            await original_message.channel.send(content=content, file=discord_file)
+            upload_started = time.monotonic()
+            upload_outcome = "failed"
+            try:
+                posted_message = await self.sender.send(original_message.channel, priority=DiscordSender.HIGH,
+                                                        content=content, file=media_item.to_discord_file(total_items))
+                upload_outcome = "ok"
+            finally:
+                media_item.close()
+                UPLOADS.inc(kind="single", outcome=upload_outcome)
+                UPLOAD_LATENCY.observe(time.monotonic() - upload_started, kind="single", outcome=upload_outcome)
+            if job_id:
+                await self.ingest_journal.mark_items(job_id, [item_num or 1], "posted")
+            await self.record_media_hashes(posted_message, [media_hash])
 
             # If this is the last item, delete the original message
             if item_num == total_items or total_items == 1:
+                await self.delete_original(original_message, job_id)
+            return True
+
+        except Exception as e:
+            log.error(f"❌ Error posting media: {e}")
+            if status_msg:
+                await self.sender.edit(status_msg, content=f"❌ Error posting media: {str(e)}")
+            return False
+
+    async def download_and_post_carousel(self, original_message: discord.Message, download_urls: List[Optional[str]],
+                                         status_msg: Optional[discord.Message] = None,
+                                         cache_key: Optional[str] = None, source: str = "Media",
+                                         retry_budget: Optional[RetryBudget] = None,
+                                         job_id: Optional[int] = None,
+                                         already_posted: Optional[set] = None,
+                                         refresh_link: Optional[Callable[[int], Awaitable[Optional[str]]]] = None
+                                         ) -> bool:
+        """
+        Download every carousel item in parallel, then post them in order, packing as many
+        items per message as Discord allows. The original message is only deleted once
+        every item has been posted. Items in ``already_posted`` (from a resumed job) are
+        skipped, and failed downloads are tried once more with a link from ``refresh_link``
+        if it's given. Returns True if every item has been posted.
+        """
+        already_posted = already_posted or set()
+        total_items = len(download_urls)
+        size_limit = get_upload_limit(original_message.guild)
+        semaphore = asyncio.Semaphore(self.carousel_concurrency)
+        media_hashes: Dict[int, Optional[int]] = {}
+
+        async def fetch(idx: int, download_url: Optional[str]) -> Optional[MediaItem]:
+            async with semaphore:
                 try:
-                    await original_message.delete()
-                    print(f"✅ Deleted original message from {original_message.author}")
-                except discord.Forbidden:
-                    print("⚠️ Missing permissions to delete message")
+                    media_item = await self.prepare_media_item(download_url, idx + 1, total_items,
+                                                               original_message.guild, cache_key,
+                                                               retry_budget=retry_budget)
+                    if not media_item and refresh_link:
+                        download_url = await refresh_link(idx + 1)
+                        if download_url:
+                            media_item = await self.prepare_media_item(download_url, idx + 1, total_items,
+                                                                       original_message.guild, cache_key,
+                                                                       retry_budget=retry_budget)
                 except Exception as e:
-                    print(f"⚠️ Could not delete original message: {e}")
+                    log.error(f"❌ Error downloading carousel item {idx + 1}/{total_items}: {e}")
+                    return None
+                if media_item:
+                    if job_id:
+                        await self.ingest_journal.mark_items(job_id, [idx + 1], "downloaded")
+                    media_hashes[idx + 1] = await self.hash_media_item(media_item)
+                return media_item
 
-        except Exception as e:
-            print(f"❌ Error posting media: {e}")
+        pending = [(idx, url) for idx, url in enumerate(download_urls) if idx + 1 not in already_posted]
+        media_items = await asyncio.gather(*(fetch(idx, url) for idx, url in pending))
+        downloaded = [item for item in media_items if item]
+        failed = len(pending) - len(downloaded)
+
+        if pending and not downloaded:
             if status_msg:
-                await status_msg.edit(content=f"❌ Error posting media: {str(e)}")
+                await self.sender.edit(status_msg, content="❌ Failed to download media.")
+            return False
+
+        # Pack items into messages, keeping to the per-message file and size limits
+        batches: List[List[MediaItem]] = []
+        batch_size = 0
+        for item in downloaded:
+            if not batches or len(batches[-1]) >= MAX_FILES_PER_MESSAGE or batch_size + item.size > size_limit:
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(item)
+            batch_size += item.size
+
+        posted = len(already_posted)
+        for batch in batches:
+            first, last = batch[0].item_num, batch[-1].item_num
+            items_label = f"Item {first}" if first == last else f"Items {first}-{last}"
+            content = f"📹 {source} from {original_message.author.mention} ({items_label}/{total_items})"
+            upload_started = time.monotonic()
+            upload_outcome = "failed"
+            try:
+                posted_message = await self.sender.send(
+                    original_message.channel,
+                    priority=DiscordSender.HIGH,
+                    content=content,
+                    files=[item.to_discord_file(total_items) for item in batch]
+                )
+                upload_outcome = "ok"
+                posted += len(batch)
+                if job_id:
+                    await self.ingest_journal.mark_items(job_id, [item.item_num for item in batch], "posted")
+                await self.record_media_hashes(posted_message, [media_hashes.get(item.item_num) for item in batch])
+            except Exception as e:
+                log.error(f"❌ Error posting carousel {items_label.lower()}: {e}")
+            finally:
+                for item in batch:
+                    item.close()
+                UPLOADS.inc(kind="carousel", outcome=upload_outcome)
+                UPLOAD_LATENCY.observe(time.monotonic() - upload_started, kind="carousel", outcome=upload_outcome)
+
+        if posted == total_items:
+            await self.delete_original(original_message, job_id)
+            return True
+        if status_msg:
+            await self.sender.edit(status_msg, content=f"⚠️ Posted {posted}/{total_items} carousel items, "
+                                          f"{failed} failed to download. The original link was kept.")
+        return False
+
+# --- Cluster launcher ---
+
+async def fetch_gateway_info(token: str) -> Dict:
+    """Ask Discord for the recommended shard count and identify concurrency."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot",
+                               headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+def split_shards(shard_count: int, cluster_count: int) -> List[List[int]]:
+    """Split shards into contiguous ranges, one per cluster."""
+    cluster_count = max(1, min(cluster_count, shard_count))
+    per_cluster = -(-shard_count // cluster_count)
+    return [list(range(first, min(first + per_cluster, shard_count)))
+            for first in range(0, shard_count, per_cluster)]
+
+
+def run_cluster_launcher(token: str, cluster_count: int):
+    """
+    Run the bot as several processes, each owning a range of shards. Clusters are
+    started one after another so their shards don't identify at the same time,
+    and restarted with a backoff if they crash.
+    """
+    max_concurrency = 1
+    if os.environ.get("SHARD_COUNT"):
+        shard_count = int(os.environ["SHARD_COUNT"])
+    else:
+        info = asyncio.run(fetch_gateway_info(token))
+        shard_count = max(info["shards"], cluster_count)
+        max_concurrency = info.get("session_start_limit", {}).get("max_concurrency", 1)
+
+    clusters = split_shards(shard_count, cluster_count)
+    log.info(f"🧩 Launching {len(clusters)} cluster(s) for {shard_count} shard(s)")
+
+    processes: Dict[int, subprocess.Popen] = {}
+    started_at: Dict[int, float] = {}
+    backoff: Dict[int, float] = {}
+    restart_at: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(cluster_id: int):
+        shard_ids = clusters[cluster_id]
+        env = dict(os.environ, CLUSTER_ID=str(cluster_id), CLUSTER_COUNT="1",
+                   SHARD_COUNT=str(shard_count), SHARD_IDS=f"{shard_ids[0]}-{shard_ids[-1]}")
+        processes[cluster_id] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        started_at[cluster_id] = time.monotonic()
+        log.info(f"🚀 Started cluster {cluster_id} (shards {shard_ids[0]}-{shard_ids[-1]}, pid {processes[cluster_id].pid})")
+
+    def wait(seconds: float):
+        deadline = time.monotonic() + seconds
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(min(1.0, deadline - time.monotonic()))
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for cluster_id, shard_ids in enumerate(clusters):
+        if stopping:
+            break
+        spawn(cluster_id)
+        # Discord allows max_concurrency identifies every 5 seconds
+        wait(5 * -(-len(shard_ids) // max_concurrency))
+
+    while not stopping and processes:
+        now = time.monotonic()
+        for cluster_id, process in list(processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if code == 0:
+                log.info(f"ℹ️ Cluster {cluster_id} exited")
+                del processes[cluster_id]
+                continue
+            if cluster_id not in restart_at:
+                # Crashing straight after start backs off; a long run resets the delay
+                if now - started_at[cluster_id] > 300:
+                    backoff[cluster_id] = 5
+                else:
+                    backoff[cluster_id] = min(backoff.get(cluster_id, 2.5) * 2, 300)
+                restart_at[cluster_id] = now + backoff[cluster_id]
+                log.warning(f"⚠️ Cluster {cluster_id} exited with code {code}, restarting in {backoff[cluster_id]:.0f}s")
+            elif now >= restart_at[cluster_id]:
+                del restart_at[cluster_id]
+                spawn(cluster_id)
+        wait(1)
+
+    log.info("🛑 Stopping clusters...")
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for cluster_id, process in processes.items():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            log.warning(f"⚠️ Cluster {cluster_id} didn't stop, killing it")
+            process.kill()
+
 
 # --- Run the bot ---
 if __name__ == "__main__":
+    setup_logging()
+
+    cluster_count = int(os.environ.get("CLUSTER_COUNT", "1"))
+    if cluster_count > 1 and os.environ.get("CLUSTER_ID") is None:
+        launcher_token = os.environ.get("DISCORD_TOKEN")
+        if not launcher_token:
+            log.error("❌ Error: DISCORD_TOKEN not found in environment variables.")
+            exit(1)
+        run_cluster_launcher(launcher_token, cluster_count)
+        sys.exit(0)
+
     bot_options = {}
     debug_guild_ids = os.environ.get("DISCORD_DEBUG_GUILD_IDS")
     if debug_guild_ids:
-        print(f"🐛 Running in debug mode for guilds: {debug_guild_ids}")
+        log.info(f"🐛 Running in debug mode for guilds: {debug_guild_ids}")
         bot_options["debug_guilds"] = [int(gid) for gid in debug_guild_ids.split(",")]
 
     bot = BoomerBoxBot(**bot_options)
@@ -460,7 +4208,8 @@ if __name__ == "__main__":
         ctx: discord.ApplicationContext,
         submission_channel: discord.Option(discord.TextChannel, description="Channel where users submit posts"),
         showcase_channel: discord.Option(discord.TextChannel, description="Channel where featured posts are showcased"),
-        showcase_time: discord.Option(str, description="Time to showcase posts (HH:MM format, e.g., 14:30)", default="12:00")
+        showcase_time: discord.Option(str, description="Time to showcase posts (HH:MM format, e.g., 14:30)", default="12:00"),
+        timezone: discord.Option(str, description="Time zone for the showcase time (e.g., Europe/London)", required=False)
     ):
         """Configure the bot for this server."""
         guild_config = bot.get_guild_config(ctx.guild.id)
@@ -472,16 +4221,25 @@ if __name__ == "__main__":
             await ctx.respond("❌ Invalid time format. Please use HH:MM (e.g., 14:30).", ephemeral=True, delete_after=30)
             return
 
+        # Validate time zone
+        if timezone is not None and not is_valid_timezone(timezone):
+            await ctx.respond("❌ Unknown time zone. Please use a name like `Europe/London` or `America/New_York`.", ephemeral=True, delete_after=30)
+            return
+
         guild_config["submission_channel_id"] = submission_channel.id
         guild_config["showcase_channel_id"] = showcase_channel.id
         guild_config["showcase_time"] = showcase_time
-        bot.save_config()
+        if timezone is not None:
+            guild_config["timezone"] = timezone
+        bot.save_config(ctx.guild.id)
+        bot.start_backfill(submission_channel.id)
+        bot.schedule_showcase(ctx.guild.id)
 
         await ctx.respond(
             f"✅ Configuration updated!\n"
             f"📥 Submission channel: {submission_channel.mention}\n"
             f"🌟 Showcase channel: {showcase_channel.mention}\n"
-            f"⏰ Showcase time: {showcase_time} daily"
+            f"⏰ Showcase time: {showcase_time} daily ({get_timezone(guild_config.get('timezone'))})"
         , ephemeral=True, delete_after=15)
 
     @bot.slash_command(name="showcase_now", description="Immediately showcase a random post")
@@ -499,11 +4257,11 @@ if __name__ == "__main__":
         original_date = guild_config.get("last_showcase_date")
         guild_config["last_showcase_date"] = None
 
-        await bot.pick_and_showcase_post(ctx.guild.id)
+        await bot.pick_and_showcase_post(ctx.guild.id, use_staged=False)
 
         # Restore original date so daily task won't run again today
         guild_config["last_showcase_date"] = original_date
-        bot.save_config()
+        bot.save_config(ctx.guild.id)
 
         await ctx.respond("✅ Showcase posted!", ephemeral=True, delete_after=15)
 
@@ -548,7 +4306,7 @@ if __name__ == "__main__":
 
         embed.add_field(
             name="⏰ Showcase Time",
-            value=f"Daily at {guild_config.get('showcase_time', '12:00')}",
+            value=f"Daily at {guild_config.get('showcase_time', '12:00')} ({get_timezone(guild_config.get('timezone'))})",
             inline=True
         )
 
@@ -560,12 +4318,7 @@ if __name__ == "__main__":
         )
 
         # Calculate next showcase time
-        now = datetime.now()
-        showcase_time_str = guild_config.get('showcase_time', '12:00')
-        showcase_hour, showcase_minute = map(int, showcase_time_str.split(':'))
-        next_showcase_dt = now.replace(hour=showcase_hour, minute=showcase_minute, second=0, microsecond=0)
-        if now >= next_showcase_dt:
-            next_showcase_dt += timedelta(days=1)
+        next_showcase_dt = next_showcase_time(guild_config)
 
         embed.add_field(
             name="⏳ Next Showcase",
@@ -573,50 +4326,241 @@ if __name__ == "__main__":
             inline=False
         )
 
+        timing = bot.showcase_timings.get(ctx.guild.id)
+        if timing and timing["lateness"] is not None:
+            embed.add_field(
+                name="⏱️ Last Scheduled Showcase",
+                value=f"Posted {timing['lateness']:.1f}s after its slot (took {timing['duration']:.1f}s)",
+                inline=False
+            )
+
+        shard = bot.get_shard(ctx.guild.shard_id)
+        embed.add_field(
+            name="🧩 Shard",
+            value=(f"{ctx.guild.shard_id} of {bot.shard_count or 1}"
+                   + (f" (cluster {bot.cluster_id})" if bot.cluster_id is not None else "")
+                   + (f", {shard.latency * 1000:.0f} ms gateway latency" if shard else "")),
+            inline=False
+        )
+
+        queue_stats = bot.ingest_queue.stats()
+        embed.add_field(
+            name="📬 Ingest Queue",
+            value=(f"{queue_stats['depth']} queued ({bot.ingest_queue.guild_depth(ctx.guild.id)} from this server), "
+                   f"{queue_stats['active']}/{queue_stats['workers']} workers busy\n"
+                   f"Wait: {queue_stats['avg_wait']:.1f}s avg, {queue_stats['max_wait']:.1f}s max"),
+            inline=False
+        )
+
+        backend_lines = [
+            f"{b['name']}: {b['state']}"
+            + (f", {b['latency'] * 1000:.0f} ms" if b['latency'] is not None else "")
+            + f", {b['failures']}/{b['requests']} failed"
+            for b in bot.cobalt_pool.stats()
+        ]
+        embed.add_field(name="🛰️ Cobalt Backends", value="\n".join(backend_lines) or "None configured", inline=False)
+
+        cache_stats = bot.media_cache.stats()
+        embed.add_field(
+            name="♻️ Media Cache",
+            value=(f"Cobalt: {cache_stats['cobalt_hits']} hits / {cache_stats['cobalt_misses']} misses\n"
+                   f"Media: {cache_stats['media_hits']} hits / {cache_stats['media_misses']} misses, "
+                   f"{cache_stats['media_files']} files ({cache_stats['media_bytes'] / 1024 / 1024:.1f} MB), "
+                   f"{cache_stats['evictions']} evicted"),
+            inline=False
+        )
+
+        sender_stats = bot.sender.stats()
+        embed.add_field(
+            name="📨 Discord Requests",
+            value=(f"{sender_stats['sent']} sent, {sender_stats['queued']} queued, "
+                   f"{sender_stats['coalesced_edits']} status edits merged\n"
+                   f"429s: {sender_stats['rate_limited']} ({sender_stats['global_rate_limited']} global), "
+                   f"queue wait {sender_stats['avg_queued']:.2f}s avg / {sender_stats['max_queued']:.2f}s max"),
+            inline=False
+        )
+
+        download_stats = bot.download_stats
+        embed.add_field(
+            name="📥 Downloads",
+            value=(f"{download_stats['downloads']} ok, {download_stats['failed']} failed, "
+                   f"{download_stats['retries']} retries, "
+                   f"{download_stats['resumed_bytes'] / 1024 / 1024:.1f} MB resumed"),
+            inline=False
+        )
+
+        quality_stats = bot.quality_memory.stats()
+        start_tiers = ", ".join(f"{platform} at {limit / 1024 / 1024:.0f} MB: {label}"
+                                for (platform, limit), label in list(quality_stats["start_tiers"].items())[:8])
+        embed.add_field(
+            name="📉 Adaptive Quality",
+            value=(f"{'On' if bot.adaptive_quality else 'Off'}: {quality_stats['step_downs']} step-down(s), "
+                   f"{quality_stats['link_hits']} repeat link(s) sent straight to their tier\n"
+                   f"Starting tiers: {start_tiers or 'top quality everywhere'}"),
+            inline=False
+        )
+
+        optimization = bot.optimization_stats.get(ctx.guild.id, {"optimized": 0, "failed": 0, "bytes_saved": 0})
+        total_saved = sum(stats["bytes_saved"] for stats in bot.optimization_stats.values())
+        embed.add_field(
+            name="🗜️ Media Optimization",
+            value=(f"Policy: {bot.media_optimization_policy(ctx.guild.id)} "
+                   f"(images: {'yes' if Image is not None else 'no Pillow'}, "
+                   f"videos: {'yes' if bot.ffmpeg_available else 'no ffmpeg'})\n"
+                   f"{optimization['optimized']} optimized, {optimization['failed']} failed, "
+                   f"{optimization['bytes_saved'] / 1024 / 1024:.1f} MB saved here "
+                   f"({total_saved / 1024 / 1024:.1f} MB overall)"),
+            inline=False
+        )
+
+        duplicate_stats = bot.duplicate_index.stats()
+        embed.add_field(
+            name="🧬 Duplicate Detection",
+            value=(f"{'On' if bot.duplicate_detection else 'Off'}: {duplicate_stats['hashes']} hash(es) "
+                   f"for {duplicate_stats['messages']} submission(s), "
+                   f"{duplicate_stats['flagged']} repost(s) flagged since start"),
+            inline=False
+        )
+
+        memory_stats = bot.memory_budget.stats()
+        embed.add_field(
+            name="🧠 Media Memory",
+            value=(f"{memory_stats['reserved'] / 1024 / 1024:.1f} MB in use, "
+                   f"peak {memory_stats['peak'] / 1024 / 1024:.1f} MB of {memory_stats['limit'] / 1024 / 1024:.0f} MB\n"
+                   f"{memory_stats['waiting']} waiting, {memory_stats['waits']} waits, {memory_stats['spills']} spilled to disk"),
+            inline=False
+        )
+
         await ctx.respond(embed=embed, ephemeral=True, delete_after=60)
 
+    @bot.slash_command(name="diagnostics", description="Show event loop lag, blocking calls and task counts")
+    @commands.has_permissions(administrator=True)
+    async def diagnostics_command(ctx: discord.ApplicationContext):
+        """Show event loop health for profiling in production."""
+        embed = discord.Embed(title="🩺 BoomerBox Diagnostics", color=discord.Color.dark_teal(), timestamp=datetime.now())
+        monitor = bot.loop_monitor
+
+        if monitor is None:
+            embed.description = "The event loop monitor is disabled (`LOOP_MONITOR=false`)."
+        else:
+            lag = monitor.stats()
+            embed.add_field(
+                name="⏱️ Event Loop Lag",
+                value=(f"p50 {lag['p50'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms, "
+                       f"max {lag['max'] * 1000:.1f} ms\n"
+                       f"over the last {lag['samples'] * monitor.interval / 60:.0f} min "
+                       f"({lag['samples']} samples every {monitor.interval * 1000:.0f} ms)"),
+                inline=False
+            )
+
+            blocked = f"{lag['blocks']} stall(s) over {monitor.threshold * 1000:.0f} ms since start"
+            if monitor.last_block and monitor.last_block_at:
+                blocked += f", last <t:{int(monitor.last_block_at)}:R> at `{monitor.last_block.callsite}`"
+            embed.add_field(name="🐢 Blocked Loop", value=blocked, inline=False)
+
+            offenders = monitor.worst_offenders()
+            if offenders:
+                embed.add_field(
+                    name="🏆 Worst Offenders",
+                    value="\n".join(
+                        f"`{b.callsite}` {b.task[:40]}: {b.count}x, worst {b.worst * 1000:.0f} ms, "
+                        f"total {b.total * 1000:.0f} ms"
+                        for b in offenders
+                    )[:1024],
+                    inline=False
+                )
+                embed.add_field(name="📜 Worst Stack", value=f"```\n{offenders[0].stack[-1000:]}\n```", inline=False)
+
+        tasks = asyncio.all_tasks()
+        by_coroutine: Dict[str, int] = {}
+        for task in tasks:
+            name = getattr(task.get_coro(), "__qualname__", "?")
+            by_coroutine[name] = by_coroutine.get(name, 0) + 1
+        busiest = sorted(by_coroutine.items(), key=lambda item: item[1], reverse=True)[:5]
+        queue_stats = bot.ingest_queue.stats()
+        embed.add_field(
+            name="🧵 Tasks",
+            value=(f"{len(tasks)} asyncio task(s), {threading.active_count()} thread(s)\n"
+                   + "\n".join(f"`{name}`: {count}" for name, count in busiest)
+                   + f"\nIngest: {queue_stats['active']}/{queue_stats['workers']} busy, {queue_stats['depth']} queued; "
+                   f"Discord: {bot.sender.stats()['queued']} queued"),
+            inline=False
+        )
+
+        caches = bot.cache_report()
+        embed.add_field(
+            name="📦 Library Caches",
+            value=(f"{'Lean' if bot.lean_gateway else 'Default'} gateway mode: {caches['guilds']} guild(s), "
+                   f"{caches['channels']} channel(s), {caches['members']} member(s), {caches['users']} user(s), "
+                   f"{caches['messages']} message(s) (limit {caches['message_cache_limit'] or 'off'})\n"
+                   f"{caches['dropped_events']} message event(s) dropped outside submission channels"
+                   + (f"; RSS {caches['rss_mb']:.0f} MB" if caches["rss_mb"] is not None else "")),
+            inline=False
+        )
+
+        await ctx.respond(embed=embed, ephemeral=True)
+
     @bot.slash_command(name="settings", description="Modify bot settings for this server")
     @commands.has_permissions(manage_guild=True)
     async def settings_command(
         ctx: discord.ApplicationContext,
         showcase_time: discord.Option(str, description="Time to showcase posts (HH:MM format, e.g., 14:30)", required=False),
-        delete_after_showcase: discord.Option(bool, description="Delete submission after it's showcased?", required=False)
+        delete_after_showcase: discord.Option(bool, description="Delete submission after it's showcased?", required=False),
+        timezone: discord.Option(str, description="Time zone for the showcase time (e.g., Europe/London)", required=False),
+        media_optimization: discord.Option(str, description="Recompress media to fit the upload limit",
+                                           choices=list(MEDIA_OPTIMIZATION_POLICIES), required=False)
     ):
         """Modify bot settings for this server."""
         guild_config = bot.get_guild_config(ctx.guild.id)
         updated_settings = []
 
+        # Validate everything before changing anything, so a bad option leaves the config untouched
+        if timezone is not None and not is_valid_timezone(timezone):
+            await ctx.respond("❌ Unknown time zone for `timezone`. Please use a name like `Europe/London`.", ephemeral=True, delete_after=30)
+            return
+
         if showcase_time is not None:
             # Validate time format
             try:
                 datetime.strptime(showcase_time, "%H:%M")
-                guild_config["showcase_time"] = showcase_time
-                updated_settings.append(f"⏰ Showcase time updated to **{showcase_time}** daily.")
             except ValueError:
                 await ctx.respond("❌ Invalid time format for `showcase_time`. Please use HH:MM (e.g., 14:30).", ephemeral=True, delete_after=30)
                 return
 
+        if timezone is not None:
+            guild_config["timezone"] = timezone
+            updated_settings.append(f"🌍 Time zone updated to **{timezone}**.")
+
+        if showcase_time is not None:
+            guild_config["showcase_time"] = showcase_time
+            updated_settings.append(f"⏰ Showcase time updated to **{showcase_time}** daily.")
+
         if delete_after_showcase is not None:
             guild_config["delete_after_showcase"] = delete_after_showcase
             status = "✅ Enabled" if delete_after_showcase else "❌ Disabled"
             updated_settings.append(f"🗑️ Delete after showcase is now {status}.")
 
+        if media_optimization is not None:
+            guild_config["media_optimization"] = media_optimization
+            updated_settings.append(f"🗜️ Media optimization set to **{media_optimization}**.")
+
         if not updated_settings:
             await ctx.respond("ℹ️ You didn't specify any settings to change. Use the options to modify settings.", ephemeral=True, delete_after=30)
             return
 
-        bot.save_config()
+        bot.save_config(ctx.guild.id)
+        bot.schedule_showcase(ctx.guild.id)
 
         await ctx.respond("✅ Settings updated!\n" + "\n".join(updated_settings), ephemeral=True, delete_after=30)
 
     discord_token = os.environ.get("DISCORD_TOKEN")
     if not discord_token:
-        print("❌ Error: DISCORD_TOKEN not found in environment variables.")
+        log.error("❌ Error: DISCORD_TOKEN not found in environment variables.")
         exit(1)
 
-    if not bot.cobalt_url:
-        print("❌ Error: COBALT_API_URL not found in environment variables.")
+    if not bot.cobalt_pool.backends:
+        log.error("❌ Error: COBALT_API_URL not found in environment variables.")
         exit(1)
 
-    print("Starting BoomerBox Bot...")
+    log.info("Starting BoomerBox Bot...")
     bot.run(discord_token)